@@ -14,9 +14,18 @@ CREATE TABLE external_kbs (
     list_wikiDataClass  TEXT,
     list_dbPediaType    TEXT,
     list_conceptNetType TEXT,
-    ts                  TIMESTAMP
+    ts                  TIMESTAMP,
+    ts_wikifier         TIMESTAMP,
+    ts_wikidata         TIMESTAMP,
+    ts_conceptnet       TIMESTAMP,
+    retry_wikifier      TIMESTAMP,
+    retry_wikidata      TIMESTAMP,
+    retry_conceptnet    TIMESTAMP
 );
 
+-- Index: idx_external_kbs_item
+CREATE INDEX idx_external_kbs_item ON external_kbs (item);
+
 
 -- Table: sentences
 CREATE TABLE sentences (
@@ -32,6 +41,15 @@ CREATE TABLE sentences (
 );
 
 
+-- Table: ingest_journal
+CREATE TABLE ingest_journal (
+    input_file     TEXT,
+    byte_offset    INTEGER,
+    sentence_uuids TEXT,
+    ts             TIMESTAMP
+);
+
+
 -- View: vw_sentences
 CREATE VIEW vw_sentences AS
     SELECT a.sentence_uuid,
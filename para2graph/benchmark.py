@@ -0,0 +1,260 @@
+#----------------------------#
+# Author: Surjit Das
+# Email: surjitdas@gmail.com
+# Program: artmind
+#----------------------------#
+
+'''
+Benchmarks the processing stages on the corpora in data/, with the external kbs & neo4j replaced by in-memory stand-ins,
+so that the numbers only depend on the code and can be compared from one change to the next.
+
+The parsing is taken out of the loop too: record parses the corpora once with the spaCy model (incl. the re-parses done by
+the apostrophe pre-processing) and saves the docs in a DocBin. run replays the docs, so no model gets loaded.
+
+    python benchmark.py record docs.spacy                        # once, needs C.SPACY_MODEL
+    python benchmark.py run docs.spacy --save-baseline base.json # on the reference code
+    python benchmark.py run docs.spacy --baseline base.json      # on the changed code, exits with 1 on a regression
+
+--stage all runs extract_doc + write for every doc, sentencer only the sentencer & triplets the triplet builders
+(token rows, sentencer, phrase & kb triplets), without the pre-processing
+'''
+
+import constants as C
+from loguru import logger as log
+import argparse
+import json
+import os
+import resource
+import sqlite3
+import sys
+import time
+import uuid
+import spacy
+from spacy.tokens import DocBin
+from metrics import metrics
+from textprocessor import TextProcessor
+from p2g_dataclasses import SentenceTable
+from graph_writer import Neo4jGraphWriter
+import wordnet_explorer
+
+STAGES = ["all", "sentencer", "triplets"]
+
+class RecordingNLP:
+    """
+    Wraps the nlp model and keeps every doc it makes
+    """
+    def __init__(self, nlp):
+        self.nlp = nlp
+        self.docs = []
+
+    def __call__(self, text):
+        doc = self.nlp(text)
+        self.docs.append(doc)
+        return doc
+
+    def pipe(self, texts, **kwargs):
+        for doc in self.nlp.pipe(texts, **kwargs):
+            self.docs.append(doc)
+            yield doc
+
+class ReplayNLP:
+    """
+    Stands in for the nlp model by returning the recorded doc of a text
+    """
+    def __init__(self, docs):
+        self.docs = {doc.text:doc for doc in docs}
+
+    def __call__(self, text):
+        try:
+            return self.docs[text]
+        except KeyError:
+            raise KeyError(f"No recorded doc for {text=}, record the docs again") from None
+
+    def pipe(self, texts, **kwargs):
+        for text in texts:
+            yield self(text)
+
+class MemoryKBs:
+    """
+    Stands in for the external kbs (Explorer) with made up, deterministic kb info
+    """
+    def get_ext_kb_info_many(self, texts):
+        return {text:{C.COL_WIKIDATACLASS:[f"{text} class"], C.COL_DBPEDIA:[f"{text} type"],
+                        C.COL_WDINSTANCE:[f"{text} instance"], C.COL_CONCEPTNET:[]} for text in texts}
+
+class MemoryCursor:
+    def data(self):
+        return []
+
+class MemoryTx:
+    def run(self, cypher, **params):
+        return MemoryCursor()
+
+class MemoryGraph:
+    """
+    Stands in for the py2neo Graph. The queries are built & grouped as usual, but go nowhere
+    """
+    def begin(self):
+        return MemoryTx()
+
+    def commit(self, tx):
+        pass
+
+    def run(self, cypher, **params):
+        return MemoryCursor()
+
+def make_tp(nlp):
+    '''
+    Returns a TextProcessor using the stand-ins & an in-memory sqlite3 db
+    '''
+    tp = TextProcessor(mode=None, extract=False, write=False)
+    tp.nlp = nlp
+    tp.kbs = MemoryKBs()
+    tp.db = sqlite3.connect(":memory:")
+    tp.G_n4j = MemoryGraph()
+    tp.graph_writer = Neo4jGraphWriter(tp.G_n4j)
+    tp.sentence_table = SentenceTable(tp.db)
+    return tp
+
+def corpus_lines(corpora):
+    for corpus in corpora:
+        with open(corpus) as fp:
+            for line in fp:
+                if line.strip() != "":
+                    yield line.strip()
+
+def record(filepath, corpora, model=C.SPACY_MODEL):
+    '''
+    Parses the corpora with the model & saves all the docs, incl. the re-parses of the apostrophe pre-processing, to a DocBin
+    '''
+    nlp = RecordingNLP(spacy.load(model))
+    tp = make_tp(nlp)
+    for doc in nlp.pipe(corpus_lines(corpora)):
+        for sentence in doc.sents:
+            tp.preprocess_sentence_for_apostrophe(sentence)
+    DocBin(docs=nlp.docs).to_disk(filepath)
+    log.info(f"Recorded {len(nlp.docs)} docs to {filepath}")
+
+def load_docs(filepath, corpora):
+    '''
+    Returns the ReplayNLP of the recorded docs & the docs of the corpus lines, in order
+    '''
+    nlp = ReplayNLP(DocBin().from_disk(filepath).get_docs(spacy.blank("en").vocab))
+    return nlp, [nlp(line) for line in corpus_lines(corpora)]
+
+def run_stage(tp, docs, stage):
+    '''
+    Runs the stage over the docs once. Returns the number of sentences
+    '''
+    sentences = 0
+    for doc in docs:
+        if stage == "all":
+            for record in tp.extract_doc(doc):
+                tp.write(record)
+                sentences += 1
+            continue
+        for sentence in doc.sents:
+            sentence_uuid = str(uuid.uuid4())
+            if stage == "sentencer":
+                with metrics.timer("sentencer"):
+                    tp.sentencer(sentence_uuid, sentence)
+            else:
+                with metrics.timer("token_rows"):
+                    token_rows, ners, nouns, adjs, verbs = SentenceTable.token_rows(sentence_uuid, sentence)
+                    deduped_nouns = tp.dedup_nouns_from_ners(nouns, ners)
+                with metrics.timer("sentencer"):
+                    ph_3plets = tp.sentencer(sentence_uuid, sentence)
+                with metrics.timer("phrase_3plets"):
+                    tp.construct_phrase_3plets(ners, deduped_nouns, adjs, verbs, ph_3plets)
+                tp.constuct_kb_3plets(ners, deduped_nouns, adjs, verbs)
+            sentences += 1
+    if stage == "all":
+        tp.flush()
+    return sentences
+
+def peak_rss_mb():
+    # ru_maxrss is in KB on linux, in bytes on macOS
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss / (1024 * 1024) if sys.platform == "darwin" else maxrss / 1024
+
+def benchmark(filepath, corpora, stage, repeat=C.BENCHMARK_REPEAT):
+    '''
+    Runs the stage repeat times over the recorded docs and returns the result of the fastest run
+    '''
+    nlp, docs = load_docs(filepath, corpora)
+    tp = make_tp(nlp)
+    metrics.enable()
+    best = None
+    for i in range(repeat):
+        metrics.reset()
+        start = time.perf_counter()
+        sentences = run_stage(tp, docs, stage)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best["seconds"]:
+            best = {"stage":stage, "sentences":sentences, "seconds":elapsed, "sentences_per_sec":sentences / elapsed,
+                    "stages":{name:s["total"] for name, s in metrics.summary()["stages"].items()}}
+    best["peak_rss_mb"] = peak_rss_mb()
+    return best
+
+def compare(result, baseline, threshold=C.BENCHMARK_THRESHOLD):
+    '''
+    Returns the regressions of the result against the baseline - a drop in sentences/sec or a growth in peak RSS beyond the threshold
+    '''
+    regressions = []
+    if result["sentences_per_sec"] < baseline["sentences_per_sec"] * (1 - threshold):
+        regressions.append(f"sentences/sec {result['sentences_per_sec']:.1f} vs baseline {baseline['sentences_per_sec']:.1f}")
+    if result["peak_rss_mb"] > baseline["peak_rss_mb"] * (1 + threshold):
+        regressions.append(f"peak RSS {result['peak_rss_mb']:.1f} MB vs baseline {baseline['peak_rss_mb']:.1f} MB")
+    return regressions
+
+def report(result):
+    lines = [f"{result['stage']}: {result['sentences']} sentences in {result['seconds']:.3f}s, "
+                f"{result['sentences_per_sec']:.1f} sentences/sec, peak RSS {result['peak_rss_mb']:.1f} MB"]
+    for name, total in result["stages"].items():
+        lines.append(f"  {name:<20}{total:>10.4f}s")
+    return "\n".join(lines)
+
+def parse_args():
+    here = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(description="Benchmarks the processing stages on recorded docs")
+    parser.add_argument("command", choices=["record", "run"])
+    parser.add_argument("docs", help="the DocBin file the docs are recorded to / replayed from")
+    parser.add_argument("--corpora", nargs="+", default=[os.path.join(here, corpus) for corpus in C.BENCHMARK_CORPORA])
+    parser.add_argument("--model", default=C.SPACY_MODEL, help="the spaCy model to record with")
+    parser.add_argument("--stage", choices=STAGES, default="all")
+    parser.add_argument("--repeat", type=int, default=C.BENCHMARK_REPEAT)
+    parser.add_argument("--wordnet-table", default=C.WORDNET_TABLE_PATH, help="use the WordNet table rather than NLTK's WordNet")
+    parser.add_argument("--baseline", help="the baseline json to compare with. Exits with 1 on a regression beyond --threshold")
+    parser.add_argument("--save-baseline", metavar="PATH", help="save the result as the baseline json")
+    parser.add_argument("--threshold", type=float, default=C.BENCHMARK_THRESHOLD)
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    if args.command == "record":
+        record(args.docs, args.corpora, args.model)
+        return 0
+
+    if args.wordnet_table is not None:
+        wordnet_explorer.load_table(args.wordnet_table)
+    result = benchmark(args.docs, args.corpora, args.stage, args.repeat)
+    print(report(result))
+    if args.save_baseline is not None:
+        with open(args.save_baseline, "w") as fp:
+            json.dump(result, fp, indent=2)
+    if args.baseline is not None:
+        with open(args.baseline) as fp:
+            baseline = json.load(fp)
+        if baseline["stage"] != result["stage"]:
+            print(f"The baseline is of --stage {baseline['stage']}, not {result['stage']}")
+            return 1
+        regressions = compare(result, baseline, args.threshold)
+        if len(regressions) > 0:
+            print(f"Regressions beyond {args.threshold:.0%}:\n" + "\n".join(regressions))
+            return 1
+        print(f"No regressions beyond {args.threshold:.0%} against {args.baseline}")
+    return 0
+
+if __name__=="__main__":
+    log.remove() # the per sentence debug logging would be benchmarked too
+    sys.exit(main())
@@ -0,0 +1,70 @@
+#----------------------------#
+# Author: Surjit Das
+# Email: surjitdas@gmail.com
+# Program: artmind
+#----------------------------#
+
+from collections import OrderedDict
+import threading
+import time
+
+class LRUCache:
+    """
+    A bounded in-memory cache. When full, the least recently used entry is evicted.
+    Optionally the entries expire after a time to live (ttl), after which they count as misses
+    """
+    def __init__(self, maxsize, ttl=None):
+        '''
+        :param maxsize: the max number of entries held
+        :param ttl: the time to live of an entry in seconds. None means the entries never expire
+        '''
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict() # key -> (value, expires_at)
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        '''
+        Returns the value for the key and marks it as most recently used. Returns default if the key is not there or expired
+        '''
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or (entry[1] is not None and entry[1] < time.monotonic()):
+                if entry is not None:
+                    del self.entries[key]
+                self.misses += 1
+                return default
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value):
+        '''
+        Adds or replaces the value for the key, evicting the least recently used entry if the cache is full
+        '''
+        expires_at = None if self.ttl is None else time.monotonic() + self.ttl
+        with self.lock:
+            self.entries[key] = (value, expires_at)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        '''
+        Removes the key, if it is there
+        '''
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def items(self):
+        '''
+        Returns the (key, value)s that have not expired, from the least to the most recently used
+        '''
+        now = time.monotonic()
+        with self.lock:
+            return [(key, entry[0]) for key, entry in self.entries.items() if entry[1] is None or entry[1] >= now]
+
+    def __len__(self):
+        return len(self.entries)
@@ -0,0 +1,190 @@
+#----------------------------#
+# Author: Surjit Das
+# Email: surjitdas@gmail.com
+# Program: artmind
+#----------------------------#
+
+import constants as C
+from loguru import logger as log
+from datetime import datetime
+import os
+import shutil
+import uuid
+
+'''
+An optional columnar copy of what gets extracted, for analytical scans (POS distributions, NER frequencies, ...) with
+vectorised tools (pyarrow, duckdb, polars, pandas) rather than going through vw_sentences in the sqlite3 db.
+Enabled with run.py --columnar <dir>. pyarrow is imported only then.
+
+Two datasets are written under the directory, hive partitioned by the date of the ingestion:
+    <dir>/tokens/date=YYYY-MM-DD/part-<run>-00000.parquet   - the rows of the sentences table (C.COLUMNS_SENTENCES)
+    <dir>/triplets/date=YYYY-MM-DD/part-<run>-00000.parquet - the phrase, NER/POS & kb edges (C.COLUMNS_TRIPLETS)
+e.g. pyarrow.dataset.dataset("<dir>/tokens", partitioning="hive") or duckdb's read_parquet('<dir>/tokens/*/*.parquet', hive_partitioning=1)
+
+The string columns, except the uuids & timestamps, are dictionary encoded. In Arrow IPC files, a column has one dictionary per part
+file, which each row group extends with its new values. The rows are buffered and written as a row group
+every C.COLUMNAR_ROW_GROUP_SIZE rows, and a new part file is started every C.COLUMNAR_PART_ROWS rows.
+A part file is written as a hidden .tmp file (which readers skip) and renamed once complete, so readers never see a half written file.
+A file run completes the part files at each checkpoint of the ingest journal (every C.COLUMNAR_SAVE_INTERVAL sentences), so that
+after a crash, --resume redoes exactly the rows that are not in a complete part file
+'''
+
+FORMATS = [C.COLUMNAR_FORMAT_PARQUET, C.COLUMNAR_FORMAT_ARROW]
+EXTENSIONS = {C.COLUMNAR_FORMAT_PARQUET:"parquet", C.COLUMNAR_FORMAT_ARROW:"arrow"}
+PLAIN_STRING_COLUMNS = [C.COL_SENT_UUID, C.COL_TS] # Unique per sentence / row, dictionary encoding would not pay off
+
+def schema(pa, columns):
+    return pa.schema([(column, pa.string() if column in PLAIN_STRING_COLUMNS else pa.dictionary(pa.int32(), pa.string()))
+                        for column in columns])
+
+class ColumnarDataset:
+    """
+    One dataset (tokens or triplets) - buffers its rows column wise and writes them out in row groups & part files
+    """
+    def __init__(self, pa, directory, columns, file_format, row_group_size, part_rows, run_id):
+        self.pa = pa
+        self.directory = directory
+        self.columns = columns
+        self.schema = schema(pa, columns)
+        self.file_format = file_format
+        self.row_group_size = row_group_size
+        self.part_rows = part_rows
+        self.run_id = run_id
+        self.part_no = 0
+        self.buffer = [[] for column in columns]
+        self.buffered = 0
+        self.writer = None
+        self.part_path = None
+        self.part_written = 0
+        self.part_dictionaries = {} # Arrow only: column -> {value: index} of the dictionary of the current part file
+
+    def add(self, rows):
+        '''
+        Adds rows (tuples in the order of the columns). Writes a row group once row_group_size rows are buffered
+        '''
+        for row in rows:
+            for values, value in zip(self.buffer, row):
+                values.append(value)
+        self.buffered += len(rows)
+        if self.buffered >= self.row_group_size:
+            self.flush()
+
+    def flush(self):
+        '''
+        Writes the buffered rows as a row group of the current part file
+        '''
+        if self.buffered == 0:
+            return
+        if self.writer is None:
+            self.open_part()
+        if self.file_format == C.COLUMNAR_FORMAT_PARQUET:
+            arrays = [self.pa.array(values, type=field.type) for values, field in zip(self.buffer, self.schema)]
+        else:
+            arrays = [self.pa.array(values, type=field.type) if field.name in PLAIN_STRING_COLUMNS
+                        else self.part_dictionary_array(field, values) for values, field in zip(self.buffer, self.schema)]
+        table = self.pa.Table.from_arrays(arrays, schema=self.schema)
+        if self.file_format == C.COLUMNAR_FORMAT_PARQUET:
+            self.writer.write_table(table, row_group_size=self.buffered)
+        else:
+            self.writer.write_table(table, max_chunksize=self.buffered)
+        self.part_written += self.buffered
+        log.debug(f"Wrote a row group of {self.buffered} rows to {self.part_path}")
+        self.buffer = [[] for column in self.columns]
+        self.buffered = 0
+        if self.part_written >= self.part_rows:
+            self.close_part()
+
+    def part_dictionary_array(self, field, values):
+        '''
+        Dictionary encodes the values against the dictionary of the column in the current part file, adding the values not in it yet.
+        An Arrow IPC file allows a single dictionary per column, which later row groups may only extend (written as deltas)
+        '''
+        dictionary = self.part_dictionaries.setdefault(field.name, {})
+        indices = [None if value is None else dictionary.setdefault(value, len(dictionary)) for value in values]
+        return self.pa.DictionaryArray.from_arrays(self.pa.array(indices, type=field.type.index_type),
+                                                    self.pa.array(list(dictionary), type=field.type.value_type))
+
+    def open_part(self):
+        partition = os.path.join(self.directory, f"date={datetime.now().date().isoformat()}")
+        os.makedirs(partition, exist_ok=True)
+        self.part_path = os.path.join(partition, f"part-{self.run_id}-{self.part_no:05d}.{EXTENSIONS[self.file_format]}")
+        if self.file_format == C.COLUMNAR_FORMAT_PARQUET:
+            import pyarrow.parquet as pq
+            self.writer = pq.ParquetWriter(tmp_path(self.part_path), self.schema, use_dictionary=True, compression="zstd")
+        else:
+            self.writer = self.pa.ipc.new_file(tmp_path(self.part_path), self.schema,
+                                                options=self.pa.ipc.IpcWriteOptions(emit_dictionary_deltas=True))
+            self.part_dictionaries = {}
+        self.part_no += 1
+
+    def close_part(self):
+        if self.writer is None:
+            return
+        self.writer.close()
+        os.replace(tmp_path(self.part_path), self.part_path)
+        log.info(f"Wrote {self.part_written} rows to {self.part_path}")
+        self.writer = None
+        self.part_written = 0
+
+    def close(self):
+        self.flush()
+        self.close_part()
+
+class ColumnarWriter:
+    """
+    Writes the SentenceRecords to the tokens & triplets datasets
+    """
+    def __init__(self, directory, append=True, file_format=C.COLUMNAR_FORMAT, row_group_size=C.COLUMNAR_ROW_GROUP_SIZE,
+                    part_rows=C.COLUMNAR_PART_ROWS):
+        '''
+        :param directory: the directory under which the datasets are written
+        :param append: False deletes the datasets written before (mode truncate)
+        :param file_format: C.COLUMNAR_FORMAT_PARQUET | C.COLUMNAR_FORMAT_ARROW (Arrow IPC files)
+        :param row_group_size: the number of rows buffered per dataset before they get written as a row group
+        :param part_rows: the number of rows after which a new part file is started
+        '''
+        if file_format not in FORMATS:
+            raise ValueError(f"Unknown columnar format {file_format}, use one of {FORMATS}")
+        import pyarrow as pa
+        run_id = uuid.uuid4().hex[:8] # Keeps the part files of different runs apart, as append adds to the same partitions
+        self.datasets = {}
+        for name, columns in [(C.COLUMNAR_TOKENS, C.COLUMNS_SENTENCES), (C.COLUMNAR_TRIPLETS, C.COLUMNS_TRIPLETS)]:
+            dataset_dir = os.path.join(directory, name)
+            if not append and os.path.isdir(dataset_dir):
+                shutil.rmtree(dataset_dir)
+            self.datasets[name] = ColumnarDataset(pa, dataset_dir, columns, file_format, row_group_size, part_rows, run_id)
+
+    def add(self, record):
+        '''
+        Adds the token rows & the edges of a SentenceRecord
+        '''
+        self.datasets[C.COLUMNAR_TOKENS].add(record.token_rows)
+        ts = datetime.now().isoformat(sep=" ")
+        self.datasets[C.COLUMNAR_TRIPLETS].add([triplet_row(record.sentence_uuid, edge_row, ts) for edge_row in record.edge_rows])
+
+    def save(self):
+        '''
+        Writes the rows still buffered and completes the part files, e.g. at a checkpoint of the ingest journal.
+        The rows added after go to new part files
+        '''
+        for dataset in self.datasets.values():
+            dataset.close()
+
+    def close(self):
+        '''
+        Writes the rows still buffered and completes the part files
+        '''
+        self.save()
+
+def tmp_path(part_path):
+    # The leading dot hides the file from the dataset readers (pyarrow, duckdb globs) till it is complete
+    directory, name = os.path.split(part_path)
+    return os.path.join(directory, f".{name}.tmp")
+
+def triplet_row(sentence_uuid, edge_row, ts):
+    '''
+    Flattens an EdgeRow to a row in the order of C.COLUMNS_TRIPLETS
+    '''
+    return (sentence_uuid, edge_row.head_label, edge_row.head_key.get(C.N4J_NODE_NAME), edge_row.head_props.get(C.CLASSIFICATION),
+            edge_row.rel_type, edge_row.rel_props.get(C.CLASSIFICATION),
+            edge_row.tail_label, edge_row.tail_key.get(C.N4J_NODE_NAME), edge_row.tail_props.get(C.CLASSIFICATION), ts)
@@ -7,24 +7,82 @@
 SQL_LOCAL_DB = "/Users/surjitdas/Downloads/nlu_processor/nlu_processor_v2.db"
 SQL_EXT_KB_DB = "/Users/surjitdas/Downloads/nlu_processor/nlu_processor_v2.db" # The External_KBs table in the same db. Can be different if required
 LOG_PATH = '/Users/surjitdas/Downloads/nlu_processor/nlu_processor.log'
+METRICS_HISTOGRAM_PRECISION = 0.02 # Relative width of the buckets of the --profile timing histograms, i.e. the error of the percentiles
+BENCHMARK_CORPORA = ["../data/regression_test1.txt", "../data/HistoryOfIndia.txt"] # Relative to para2graph/
+BENCHMARK_REPEAT = 3 # Runs per benchmark, the fastest one is reported
+BENCHMARK_THRESHOLD = 0.10 # Fraction by which sentences/sec may drop (or peak RSS grow) against the baseline before the benchmark fails
 
 WIKIFIER_URL = "http://www.wikifier.org/annotate-article"
 WIKIDATA_API_ENDPOINT_URL = "https://www.wikidata.org/w/api.php"
 WIKIDATA_SPARQL_ENDPOINT_URL = "https://query.wikidata.org/sparql"
+WIKIDATA_SPARQL_BATCH_SIZE = 50 # entities per VALUES sparql query
 WIKIFIER_USER_KEY = "vvswrnlywccfgddhmprbdwviamhnuc"
 # CONCEPTNET_API_ENDPOINT_URL = "http://api.conceptnet.io/c/en/" not using the Web API, but directly the local database & API
 CONCEPTNET_LOCAL_DB = "/Volumes/Surjit_SSD_1/tech/conceptnet.db"
+CONCEPTNET_BATCH_SIZE = 500 # texts per is_a query, sqlite allows 999 parameters per statement on older builds
+
+KB_SOURCE_WIKIFIER = "wikifier"
+KB_SOURCE_WIKIDATA = "wikidata"
+KB_SOURCE_CONCEPTNET = "conceptnet"
+KB_MAX_CONCURRENCY = 8 # Max number of external kb requests in flight at the same time
+KB_TIMEOUTS = {KB_SOURCE_WIKIFIER:60, KB_SOURCE_WIKIDATA:30} # Per source http timeout in seconds
+KB_HTTP_POOL_SIZE = KB_MAX_CONCURRENCY # Connections kept alive per host
+KB_HTTP_RETRIES = 5 # Retries of a call failing with a connection error, 429 or 5xx
+KB_HTTP_BACKOFF = 0.5 # Retry backoff factor in seconds, doubles with each retry. A Retry-After from the server takes precedence
+KB_RATE_LIMITS = {KB_SOURCE_WIKIFIER:10, KB_SOURCE_WIKIDATA:5} # Per source max calls per second to each of its endpoints, shared by the --workers processes. None for no limit
+KB_CACHE_SIZE = 50000 # Max number of items whose external kb info is held in memory
+KB_CACHE_TTL = None # Seconds an item stays in the in-memory cache. None to keep it till it gets evicted
+# Freshness of the saved external kb info, per source, in seconds. None never expires (the local ConceptNet db does not change)
+# Negative results (nothing found) are kept for a shorter time than the positive ones. Failures are retried after KB_RETRY_TTL
+KB_POSITIVE_TTL = {KB_SOURCE_WIKIFIER:180*24*3600, KB_SOURCE_WIKIDATA:180*24*3600, KB_SOURCE_CONCEPTNET:None}
+KB_NEGATIVE_TTL = {KB_SOURCE_WIKIFIER:24*3600, KB_SOURCE_WIKIDATA:24*3600, KB_SOURCE_CONCEPTNET:None}
+# Seconds after which a source that failed (an error, unlike a not found) is tried again. Finite for every source, as a failure is transient
+KB_RETRY_TTL = {KB_SOURCE_WIKIFIER:24*3600, KB_SOURCE_WIKIDATA:24*3600, KB_SOURCE_CONCEPTNET:3600}
+KB_REFRESH_IN_BACKGROUND = True # True returns stale info right away and refreshes it in a background thread. False refreshes it before returning
+KB_REFRESH_BATCH_SIZE = 50 # Max number of items refreshed together
+KB_PREFETCH_CHUNK_SIZE = 100 # Number of new entities whose external kb info is fetched together when prefetching
+KB_OFFLINE = False # True never calls the web sources. Items not in the db get UNKNOWN (not saved), stale ones are used as is
 
 NEO4J_USER = 'neo4j'
 NEO4J_PASSWORD = "unonothing"
 NEO4J_URI = "bolt://localhost:7687"
 
+GRAPH_SINK_NEO4J = "neo4j"
+GRAPH_SINK_NETWORKX = "networkx"
+GRAPH_SINK = GRAPH_SINK_NEO4J # Where the graph is written. networkx keeps it in process & saves it to GRAPHML_PATH, no neo4j needed
+GRAPHML_PATH = '/Users/surjitdas/Downloads/nlu_processor/nlu_processor.graphml'
+# Number of sentences between the ingest journal checkpoints when the graph goes to a GraphML file, as each checkpoint saves the whole graph.
+# The db rows & the journal wait for the saves, a resumed run starts from the last one
+GRAPHML_SAVE_INTERVAL = 10000
+GRAPH_MERGE_EDGES = False # True keeps one edge per (head, type, tail) with a count & first / last seen, rather than one edge per sentence
+EDGE_COUNT = "count"
+EDGE_FIRST_SEEN = "first_seen"
+EDGE_LAST_SEEN = "last_seen"
+
+COLUMNAR_PATH = None # Directory of the columnar (Parquet / Arrow) copy of the tokens & triplets, see columnar_sink.py. None to not write it
+COLUMNAR_FORMAT_PARQUET = "parquet"
+COLUMNAR_FORMAT_ARROW = "arrow"
+COLUMNAR_FORMAT = COLUMNAR_FORMAT_PARQUET
+COLUMNAR_ROW_GROUP_SIZE = 100000 # Number of rows buffered per dataset and written as one row group
+COLUMNAR_PART_ROWS = 5000000 # Number of rows after which a new part file is started
+COLUMNAR_SAVE_INTERVAL = 5000 # Number of sentences between the ingest journal checkpoints when the columnar files are written, as each completes the part files
+COLUMNAR_TOKENS = "tokens"
+COLUMNAR_TRIPLETS = "triplets"
+
 # SPACY_MODEL = "en_core_web_lg"
 SPACY_MODEL = "en_core_web_trf"
+SPACY_BATCH_SIZE = 32 # Number of texts parsed together by nlp.pipe in file mode
+SPACY_N_PROCESS = 1 # Number of processes used by nlp.pipe. Each process loads its own copy of the model
+
+PIPELINE_QUEUE_SIZE = 4 # Max number of batches waiting between two stages of the pipeline (run.py --workers)
+
+SQL_COMMIT_INTERVAL = 100 # Number of sentences whose rows are inserted & committed together
+SQL_BUSY_TIMEOUT = 120 # Seconds a db connection waits for the write lock held by another (e.g. the writer, a worker's kb saves)
 
 TAB_SENTENCES = "sentences"
 TAB_EXT_KBS = "external_kbs"
 VW_SENTENCES = "vw_sentences"
+TAB_INGEST_JOURNAL = "ingest_journal"
 COL_SENT_UUID = "sentence_uuid"
 COL_TYPE = "TYPE"
 COL_NER_TYPE = "NER_type"
@@ -40,6 +98,23 @@ COL_WIKIDATACLASS = "list_wikiDataClass"
 COL_DBPEDIA = "list_dbPediaType"
 COL_CONCEPTNET = "list_conceptNetType"
 COL_TS = "ts"
+COL_TS_WIKIFIER = "ts_wikifier"
+COL_TS_WIKIDATA = "ts_wikidata"
+COL_TS_CONCEPTNET = "ts_conceptnet"
+COL_RETRY_WIKIFIER = "retry_wikifier"
+COL_RETRY_WIKIDATA = "retry_wikidata"
+COL_RETRY_CONCEPTNET = "retry_conceptnet"
+COL_INPUT_FILE = "input_file"
+COL_BYTE_OFFSET = "byte_offset"
+COL_SENT_UUIDS = "sentence_uuids"
+COL_HEAD_LABEL = "head_label"
+COL_HEAD_NAME = "head_name"
+COL_HEAD_CLASSIFICATION = "head_classification"
+COL_REL_TYPE = "rel_type"
+COL_REL_CLASSIFICATION = "rel_classification"
+COL_TAIL_LABEL = "tail_label"
+COL_TAIL_NAME = "tail_name"
+COL_TAIL_CLASSIFICATION = "tail_classification"
 
 WDINSTANCE = "wdInstance"
 WIKIDATA_CLASS = "wikiDataClass"
@@ -49,10 +124,24 @@ WORDNET = "wordNet"
 
 MAX_KB_NODES = 1
 
+WORDNET_TABLE_PATH = None # The precomputed WordNet table (see wordnet_table.py). None to use NLTK's WordNet
+WORDNET_CACHE_SIZE = 100000 # Max number of words whose WordNet parent classes are held in memory
+WORDNET_CACHE_PATH = None # json file the WordNet cache is loaded from at start and saved to at the end. None to not persist it
+WORDNET_FREQ_LIST_PATH = None # Word frequency list (one word per line, most frequent first) to pre-warm the WordNet cache with. None to not pre-warm
+
 COLUMNS_KBS_SOURCES = [COL_WDINSTANCE, COL_WIKIDATACLASS, COL_DBPEDIA, COL_CONCEPTNET]
+KB_SOURCE_COLUMNS = {KB_SOURCE_WIKIFIER:[COL_WIKIDATACLASS, COL_DBPEDIA], KB_SOURCE_WIKIDATA:[COL_WDINSTANCE], KB_SOURCE_CONCEPTNET:[COL_CONCEPTNET]}
+KB_NEGATIVE_VALUES = [[], ["UNKNOWN"], ["wd_UNKNOWN"]] # The values stored when a source finds nothing or fails
 COLUMNS_TOKEN = [COL_TOKEN_DEP, COL_TOKEN_POS, COL_TOKEN_HEAD_TEXT, COL_TOKEN_LEMMA, COL_COMP_NOUN, COL_VERB_PHRASE]
-COLUMNS_KBS = [COL_ITEM] + COLUMNS_KBS_SOURCES + [COL_TS]
+KB_SOURCE_TS_COLUMNS = {KB_SOURCE_WIKIFIER:COL_TS_WIKIFIER, KB_SOURCE_WIKIDATA:COL_TS_WIKIDATA, KB_SOURCE_CONCEPTNET:COL_TS_CONCEPTNET} # When each source was last fetched
+KB_FAILED_VALUES = {COL_WIKIDATACLASS:["UNKNOWN"], COL_DBPEDIA:["UNKNOWN"], COL_WDINSTANCE:["wd_UNKNOWN"], COL_CONCEPTNET:["UNKNOWN"]} # The values of a source that failed
+KB_SOURCE_RETRY_COLUMNS = {KB_SOURCE_WIKIFIER:COL_RETRY_WIKIFIER, KB_SOURCE_WIKIDATA:COL_RETRY_WIKIDATA, KB_SOURCE_CONCEPTNET:COL_RETRY_CONCEPTNET} # When a source whose refresh failed is tried again
+COLUMNS_KBS = [COL_ITEM] + COLUMNS_KBS_SOURCES + [COL_TS] + list(KB_SOURCE_TS_COLUMNS.values()) + list(KB_SOURCE_RETRY_COLUMNS.values()) # ts is when any of the sources was last fetched
 COLUMNS_PARA = [COL_SENT_UUID, COL_TYPE, COL_NER_TYPE, COL_ITEM] + COLUMNS_TOKEN + [COL_TS]
+COLUMNS_SENTENCES = [COL_SENT_UUID, COL_TYPE, COL_NER_TYPE, COL_ITEM, COL_TOKEN_DEP, COL_TOKEN_POS, COL_TOKEN_HEAD_TEXT, COL_TOKEN_LEMMA, COL_TS]
+COLUMNS_TRIPLETS = [COL_SENT_UUID, COL_HEAD_LABEL, COL_HEAD_NAME, COL_HEAD_CLASSIFICATION, COL_REL_TYPE, COL_REL_CLASSIFICATION,
+                    COL_TAIL_LABEL, COL_TAIL_NAME, COL_TAIL_CLASSIFICATION, COL_TS]
+COLUMNS_JOURNAL = [COL_INPUT_FILE, COL_BYTE_OFFSET, COL_SENT_UUIDS, COL_TS]
 COLUMNS_DF = [COL_SENT_UUID, COL_TYPE, COL_NER_TYPE, COL_ITEM] + COLUMNS_TOKEN + COLUMNS_KBS_SOURCES + [COL_TS]
 
 COL_TYPE_VAL_PARSED = "PARSED"
@@ -86,6 +175,12 @@ VERB = "Verb"
 PHRASE = "Phrase"
 PHRASE_LINK = "Phrase_Link"
 N4J_NODE_NAME = "name"
+N4J_SENTENCE_UUID = "s_uuid"
+N4J_PHRASE_KEY = [N4J_NODE_NAME, N4J_SENTENCE_UUID] # Phrase nodes are unique per sentence, all other nodes are unique by name
+N4J_BATCH_SIZE = 1000 # Number of edges written to neo4j in one transaction
+N4J_NODE_CACHE_SIZE = 100000 # Max number of (label, name) -> neo4j node ids held, for the nodes shared across sentences
+N4J_NODE_CACHE_WARM = 0 # Number of the most connected nodes whose ids are loaded at startup in append mode. 0 to not warm up - opt in, as it sorts all the nodes by degree
+N4J_INDEXED_LABELS = [PHRASE, NOUN, ADJ, VERB, WORDNET, WIKIDATA_CLASS, DBPEDIA, WDINSTANCE, CONCEPTNET] # + the NER labels of the spaCy model
 
 
 UUID = "uuid"
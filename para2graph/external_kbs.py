@@ -6,37 +6,121 @@
 
 import constants as C
 from loguru import logger as log
-import conceptnet_lite as cn_l
-import urllib
 from string import punctuation
-import json
 import sys
-import requests
-from SPARQLWrapper import SPARQLWrapper, JSON
-import pandas as pd
 from datetime import datetime
+import time
+import queue
 import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+import ast
+from caches import LRUCache
+import sql_db
+from http_client import make_session, RateLimiter
+from metrics import metrics
+import threading
 
-cn_l.connect(C.CONCEPTNET_LOCAL_DB)
+ENTRY_COLUMNS = C.COLUMNS_KBS[1:] # The columns read into an entry, all but the item
 
 class Explorer:
-    def __init__(self):
-        self.db = sqlite3.connect(C.SQL_EXT_KB_DB)
-    
+    def __init__(self, wikifier_url=C.WIKIFIER_URL, wikidata_api_url=C.WIKIDATA_API_ENDPOINT_URL,
+                    wikidata_sparql_url=C.WIKIDATA_SPARQL_ENDPOINT_URL, max_workers=C.KB_MAX_CONCURRENCY, timeouts=C.KB_TIMEOUTS,
+                    pool_size=C.KB_HTTP_POOL_SIZE, retries=C.KB_HTTP_RETRIES, backoff=C.KB_HTTP_BACKOFF, rate_limits=C.KB_RATE_LIMITS,
+                    positive_ttls=C.KB_POSITIVE_TTL, negative_ttls=C.KB_NEGATIVE_TTL, retry_ttls=C.KB_RETRY_TTL,
+                    refresh_in_background=C.KB_REFRESH_IN_BACKGROUND, offline=C.KB_OFFLINE):
+        '''
+        :param wikifier_url, wikidata_api_url, wikidata_sparql_url: the endpoints of the web sources. Can be pointed to local stand-ins
+        :param max_workers: the max number of requests to the sources that are in flight at the same time
+        :param timeouts: the http timeout in seconds per source
+        :param pool_size, retries, backoff: the connection pool size per host and the retry policy of the http session
+        :param rate_limits: the max calls per second per source, applied to each of the endpoints of the source. The limits hold for
+                this process only, processes sharing the endpoints each pass their share (see http_client.per_process_rate_limits)
+        :param positive_ttls, negative_ttls: the seconds per source after which the saved info is stale, for found / not found info
+        :param retry_ttls: the seconds per source after which a source that failed is tried again. A failed refresh keeps the saved info
+        :param refresh_in_background: True to return stale info as is and refresh it in a background thread, False to refresh it before returning
+        :param offline: only use the info saved in the db (e.g. filled by prefetch). Items not there get UNKNOWN, which is not saved
+        '''
+        self.db = sql_db.connect(C.SQL_EXT_KB_DB)
+        create_table(self.db)
+        self.cache = LRUCache(C.KB_CACHE_SIZE, C.KB_CACHE_TTL)
+        self.wikifier_url = wikifier_url
+        self.wikidata_api_url = wikidata_api_url
+        self.wikidata_sparql_url = wikidata_sparql_url
+        self.timeouts = timeouts
+        # One session for all the endpoints, so that the connections are kept alive and reused by all the pool threads
+        # TODO adjust user agent; see https://w.wiki/CX6
+        self.session = make_session(pool_size, retries, backoff,
+                                    user_agent="WDQS-example Python/%s.%s" % (sys.version_info[0], sys.version_info[1]))
+        self.rate_limiters = {wikifier_url:RateLimiter(rate_limits.get(C.KB_SOURCE_WIKIFIER)),
+                                wikidata_api_url:RateLimiter(rate_limits.get(C.KB_SOURCE_WIKIDATA)),
+                                wikidata_sparql_url:RateLimiter(rate_limits.get(C.KB_SOURCE_WIKIDATA))}
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.conceptnet_db = None
+        self.conceptnet_lock = threading.Lock()
+        self.positive_ttls = positive_ttls
+        self.negative_ttls = negative_ttls
+        self.retry_ttls = retry_ttls
+        self.refresh_in_background = refresh_in_background
+        self.refresh_q = queue.Queue()
+        self.refresh_pending = set()
+        self.refresh_lock = threading.Lock()
+        self.refresher = None
+        self.offline = offline
+        self.offline_misses = 0 # Items looked up offline which were not in the db
+
+    def connect_conceptnet(self):
+        '''
+        Opens the ConceptNet database (the one built by conceptnet_lite) on first use, read only - it is never changed by the lookups.
+        The batch query looks up the is_a edges by their start concept, which is slow without the index made by index_conceptnet.
+        The connection is shared by the pool threads, one batch at a time (conceptnet_lock)
+        '''
+        if self.conceptnet_db is None:
+            db = sqlite3.connect(f"file:{C.CONCEPTNET_LOCAL_DB}?mode=ro", uri=True, check_same_thread=False)
+            indexed_columns = [db.execute(f"pragma index_info({quote_sql(row[1])})").fetchone() for row in db.execute("pragma index_list(edge)")]
+            if not any(column is not None and column[2] == "start_id" for column in indexed_columns):
+                log.warning(f"The ConceptNet edges are not indexed by their start, the lookups will be slow. "
+                            f"Index them once with: python external_kbs.py index-conceptnet")
+            self.conceptnet_db = db
+        return self.conceptnet_db
+
     def get_conceptnet_data(self, text):
-        conceptnet_list = []
-        try:
-            for e in cn_l.edges_for(cn_l.Label.get(text=text, language='en').concepts, same_language=True):
-                if(e.relation.name in ['is_a'] and e.start.text == text):
-                    conceptnet_list.append(e.end.text)
-        except:
-            conceptnet_list.append("UNKNOWN")
-        return conceptnet_list
+        return self.get_conceptnet_data_many([text])[text]
+
+    def get_conceptnet_data_many(self, texts, chunk_size=C.CONCEPTNET_BATCH_SIZE):
+        '''
+        Returns a dict of text -> the ConceptNet is_a targets of the text, i.e. the end concepts of the is_a edges
+        starting from the english concepts of the text, in the same language. ["UNKNOWN"] if ConceptNet does not have the text at all
+        The relation & language are filtered in the database, with one query per chunk of texts rather than one ORM walk per text
+        '''
+        texts = list(dict.fromkeys(texts))
+        conceptnet = {}
+        with self.conceptnet_lock:
+            db = self.connect_conceptnet()
+            for i in range(0, len(texts), chunk_size):
+                chunk = texts[i:i + chunk_size]
+                marks = ", ".join(["?"] * len(chunk))
+                known = db.execute(f"select l.text from label l join language lang on lang.id = l.language_id "
+                                    f"where lang.name = 'en' and l.text in ({marks})", chunk)
+                for (text,) in known:
+                    conceptnet[text] = []
+                edges = db.execute(f"select sl.text, el.text from label sl "
+                                    f"join language lang on lang.id = sl.language_id and lang.name = 'en' "
+                                    f"join concept sc on sc.label_id = sl.id "
+                                    f"join edge e on e.start_id = sc.id "
+                                    f"join relation r on r.id = e.relation_id and r.name = 'is_a' "
+                                    f"join concept ec on ec.id = e.end_id "
+                                    f"join label el on el.id = ec.label_id and el.language_id = sl.language_id "
+                                    f"where sl.text in ({marks}) order by e.id", chunk)
+                for text, end_text in edges:
+                    conceptnet[text].append(end_text)
+        for text in texts:
+            conceptnet.setdefault(text, ["UNKNOWN"])
+        return conceptnet
 
     def wikifier(self, text, lang="en", threshold=0.8):
         """Function that fetches entity linking results from wikifier.com API"""
-        # Prepare the URL.
-        data = urllib.parse.urlencode([
+        # Prepare the form data.
+        data = [
             ("text", text), ("lang", lang),
             ("userKey", C.WIKIFIER_USER_KEY) # this is my userkey
             ,
@@ -46,13 +130,13 @@ class Explorer:
             ("wikiDataClasses", "true"), ("wikiDataClassIds", "false"),
             ("support", "true"), ("ranges", "false"), ("minLinkFrequency", "2"),
             ("includeCosines", "false"), ("maxMentionEntropy", "3")
-        ])
+        ]
     
         # Call the Wikifier and read the response.
-        req = urllib.request.Request(C.WIKIFIER_URL, data=data.encode("utf8"), method="POST")
-        with urllib.request.urlopen(req, timeout=60) as f:
-            response = f.read()
-            response = json.loads(response.decode("utf8"))
+        self.rate_limiters[self.wikifier_url].wait()
+        response = self.session.post(self.wikifier_url, data=data, timeout=self.timeouts[C.KB_SOURCE_WIKIFIER])
+        response.raise_for_status()
+        response = response.json()
         
         log.debug(data)
         log.debug(response)
@@ -93,17 +177,17 @@ class Explorer:
 
     # For wikidata, defining a generic sparql calling function
     def get_sparql_results(self, query):
-        user_agent = "WDQS-example Python/%s.%s" % (sys.version_info[0], sys.version_info[1])
-        # TODO adjust user agent; see https://w.wiki/CX6
-        sparql = SPARQLWrapper(C.WIKIDATA_SPARQL_ENDPOINT_URL, agent=user_agent)
-        sparql.setQuery(query)
-        sparql.setReturnFormat(JSON)
-        return sparql.query().convert()
+        # POST, as the batched VALUES queries can get too long for a GET url
+        self.rate_limiters[self.wikidata_sparql_url].wait()
+        response = self.session.post(self.wikidata_sparql_url, data={"query":query},
+                                        headers={"Accept":"application/sparql-results+json"}, timeout=self.timeouts[C.KB_SOURCE_WIKIDATA])
+        response.raise_for_status()
+        return response.json()
 
-    def get_wikidata(self, text, limit=1):
-
-        # First the web serach api of wiki data has to be used for getting the entity id
-        # This entity id is then useful for the wikidata query service
+    def search_wikidata_entity(self, text, limit=1):
+        '''
+        Returns the wikidata entity id of the text using the web search api of wikidata, None if wikidata does not find the entity
+        '''
         params = {
             'action': 'wbsearchentities',
             'format': 'json',
@@ -111,42 +195,91 @@ class Explorer:
             'search': text,
             'limit': limit
         }
-        response = requests.get(C.WIKIDATA_API_ENDPOINT_URL, params=params)
+        self.rate_limiters[self.wikidata_api_url].wait()
+        response = self.session.get(self.wikidata_api_url, params=params, timeout=self.timeouts[C.KB_SOURCE_WIKIDATA])
+        response.raise_for_status()
         response_json = response.json()
-        log.debug(f"get_wikidata::response_json: {response_json}")
-        entity_ids = []
-        for entity in response_json['search']:
-            entity_ids.append(entity['id'])
-        
-        records_dict = {}
-        # Put an empty list if wd does not find the entity
-        if len(entity_ids)==0:
-            records_dict[C.COL_WDINSTANCE] = ["wd_UNKNOWN"]
-            return records_dict
-
-        entity_id = entity_ids[0] # First entity_id. If there are none, this will throw an error
-        query =(f"SELECT ?instance_of ?instance_ofLabel "
+        log.debug(f"search_wikidata_entity::response_json: {response_json}")
+        entity_ids = [entity['id'] for entity in response_json['search']]
+        return entity_ids[0] if len(entity_ids) > 0 else None
+
+    def get_wikidata(self, text, limit=1):
+        wd_dict = self.get_wikidata_many([text], limit)[text]
+        if wd_dict is None:
+            raise RuntimeError(f"get_wikidata failed for {text=}")
+        return wd_dict
+
+    def get_wikidata_many(self, texts, limit=1, chunk_size=C.WIKIDATA_SPARQL_BATCH_SIZE):
+        '''
+        The batch form of get_wikidata. Returns a dict of text -> records_dict, None for the texts whose lookup failed
+        First the web search api of wikidata is used for getting the entity id of each text, concurrently on the thread pool.
+        The instance_of / subclass_of labels of all the entities are then fetched with one sparql query (per chunk of entities),
+        the entities being bound with VALUES ?item {...} and the results split back per entity on ?item
+        Must not be called from the thread pool itself, as it waits on the pool
+        '''
+        texts = list(dict.fromkeys(texts))
+        futures = {text:self.executor.submit(self.search_wikidata_entity, text, limit) for text in texts}
+        entity_ids = {}
+        wd_dicts = {}
+        for text, future in futures.items():
+            try:
+                entity_ids[text] = future.result()
+            except Exception as e:
+                log.warning(f"get_wikidata_many: search failed for {text=}: {e!r}")
+                wd_dicts[text] = None
+
+        # Put wd_UNKNOWN if wd does not find the entity
+        for text, entity_id in entity_ids.items():
+            if entity_id is None:
+                wd_dicts[text] = {C.COL_WDINSTANCE:["wd_UNKNOWN"]}
+
+        distinct_ids = list(dict.fromkeys([entity_id for entity_id in entity_ids.values() if entity_id is not None]))
+        entity_records = {}
+        for i in range(0, len(distinct_ids), chunk_size):
+            chunk = distinct_ids[i:i + chunk_size]
+            try:
+                entity_records.update(self.get_wikidata_classes(chunk))
+            except Exception as e:
+                log.warning(f"get_wikidata_many: sparql failed for {chunk}: {e!r}")
+
+        for text, entity_id in entity_ids.items():
+            if entity_id is None:
+                continue
+            records_dict = entity_records.get(entity_id)
+            if records_dict is None:
+                wd_dicts[text] = None
+                continue
+            records_dict = {column1:list(col2_list) for column1, col2_list in records_dict.items()}
+            records_dict[C.COL_WDINSTANCE] = list(records_dict.keys())
+            wd_dicts[text] = records_dict
+        log.debug(wd_dicts)
+        return wd_dicts
+
+    def get_wikidata_classes(self, entity_ids):
+        '''
+        Returns a dict of entity id -> {instance_of label: [subclass_of labels]} for the entity ids, with a single sparql query
+        An entity without any instance_of gets an empty dict
+        '''
+        values = " ".join([f"wd:{entity_id}" for entity_id in entity_ids])
+        query =(f"SELECT ?item ?instance_of ?instance_ofLabel "
                 f"?subclass_of ?subclass_ofLabel "
-                f"WHERE {{wd:{entity_id} "
-                f"wdt:P31 ?instance_of . "
+                f"WHERE {{VALUES ?item {{{values}}} "
+                f"?item wdt:P31 ?instance_of . "
                 f"?instance_of wdt:P279+ ?subclass_of . "
                 f"SERVICE wikibase:label {{ bd:serviceParam wikibase:language '[AUTO_LANGUAGE],en'. }}}}")
         log.debug(query)
         results = self.get_sparql_results(query)
         log.debug(results)
         records = (results["results"]["bindings"])
-        
+
+        entity_records = {entity_id:{} for entity_id in entity_ids}
         for record in records:
+            # ?item is the entity uri, http://www.wikidata.org/entity/Qxxx
+            entity_id = record['item']['value'].rsplit("/", 1)[-1]
             column1 = record['instance_ofLabel']['value']
             column2 = record['subclass_ofLabel']['value']
-            col2_list = records_dict.get(column1,[])
-            col2_list.append(column2)
-            records_dict[column1] = col2_list
-        
-        records_dict[C.COL_WDINSTANCE] = list(records_dict.keys())
-        
-        log.debug(records_dict)
-        return records_dict
+            entity_records.setdefault(entity_id, {}).setdefault(column1, []).append(column2)
+        return entity_records
 
     def get_ext_kb_info(self, text):
         '''
@@ -155,26 +288,313 @@ class Explorer:
         Otherwise makes the API/web calls, saves it to db for later use and then returns
         Thus this is a fully encapsulated function
         '''
-        sql_str = f"select * from {C.TAB_EXT_KBS} where {C.COL_ITEM}=?"
-        params = (text,)
-        df = pd.read_sql(sql_str, self.db, params=params)
-        df = df.fillna("[]")
-        if len(df) != 0:
-            return {C.COL_WIKIDATACLASS:df[C.COL_WIKIDATACLASS][0], C.COL_WDINSTANCE:df[C.COL_WDINSTANCE][0],
-                        C.COL_DBPEDIA:df[C.COL_DBPEDIA][0], C.COL_CONCEPTNET:df[C.COL_CONCEPTNET][0]}
-        else:
-            wk_dict = self.wikifier(text)
-            wikidataclass = str(wk_dict[C.COL_WIKIDATACLASS])
-            dbpedia = str(wk_dict[C.COL_DBPEDIA])
-            wdinstance = str(self.get_wikidata(text)[C.COL_WDINSTANCE])
-            conceptnet = str(self.get_conceptnet_data(text.lower()))
-            ts = datetime.now()
-            
-            cols = [C.COL_ITEM,C.COL_WIKIDATACLASS, C.COL_DBPEDIA, C.COL_WDINSTANCE,C.COL_CONCEPTNET, C.COL_TS]
-            
-            df = pd.DataFrame([[text, wikidataclass,dbpedia,wdinstance,conceptnet,ts]],columns=cols)
-            df.to_sql(C.TAB_EXT_KBS, self.db, if_exists="append", index=False)
-            return {C.COL_WIKIDATACLASS:wikidataclass, C.COL_WDINSTANCE:dbpedia, C.COL_DBPEDIA:wdinstance, C.COL_CONCEPTNET:conceptnet}
+        return self.get_ext_kb_info_many([text])[text]
+
+    def get_ext_kb_info_many(self, texts):
+        '''
+        The batch form of get_ext_kb_info. Returns a dict of text -> kb_info
+        The texts which are not in the database yet are fetched concurrently - all the sources for all the texts are
+        submitted to the thread pool at once, so the latency is that of the slowest source rather than the sum of all of them
+        The texts with a stale source are either returned as is and refreshed in the background, or refreshed before returning.
+        Either way only the stale sources are fetched again
+        '''
+        kb_infos = {}
+        fetches = {} # text -> the saved (kb_info, source_ts, retry_at), None for the texts not in the database
+        now = time.time()
+        for text in dict.fromkeys(texts):
+            entry = self.cache.get(text)
+            if entry is None:
+                entry = self.read_ext_kb_info(text)
+                if entry is not None:
+                    self.cache.put(text, entry)
+                    metrics.incr("kb_db_hits")
+            else:
+                metrics.incr("kb_cache_hits")
+            if entry is None:
+                metrics.incr("kb_misses")
+                fetches[text] = None
+                continue
+            kb_info = entry[0]
+            if len(self.stale_sources(*entry, now)) > 0 and not self.offline:
+                metrics.incr("kb_stale")
+                if not self.refresh_in_background:
+                    fetches[text] = entry
+                    continue
+                self.refresh_later(text)
+            kb_infos[text] = kb_info
+
+        if len(fetches) == 0:
+            return kb_infos
+
+        if self.offline:
+            for text in fetches:
+                kb_infos[text] = dict(C.KB_FAILED_VALUES)
+            log.debug(f"get_ext_kb_info_many: offline, {len(fetches)} items not in the db: {list(fetches)}")
+            # Items the prefetch did not cover, e.g. as its model found other entities. Counted to make the gap visible
+            self.offline_misses += len(fetches)
+            metrics.incr("kb_offline_misses", len(fetches))
+            return kb_infos
+
+        with metrics.timer("kb_fetch"):
+            kb_infos.update(self.update_ext_kb_info_many(fetches))
+        return kb_infos
+
+    def update_ext_kb_info_many(self, entries, db=None):
+        '''
+        Fetches the sources of the texts that are missing or stale, merges them into the saved info and saves the result.
+        Returns a dict of text -> kb_info
+        :param entries: dict of text -> the saved (kb_info, source_ts, retry_at), None for a text not saved yet (all its sources get fetched)
+        :param db: the sqlite3 connection to save to, see save_ext_kb_info
+        '''
+        now = time.time()
+        sources = {text:self.stale_sources(*entry, now) if entry is not None else list(C.KB_SOURCE_COLUMNS) for text, entry in entries.items()}
+        fetched = self.fetch_ext_kb_info_many(sources)
+        kb_infos = {}
+        for text, entry in entries.items():
+            kb_info, source_ts, retry_at = merge_kb_info(entry, fetched[text], now, self.retry_ttls)
+            self.save_ext_kb_info(text, kb_info, source_ts, db, retry_at)
+            kb_infos[text] = kb_info
+        return kb_infos
+
+    def fetch_ext_kb_info_many(self, sources):
+        '''
+        Fetches the given sources of the texts. Returns a dict of text -> {source: {column: value}}, the value of a source being None if it failed
+        :param sources: dict of text -> the sources (C.KB_SOURCE_*) to fetch for the text
+        '''
+        def texts_of(source):
+            return [text for text, text_sources in sources.items() if source in text_sources]
+
+        results = {text:{} for text in sources}
+        wikifier_futures = {text:self.executor.submit(self.wikifier, text) for text in texts_of(C.KB_SOURCE_WIKIFIER)}
+        # ConceptNet is local, all the texts go in one batch query which runs alongside the web calls
+        conceptnet_texts = texts_of(C.KB_SOURCE_CONCEPTNET)
+        if len(conceptnet_texts) > 0:
+            conceptnet_future = self.executor.submit(self.get_conceptnet_data_many, [text.lower() for text in conceptnet_texts])
+
+        # Wikidata searches the entities on the pool too, then fetches the classes of all of them in one query
+        wikidata_texts = texts_of(C.KB_SOURCE_WIKIDATA)
+        if len(wikidata_texts) > 0:
+            wd_dicts = self.get_wikidata_many(wikidata_texts)
+            for text in wikidata_texts:
+                results[text][C.KB_SOURCE_WIKIDATA] = {C.COL_WDINSTANCE:wd_dicts[text][C.COL_WDINSTANCE]} if wd_dicts[text] is not None else None
+
+        if len(conceptnet_texts) > 0:
+            try:
+                conceptnet = conceptnet_future.result()
+                for text in conceptnet_texts:
+                    results[text][C.KB_SOURCE_CONCEPTNET] = {C.COL_CONCEPTNET:conceptnet[text.lower()]}
+            except Exception as e:
+                log.warning(f"fetch_ext_kb_info_many: {C.KB_SOURCE_CONCEPTNET} failed for {len(conceptnet_texts)} texts: {e!r}")
+                for text in conceptnet_texts:
+                    results[text][C.KB_SOURCE_CONCEPTNET] = None
+        for text, future in wikifier_futures.items():
+            try:
+                results[text][C.KB_SOURCE_WIKIFIER] = future.result()
+            except Exception as e:
+                log.warning(f"fetch_ext_kb_info_many: {C.KB_SOURCE_WIKIFIER} failed for {text=}: {e!r}")
+                results[text][C.KB_SOURCE_WIKIFIER] = None
+        return results
+
+    def stale_sources(self, kb_info, source_ts, retry_at, now):
+        '''
+        Returns the sources of the kb_info which are stale at now (epoch seconds).
+        Each source has its own ttl, the shorter negative one if the source found nothing, counted from when the source was fetched.
+        A source whose last fetch failed is stale at its retry_at instead, whatever its ttl, so that a failure is never kept like a not found
+        '''
+        stale = []
+        for source, columns in C.KB_SOURCE_COLUMNS.items():
+            if source in retry_at:
+                if retry_at[source] <= now:
+                    stale.append(source)
+                continue
+            negative = all(kb_info[col] in C.KB_NEGATIVE_VALUES for col in columns)
+            ttl = self.negative_ttls.get(source) if negative else self.positive_ttls.get(source)
+            if ttl is not None and source_ts[source] + ttl < now:
+                stale.append(source)
+        return stale
+
+    def read_ext_kb_info(self, text, db=None):
+        '''
+        Returns (kb_info, source_ts, retry_at) of the text saved in the database, None if it is not there. source_ts is the dict of source -> when
+        it was fetched (epoch seconds), retry_at that of source -> when it is tried again after a failed refresh. The lists are stored as strings in the db. They are converted back to lists here,
+        once per item, as the kb_info is then held in the cache
+        '''
+        db = self.db if db is None else db
+        sql_str = f"select {', '.join(ENTRY_COLUMNS)} from {C.TAB_EXT_KBS} where {C.COL_ITEM}=? limit 1"
+        row = db.execute(sql_str, (text,)).fetchone()
+        if row is None:
+            return None
+        return to_entry(row)
+
+    def save_ext_kb_info(self, text, kb_info, source_ts, db=None, retry_at=None):
+        '''
+        Saves the kb_info of the text to the database - updates the row if the text is there already (a refresh), inserts it otherwise
+        :param source_ts: dict of source -> when the source was fetched (epoch seconds). The ts of the row is the latest of them
+        :param db: the sqlite3 connection to use, by default that of the Explorer. The background refresh thread passes its own
+        :param retry_at: dict of source -> when a source whose refresh failed is tried again (epoch seconds). Only those sources are in it
+        '''
+        db = self.db if db is None else db
+        retry_at = {} if retry_at is None else retry_at
+        columns = ENTRY_COLUMNS
+        values = ([str(kb_info[col]) for col in C.COLUMNS_KBS_SOURCES] + [to_ts(max(source_ts.values()))]
+                    + [to_ts(source_ts[source]) for source in C.KB_SOURCE_TS_COLUMNS]
+                    + [to_ts(retry_at[source]) if source in retry_at else None for source in C.KB_SOURCE_RETRY_COLUMNS])
+        with db:
+            cursor = db.execute(f"update {C.TAB_EXT_KBS} set {', '.join([f'{col}=?' for col in columns])} where {C.COL_ITEM}=?", values + [text])
+            if cursor.rowcount == 0:
+                db.execute(f"insert into {C.TAB_EXT_KBS} ({', '.join([C.COL_ITEM] + columns)}) values ({', '.join(['?'] * (len(columns) + 1))})",
+                            [text] + values)
+        self.cache.put(text, (kb_info, source_ts, retry_at))
+
+    def refresh_later(self, text):
+        '''
+        Queues the text for the background refresh thread, which is started on first use
+        '''
+        with self.refresh_lock:
+            if text in self.refresh_pending:
+                return
+            self.refresh_pending.add(text)
+            if self.refresher is None:
+                self.refresher = threading.Thread(target=self.refresh_loop, daemon=True)
+                self.refresher.start()
+        self.refresh_q.put(text)
+
+    def refresh_loop(self):
+        '''
+        The background refresh thread. Refreshes the stale sources of the queued texts in batches and updates their rows,
+        with its own sqlite3 connection as a connection can not be shared across threads. Runs till it gets the stop marker (None) from close()
+        '''
+        db = sql_db.connect(C.SQL_EXT_KB_DB)
+        stop = False
+        while not stop:
+            texts = [self.refresh_q.get()]
+            while len(texts) < C.KB_REFRESH_BATCH_SIZE:
+                try:
+                    texts.append(self.refresh_q.get_nowait())
+                except queue.Empty:
+                    break
+            stop = None in texts
+            texts = [text for text in texts if text is not None]
+            try:
+                if len(texts) > 0:
+                    self.update_ext_kb_info_many({text:self.read_ext_kb_info(text, db) for text in texts}, db)
+                    log.debug(f"Refreshed the external kb info of {len(texts)} items")
+            except Exception:
+                log.exception(f"Failed to refresh {texts}")
+            finally:
+                with self.refresh_lock:
+                    self.refresh_pending.difference_update(texts)
+        db.close()
+
+    def refresh_stale(self, limit=None):
+        '''
+        Refreshes the stale sources of the saved external kb info, e.g. as a periodic job. Returns the number of items refreshed
+        :param limit: the max number of items to refresh
+        '''
+        now = time.time()
+        sql_str = f"select {', '.join([C.COL_ITEM] + ENTRY_COLUMNS)} from {C.TAB_EXT_KBS}"
+        stale = {}
+        for row in self.db.execute(sql_str).fetchall():
+            entry = to_entry(row[1:])
+            if row[0] not in stale and len(self.stale_sources(*entry, now)) > 0:
+                stale[row[0]] = entry
+        texts = list(stale)[:limit]
+        for i in range(0, len(texts), C.KB_REFRESH_BATCH_SIZE):
+            self.update_ext_kb_info_many({text:stale[text] for text in texts[i:i + C.KB_REFRESH_BATCH_SIZE]})
+            log.info(f"Refreshed {min(i + C.KB_REFRESH_BATCH_SIZE, len(texts))}/{len(texts)} stale items")
+        return len(texts)
+
+    def close(self, wait=True):
+        '''
+        Stops the background refresh thread. With wait, the refreshes already queued are done first.
+        Offline, also logs how many items were not in the db
+        '''
+        if self.offline_misses > 0:
+            log.warning(f"{self.offline_misses} external kb lookups were not in the db and got UNKNOWN. Prefetch the corpus with the same model to fill them")
+        if self.refresher is not None:
+            self.refresh_q.put(None)
+            if wait:
+                self.refresher.join()
+            self.refresher = None
+
+def create_table(db):
+    '''
+    Creates the external_kbs table & its index if they are missing, and adds the per source ts & retry columns to a table made before them.
+    Till a source is fetched again, its ts is that of the row. The pipeline runs this once before starting its workers,
+    so that they do not race each other to add the columns
+    '''
+    db.execute(f"create table if not exists {C.TAB_EXT_KBS} ({', '.join(C.COLUMNS_KBS)})")
+    db.execute(f"create index if not exists idx_{C.TAB_EXT_KBS}_{C.COL_ITEM} on {C.TAB_EXT_KBS} ({C.COL_ITEM})")
+    existing = [row[1] for row in db.execute(f"pragma table_info({C.TAB_EXT_KBS})")]
+    with db:
+        for col in list(C.KB_SOURCE_TS_COLUMNS.values()) + list(C.KB_SOURCE_RETRY_COLUMNS.values()):
+            if col not in existing:
+                db.execute(f"alter table {C.TAB_EXT_KBS} add column {col}")
+
+def index_conceptnet(path=C.CONCEPTNET_LOCAL_DB):
+    '''
+    Adds the (start_id, relation_id) edge index used by Explorer.get_conceptnet_data_many to the ConceptNet database.
+    A one off setup step, as it takes minutes on the full database and writes to it
+    '''
+    db = sqlite3.connect(path)
+    try:
+        log.info(f"Indexing the ConceptNet edges of {path}")
+        with db:
+            db.execute("create index if not exists idx_edge_start_relation on edge (start_id, relation_id)")
+    finally:
+        db.close()
+
+def quote_sql(name):
+    return '"' + name.replace('"', '""') + '"'
+
+def parse_ts(ts):
+    '''
+    Returns the ts column value as epoch seconds. A missing or unreadable ts counts as the oldest possible, i.e. stale
+    '''
+    try:
+        return datetime.fromisoformat(str(ts)).timestamp()
+    except ValueError:
+        return 0
+
+def to_ts(epoch):
+    return datetime.fromtimestamp(epoch).isoformat(sep=" ")
+
+def to_entry(row):
+    '''
+    Returns (kb_info, source_ts, retry_at) of a row of the ENTRY_COLUMNS - the source columns, the ts, the per source ts & retry columns.
+    A source without a ts of its own (a row saved before those columns) gets the ts of the row. Only the sources with a retry ts are in retry_at
+    '''
+    kb_info = {col:ast.literal_eval(value) if value is not None else [] for col, value in zip(C.COLUMNS_KBS_SOURCES, row)}
+    ts = row[len(C.COLUMNS_KBS_SOURCES)]
+    ts_values = row[len(C.COLUMNS_KBS_SOURCES) + 1:]
+    source_ts = {source:parse_ts(value if value is not None else ts) for source, value in zip(C.KB_SOURCE_TS_COLUMNS, ts_values)}
+    retry_at = {source:parse_ts(value) for source, value in zip(C.KB_SOURCE_RETRY_COLUMNS, ts_values[len(C.KB_SOURCE_TS_COLUMNS):])
+                    if value is not None}
+    return kb_info, source_ts, retry_at
+
+def merge_kb_info(entry, fetched, now, retry_ttls):
+    '''
+    Merges the freshly fetched sources into the saved info of a text. Returns the new (kb_info, source_ts, retry_at)
+    A source that failed keeps its saved value and ts, so a failing refresh never overwrites good info. A source that failed for a new
+    text gets the negative C.KB_FAILED_VALUES. Either way the source is tried again once its retry ttl has passed - not before, so that
+    a failing source is not called again for every lookup of the text, and not never, so that a failure is not kept like a not found
+    :param entry: the saved (kb_info, source_ts, retry_at), None for a new text
+    :param fetched: dict of source -> {column: value}, None for a failed source. Only the fetched sources are in it
+    :param now: when the sources were fetched (epoch seconds)
+    :param retry_ttls: dict of source -> seconds after which a source that failed is tried again
+    '''
+    kb_info, source_ts, retry_at = ({}, {}, {}) if entry is None else (dict(entry[0]), dict(entry[1]), dict(entry[2]))
+    for source, columns in C.KB_SOURCE_COLUMNS.items():
+        if fetched.get(source) is not None:
+            kb_info.update({col:fetched[source][col] for col in columns})
+            source_ts[source] = now
+            retry_at.pop(source, None)
+        elif source not in source_ts:
+            kb_info.update({col:C.KB_FAILED_VALUES[col] for col in columns})
+            source_ts[source] = now
+        if source in fetched and fetched[source] is None:
+            retry_at[source] = now + retry_ttls[source]
+    return kb_info, source_ts, retry_at
 
 def test(text):
     exp = Explorer()
@@ -185,5 +605,10 @@ def test(text):
     print(x[C.COL_CONCEPTNET])
 
 if __name__=="__main__":
-    test("mathematics")
+    if len(sys.argv) > 1 and sys.argv[1] == "refresh":
+        print(f"Refreshed {Explorer().refresh_stale()} stale items")
+    elif len(sys.argv) > 1 and sys.argv[1] == "index-conceptnet":
+        index_conceptnet()
+    else:
+        test("mathematics")
 
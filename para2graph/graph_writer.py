@@ -0,0 +1,376 @@
+#----------------------------#
+# Author: Surjit Das
+# Email: surjitdas@gmail.com
+# Program: artmind
+#----------------------------#
+
+from collections import namedtuple
+from datetime import datetime
+import os
+import constants as C
+from loguru import logger as log
+from metrics import metrics
+from caches import LRUCache
+
+'''
+An EdgeRow is the plain form of an edge to be written to the graph. The nodes are described by their label, the properties
+that identify them (head_key / tail_key) and the properties that are only set when the node gets created (head_props / tail_props)
+'''
+EdgeRow = namedtuple("EdgeRow", ["head_label", "head_key", "head_props", "rel_type", "rel_props", "tail_label", "tail_key", "tail_props"])
+
+# Process wide (label, name) -> neo4j node id of the nodes shared across sentences (all but the Phrase nodes).
+# A node in it is MATCHed on its id rather than MERGEd on its label & name
+NODE_IDS = LRUCache(C.N4J_NODE_CACHE_SIZE)
+
+def quote(name):
+    '''
+    Backtick quotes a label or relationship type so that it can be used in cypher as is (spaces, dashes, etc.)
+    '''
+    return "`" + name.replace("`", "``") + "`"
+
+def node_parts(node):
+    '''
+    Splits a node into its label, the key properties and the remaining properties
+    Phrase nodes are identified by (name, s_uuid), all other nodes only by name
+    '''
+    return node.label, node.key, node.props
+
+def to_edge_row(head, rel_type, rel_props, tail):
+    '''
+    Creates the EdgeRow for head-[rel_type]->tail
+    '''
+    head_label, head_key, head_props = node_parts(head)
+    tail_label, tail_key, tail_props = node_parts(tail)
+    return EdgeRow(head_label, head_key, head_props, rel_type, rel_props, tail_label, tail_key, tail_props)
+
+class Neo4jGraphWriter:
+    """
+    Collects the edges of one or more sentences and writes them to neo4j in a single transaction,
+    with one parameterised UNWIND ... MERGE query per (head label, relationship type, tail label)
+    """
+    def __init__(self, G_n4j, batch_size=C.N4J_BATCH_SIZE, merge_edges=C.GRAPH_MERGE_EDGES):
+        '''
+        :param G_n4j: the py2neo Graph to write to
+        :param batch_size: the number of edges after which the collected edges get written
+        :param merge_edges: keep one relationship per (head, type, tail), counting how often it was seen, rather than create one per sentence
+        '''
+        self.G_n4j = G_n4j
+        self.batch_size = batch_size
+        self.merge_edges = merge_edges
+        self.auto_flush = True # False leaves the flushing to the caller, e.g. to line the commits up with the ingest journal
+        self.rows = []
+        self.indexed_labels = set()
+
+    def ensure_schema(self, labels):
+        '''
+        Creates the index used by the MERGEs for each of the labels - (name, s_uuid) for Phrase and name for all other labels.
+        Without these every MERGE is a label scan, which gets slower as the graph grows.
+        IF NOT EXISTS makes this a no-op for the indexes that are already there (e.g. in append mode)
+        '''
+        for label in labels:
+            if label in self.indexed_labels:
+                continue
+            key_names = C.N4J_PHRASE_KEY if label == C.PHRASE else [C.N4J_NODE_NAME]
+            index_name = quote(f"idx_{label}_{'_'.join(key_names)}")
+            props = ", ".join([f"n.{name}" for name in key_names])
+            self.G_n4j.run(f"CREATE INDEX {index_name} IF NOT EXISTS FOR (n:{quote(label)}) ON ({props})")
+            metrics.incr("neo4j_round_trips")
+            self.indexed_labels.add(label)
+            log.debug(f"Ensured index {index_name}")
+
+    def add(self, edge_rows):
+        '''
+        Adds the EdgeRows to the current batch. The batch is written once it has reached the batch_size (unless auto_flush is off)
+        '''
+        self.rows.extend(edge_rows)
+        if self.auto_flush and self.full():
+            self.flush()
+
+    def full(self):
+        return len(self.rows) >= self.batch_size
+
+    def flush(self):
+        '''
+        Writes all the collected edges. Nodes are MERGEd on their key, so that a node is created only if it does not exist yet
+        '''
+        if len(self.rows) == 0:
+            return
+
+        with metrics.timer("neo4j_write"):
+            # Labels not known upfront (e.g. a NER type the model did not list) get their index before the first write
+            self.ensure_schema({row.head_label for row in self.rows} | {row.tail_label for row in self.rows})
+
+            # Without merge_edges every row is an edge of its own (count 1). With it, the repeats within the batch are written once
+            counted_rows = aggregate(self.rows) if self.merge_edges else [(row, 1) for row in self.rows]
+            ts = datetime.now().isoformat(sep=" ")
+            groups = group_rows(counted_rows, range(len(counted_rows)), ts)
+            metrics.incr("neo4j_node_cache_hits", sum([(group[2] + group[6]) * len(params) for group, params in groups.items()]))
+
+            tx = self.G_n4j.begin()
+            node_ids = []
+            stale = self.run_groups(tx, groups, node_ids)
+            queries = len(groups)
+            if len(stale) > 0:
+                # The cached ids of nodes deleted since (or of another db) match nothing. Those ids are evicted
+                # and the rows written again, MERGEing their nodes on their keys
+                for i in stale:
+                    row = counted_rows[i][0]
+                    NODE_IDS.delete((row.head_label, row.head_key.get(C.N4J_NODE_NAME)))
+                    NODE_IDS.delete((row.tail_label, row.tail_key.get(C.N4J_NODE_NAME)))
+                metrics.incr("neo4j_node_cache_stale", len(stale))
+                log.warning(f"{len(stale)} edges had a cached node id which no longer matches a node, writing them again")
+                retry_groups = group_rows(counted_rows, stale, ts)
+                self.run_groups(tx, retry_groups, node_ids)
+                queries += len(retry_groups)
+            self.G_n4j.commit(tx)
+            # Only the ids of committed nodes are cached
+            for node, node_id in node_ids:
+                NODE_IDS.put(node, node_id)
+            # one per query, plus the begin & the commit
+            metrics.incr("neo4j_round_trips", queries + 2)
+            metrics.incr("neo4j_edges", len(self.rows))
+            log.debug(f"Wrote {len(self.rows)} edges with {len(groups)} queries")
+            self.rows = []
+
+    def run_groups(self, tx, groups, node_ids):
+        '''
+        Runs the query of each group of edges in the transaction. Adds the ((label, name), id)s of the nodes MERGEd to node_ids.
+        Returns the indexes of the rows which were not written, as a cached node id of theirs did not match a node
+        '''
+        stale = []
+        for group, params in groups.items():
+            records = tx.run(self.cypher(*group), rows=params).data()
+            head_label, head_key_names, head_cached, rel_type, tail_label, tail_key_names, tail_cached = group
+            for record in records:
+                if returns_id(head_label, head_cached):
+                    node_ids.append(((head_label, record["h_name"]), record["h_id"]))
+                if returns_id(tail_label, tail_cached):
+                    node_ids.append(((tail_label, record["t_name"]), record["t_id"]))
+            if head_cached or tail_cached:
+                written = {record["i"] for record in records}
+                stale.extend([row["i"] for row in params if row["i"] not in written])
+        return stale
+
+    def warm_node_ids(self, limit=C.N4J_NODE_CACHE_WARM):
+        '''
+        Fills the node id cache with the nodes already in the graph (e.g. in append mode), the most connected ones first,
+        as those are the shared vocabulary (wordNet:"entity", etc.) that comes up in most sentences.
+        Opt in (C.N4J_NODE_CACHE_WARM), as the query sorts all the nodes of the graph by their degree
+        '''
+        cursor = self.G_n4j.run(f"MATCH (n) WHERE NOT n:{quote(C.PHRASE)} AND n.{C.N4J_NODE_NAME} IS NOT NULL "
+                                f"RETURN labels(n)[0] AS label, n.{C.N4J_NODE_NAME} AS name, id(n) AS id "
+                                f"ORDER BY COUNT {{ (n)--() }} DESC LIMIT $limit", limit=limit)
+        records = cursor.data()
+        # put the most connected last, so that they are the last to be evicted
+        for record in reversed(records):
+            NODE_IDS.put((record["label"], record["name"]), record["id"])
+        metrics.incr("neo4j_round_trips")
+        log.info(f"Warmed the node id cache with {len(records)} nodes")
+
+    def save(self):
+        '''
+        Nothing to do, the edges are committed by flush()
+        '''
+        pass
+
+    def close(self):
+        '''
+        Writes the edges still collected
+        '''
+        self.flush()
+
+    def cypher(self, head_label, head_key_names, head_cached, rel_type, tail_label, tail_key_names, tail_cached):
+        '''
+        Builds the UNWIND query for a group of edges. Labels and relationship types can not be parameters in cypher,
+        hence those are part of the query text while everything else is passed as parameters.
+        The nodes whose id is cached are MATCHed on it, the others MERGEd on their key, which returns their id for the cache
+        '''
+        matches = []
+        merges = []
+        returns = ["row.i AS i"] # tells which rows were written, a MATCH on a stale cached id writes nothing
+        for var, label, key_names, cached in [("h", head_label, head_key_names, head_cached), ("t", tail_label, tail_key_names, tail_cached)]:
+            if cached:
+                # MATCH before the MERGEs, as cypher does not allow a read after a write without a WITH
+                matches.append(f"MATCH ({var}) WHERE id({var}) = row.{var}_id ")
+                continue
+            key = ", ".join([f"{name}: row.{var}_key.{name}" for name in key_names])
+            merges.append(f"MERGE ({var}:{quote(label)} {{{key}}}) "
+                            f"ON CREATE SET {var} += row.{var}_props ")
+            if returns_id(label, cached):
+                returns.append(f"row.{var}_key.{C.N4J_NODE_NAME} AS {var}_name, id({var}) AS {var}_id")
+        if self.merge_edges:
+            edge = (f"MERGE (h)-[r:{quote(rel_type)}]->(t) "
+                    f"ON CREATE SET r += row.r_props, r.{C.EDGE_COUNT} = row.count, r.{C.EDGE_FIRST_SEEN} = row.ts, r.{C.EDGE_LAST_SEEN} = row.ts "
+                    f"ON MATCH SET r.{C.EDGE_COUNT} = coalesce(r.{C.EDGE_COUNT}, 1) + row.count, r.{C.EDGE_LAST_SEEN} = row.ts")
+        else:
+            edge = (f"CREATE (h)-[r:{quote(rel_type)}]->(t) "
+                    "SET r += row.r_props")
+        return ("UNWIND $rows AS row "
+                + "".join(matches) + "".join(merges) + edge
+                + f" RETURN {', '.join(returns)}")
+
+def group_rows(counted_rows, indexes, ts):
+    '''
+    Groups the (EdgeRow, count)s at the indexes by their query - (head label, head key, head cached, type, tail label, tail key, tail cached).
+    Returns a dict of group -> the query parameters of its rows, i being the index of the row
+    '''
+    groups = {}
+    for i in indexes:
+        row, count = counted_rows[i]
+        h_id = cached_node_id(row.head_label, row.head_key)
+        t_id = cached_node_id(row.tail_label, row.tail_key)
+        group = (row.head_label, tuple(row.head_key), h_id is not None, row.rel_type, row.tail_label, tuple(row.tail_key), t_id is not None)
+        groups.setdefault(group, []).append({"i":i, "h_key":row.head_key, "h_id":h_id, "h_props":row.head_props, "r_props":row.rel_props,
+                                            "t_key":row.tail_key, "t_id":t_id, "t_props":row.tail_props,
+                                            "count":count, "ts":ts})
+    return groups
+
+def aggregate(rows):
+    '''
+    Combines the EdgeRows of the same edge - same head, type & tail. Returns (the first of the EdgeRows, how many there were)s in the order first seen
+    '''
+    counted = {}
+    for row in rows:
+        edge = (row.head_label, tuple(row.head_key.items()), row.rel_type, row.tail_label, tuple(row.tail_key.items()))
+        if edge in counted:
+            counted[edge][1] += 1
+        else:
+            counted[edge] = [row, 1]
+    return [(row, count) for row, count in counted.values()]
+
+def cached_node_id(label, key):
+    '''
+    Returns the cached neo4j id of the node, None if it is not cached. Phrase nodes are never cached, as they are per sentence
+    '''
+    if label == C.PHRASE:
+        return None
+    return NODE_IDS.get((label, key[C.N4J_NODE_NAME]))
+
+def returns_id(label, cached):
+    '''
+    Tells if the query returns the id of the node, for the cache - for the nodes that are shared across sentences & not cached yet
+    '''
+    return label != C.PHRASE and not cached
+
+class NetworkXGraphWriter:
+    """
+    Writes the edges to an in-process networkx MultiDiGraph instead of neo4j, e.g. for fast local runs, testing & benchmarking.
+    The semantics are those of Neo4jGraphWriter: a node is created once per label & key (its other properties are set only then),
+    while every edge is a new one - or with merge_edges, there is one edge per (head, type, tail) counting how often it was seen.
+    The graph can be saved to (and in append mode continued from) a GraphML file
+    """
+    def __init__(self, filepath=None, append=False, batch_size=C.N4J_BATCH_SIZE, merge_edges=C.GRAPH_MERGE_EDGES):
+        '''
+        :param filepath: the GraphML file the graph is saved to by save() & close(). None keeps the graph in memory only
+        :param append: continue the graph saved in filepath, if there is one
+        :param batch_size: the number of edges after which the collected edges get added to the graph
+        :param merge_edges: keep one edge per (head, type, tail) with a count & first / last seen, rather than one per sentence
+        '''
+        import networkx as nx
+        self.nx = nx
+        self.filepath = filepath
+        self.batch_size = batch_size
+        self.merge_edges = merge_edges
+        self.auto_flush = True
+        self.rows = []
+        if append and filepath is not None and os.path.exists(filepath):
+            self.G = nx.read_graphml(filepath, force_multigraph=True)
+            log.info(f"Continuing the graph in {filepath}: {self.G.number_of_nodes()} nodes, {self.G.number_of_edges()} edges")
+        else:
+            self.G = nx.MultiDiGraph()
+
+    def ensure_schema(self, labels):
+        '''
+        Nothing to do, the nodes are looked up by their id
+        '''
+        pass
+
+    def add(self, edge_rows):
+        '''
+        Adds the EdgeRows to the current batch. The batch is added to the graph once it has reached the batch_size (unless auto_flush is off)
+        '''
+        self.rows.extend(edge_rows)
+        if self.auto_flush and self.full():
+            self.flush()
+
+    def full(self):
+        return len(self.rows) >= self.batch_size
+
+    def flush(self):
+        '''
+        Adds all the collected edges to the graph. The graph is only in memory till save()
+        '''
+        if len(self.rows) == 0:
+            return
+        with metrics.timer("networkx_write"):
+            ts = datetime.now().isoformat(sep=" ")
+            counted_rows = aggregate(self.rows) if self.merge_edges else [(row, 1) for row in self.rows]
+            for row, count in counted_rows:
+                head = self.merge_node(row.head_label, row.head_key, row.head_props)
+                tail = self.merge_node(row.tail_label, row.tail_key, row.tail_props)
+                if not self.merge_edges:
+                    self.G.add_edge(head, tail, type=row.rel_type, **without_nones(row.rel_props))
+                elif self.G.has_edge(head, tail, key=row.rel_type):
+                    # the edges are keyed on their type, the one edge of the type between the nodes
+                    edge = self.G.edges[head, tail, row.rel_type]
+                    edge[C.EDGE_COUNT] = edge.get(C.EDGE_COUNT, 1) + count
+                    edge[C.EDGE_LAST_SEEN] = ts
+                else:
+                    self.G.add_edge(head, tail, key=row.rel_type, type=row.rel_type, **without_nones(row.rel_props),
+                                    **{C.EDGE_COUNT:count, C.EDGE_FIRST_SEEN:ts, C.EDGE_LAST_SEEN:ts})
+            metrics.incr("networkx_edges", len(counted_rows))
+            self.rows = []
+
+    def merge_node(self, label, key, props):
+        '''
+        Returns the id of the node with the label & key, creating it with the props if it does not exist yet.
+        The id is made of the label & the key values, so that it can be looked up and survives a GraphML round trip
+        '''
+        node_id = ":".join([label] + [str(value) for value in key.values()])
+        if node_id not in self.G:
+            self.G.add_node(node_id, label=label, **without_nones(key), **without_nones(props))
+        return node_id
+
+    def close(self):
+        '''
+        Adds the collected edges and saves the graph to the GraphML file
+        '''
+        self.flush()
+        self.save()
+
+    def save(self):
+        '''
+        Saves the graph to the GraphML file. It is written as .tmp and renamed, so that a crash never leaves a half written file
+        '''
+        if self.filepath is None:
+            return
+        with metrics.timer("networkx_write"):
+            self.nx.write_graphml(self.G, self.filepath + ".tmp")
+            os.replace(self.filepath + ".tmp", self.filepath)
+        log.info(f"Saved the graph to {self.filepath}: {self.G.number_of_nodes()} nodes, {self.G.number_of_edges()} edges")
+
+def without_nones(props):
+    # GraphML can not hold None values
+    return {name:value for name, value in props.items() if value is not None}
+
+def make_graph_writer(sink, mode, merge_edges=C.GRAPH_MERGE_EDGES, graphml_path=C.GRAPHML_PATH):
+    '''
+    Returns the graph writer for the sink, along with the py2neo Graph for neo4j (None for the other sinks).
+    py2neo & networkx are imported only when their sink is used
+    :param sink: C.GRAPH_SINK_NEO4J | C.GRAPH_SINK_NETWORKX
+    :param mode: truncate | append. truncate starts from an empty graph
+    :param merge_edges: one edge per (head, type, tail) with a count, see Neo4jGraphWriter
+    :param graphml_path: the GraphML file of the networkx sink
+    '''
+    if sink == C.GRAPH_SINK_NEO4J:
+        import py2neo as p2n
+        G_n4j = p2n.Graph(C.NEO4J_URI, auth=(C.NEO4J_USER, C.NEO4J_PASSWORD))
+        graph_writer = Neo4jGraphWriter(G_n4j, merge_edges=merge_edges)
+        if mode == "truncate":
+            G_n4j.delete_all()
+        elif C.N4J_NODE_CACHE_WARM > 0:
+            graph_writer.warm_node_ids()
+        return G_n4j, graph_writer
+    if sink == C.GRAPH_SINK_NETWORKX:
+        return None, NetworkXGraphWriter(graphml_path, append=mode != "truncate", merge_edges=merge_edges)
+    raise ValueError(f"Unknown graph sink {sink}")
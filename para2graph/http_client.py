@@ -0,0 +1,68 @@
+#----------------------------#
+# Author: Surjit Das
+# Email: surjitdas@gmail.com
+# Program: artmind
+#----------------------------#
+
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+RETRY_STATUSES = [429, 500, 502, 503, 504]
+
+def make_session(pool_size, retries, backoff, user_agent=None):
+    '''
+    Creates a requests Session which keeps the connections alive and reuses them across calls (no TCP/TLS handshake per call).
+    Calls failing to connect, or answered with 429 or 5xx, are retried with exponential backoff (backoff * 2^n seconds),
+    and a Retry-After sent by the server is honoured.
+    A read timeout is not retried - a hanging endpoint then costs one timeout per call, rather than one per try.
+    The retries happen within the session, so they do not go through the RateLimiter of the endpoint; their backoff spaces them out instead
+    :param pool_size: the max number of connections kept per host. Should be at least the number of threads using the session
+    :param retries: the max number of retries per call
+    :param backoff: the backoff factor in seconds
+    '''
+    retry = Retry(total=retries, read=0, backoff_factor=backoff, status_forcelist=RETRY_STATUSES,
+                    allowed_methods=None, # retry POSTs too, all the calls here are lookups
+                    respect_retry_after_header=True, raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    if user_agent is not None:
+        session.headers["User-Agent"] = user_agent
+    return session
+
+class RateLimiter:
+    """
+    Spaces out the calls to an endpoint to at most rate calls per second, across all the threads using it.
+    The limit is per process - processes calling the same endpoint each get a share of the rate, see per_process_rate_limits
+    """
+    def __init__(self, rate):
+        '''
+        :param rate: the max calls per second. None for no limit
+        '''
+        self.interval = 1 / rate if rate else 0
+        self.next_at = 0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        '''
+        Blocks till the caller is allowed to make the next call
+        '''
+        if self.interval == 0:
+            return
+        with self.lock:
+            now = time.monotonic()
+            call_at = max(now, self.next_at)
+            self.next_at = call_at + self.interval
+        if call_at > now:
+            time.sleep(call_at - now)
+
+def per_process_rate_limits(rate_limits, processes):
+    '''
+    Splits the rate limits (source -> max calls per second, None for no limit) evenly across the processes calling the sources,
+    so that together they stay within the limits
+    '''
+    return {source:rate / processes if rate else rate for source, rate in rate_limits.items()}
@@ -0,0 +1,65 @@
+#----------------------------#
+# Author: Surjit Das
+# Email: surjitdas@gmail.com
+# Program: artmind
+#----------------------------#
+
+import bz2
+import gzip
+import os
+import sys
+from tqdm import tqdm
+
+GZIP_MAGIC = b"\x1f\x8b"
+BZ2_MAGIC = b"BZh"
+
+def open_input(filepath):
+    '''
+    Opens the input for reading bytes. Returns the stream to read the lines from, and the underlying raw file
+    which tells how far the (possibly compressed) input has been read.
+    The compression is detected from the first bytes, so that compressed stdin works too
+    :param filepath: a plain, gzip or bz2 file. "-" reads from stdin
+    '''
+    if filepath == "-":
+        raw = sys.stdin.buffer
+    else:
+        raw = open(filepath, "rb")
+
+    magic = raw.peek(3)[:3]
+    if magic.startswith(GZIP_MAGIC):
+        return gzip.GzipFile(fileobj=raw), raw
+    if magic.startswith(BZ2_MAGIC):
+        return bz2.BZ2File(raw), raw
+    return raw, raw
+
+def read_lines(filepath, start_offset=0, desc="Processing sentences"):
+    '''
+    Yields the lines of the input one at a time, so that memory stays flat whatever the size of the input.
+    Each line comes with the byte offset (in the uncompressed input) right after it, i.e. where the next line starts.
+    The progress is shown in bytes of the input file read so far (compressed bytes for compressed input)
+    :param filepath: a plain, gzip or bz2 file, or "-" for stdin
+    :param start_offset: the byte offset to start from, e.g. to resume. Plain files are seeked, other inputs are read up to it
+    '''
+    stream, raw = open_input(filepath)
+    total = os.path.getsize(filepath) if filepath != "-" else None
+    offset = 0
+    if start_offset > 0 and stream is raw and raw.seekable():
+        raw.seek(start_offset)
+        offset = start_offset
+    try:
+        with tqdm(total=total, unit="B", unit_scale=True, desc=desc) as progress:
+            position = 0
+            for line in stream:
+                if raw.seekable():
+                    progress.update(raw.tell() - position)
+                    position = raw.tell()
+                else:
+                    progress.update(len(line))
+                offset += len(line)
+                if offset <= start_offset:
+                    continue
+                yield offset, line.decode("utf8")
+    finally:
+        if raw is not sys.stdin.buffer:
+            stream.close()
+            raw.close()
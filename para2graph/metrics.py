@@ -0,0 +1,184 @@
+#----------------------------#
+# Author: Surjit Das
+# Email: surjitdas@gmail.com
+# Program: artmind
+#----------------------------#
+
+import constants as C
+import json
+import math
+import time
+
+'''
+Per stage timings and counters of the processing, enabled with run.py --profile.
+The stages are timed with `with metrics.timer("stage"):` and the counters bumped with metrics.incr("name").
+When disabled (the default), timer returns a shared no-op context and incr returns right away, so the cost is one attribute check.
+The timings go into fixed size log bucketed histograms, so the memory stays flat however many sentences are processed,
+and the percentiles are exact to within the bucket width (C.METRICS_HISTOGRAM_PRECISION)
+'''
+
+class Histogram:
+    """
+    A histogram of durations in seconds, with log sized buckets: bucket i holds the values in [base^i, base^(i+1))
+    """
+    def __init__(self, precision=C.METRICS_HISTOGRAM_PRECISION):
+        self.log_base = math.log(1 + precision)
+        self.buckets = {}
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, value):
+        i = math.floor(math.log(max(value, 1e-9)) / self.log_base)
+        self.buckets[i] = self.buckets.get(i, 0) + 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def percentile(self, p):
+        '''
+        Returns the upper bound of the bucket in which the p-th percentile (0-100) falls
+        '''
+        if self.count == 0:
+            return 0.0
+        rank = math.ceil(self.count * p / 100)
+        seen = 0
+        for i in sorted(self.buckets):
+            seen += self.buckets[i]
+            if seen >= rank:
+                return min(math.exp((i + 1) * self.log_base), self.max)
+        return self.max
+
+    def to_dict(self):
+        return {"buckets":self.buckets, "count":self.count, "total":self.total, "max":self.max}
+
+    def merge(self, histogram):
+        '''
+        Adds the counts of a histogram in its to_dict form, e.g. from a worker process
+        '''
+        for i, count in histogram["buckets"].items():
+            self.buckets[int(i)] = self.buckets.get(int(i), 0) + count
+        self.count += histogram["count"]
+        self.total += histogram["total"]
+        self.max = max(self.max, histogram["max"])
+
+class NullTimer:
+    """
+    The timer used when the metrics are disabled. A single shared instance which does nothing
+    """
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+NULL_TIMER = NullTimer()
+
+class Timer:
+    """
+    Times the block it wraps and adds the duration to the histogram of its stage
+    """
+    def __init__(self, metrics, stage):
+        self.metrics = metrics
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.record(self.stage, time.perf_counter() - self.start)
+        return False
+
+class Metrics:
+    def __init__(self):
+        self.enabled = False
+        self.histograms = {} # stage -> Histogram
+        self.counters = {} # name -> count
+
+    def enable(self):
+        self.enabled = True
+
+    def reset(self):
+        self.histograms = {}
+        self.counters = {}
+
+    def timer(self, stage):
+        '''
+        Returns the context manager timing the stage
+        '''
+        if not self.enabled:
+            return NULL_TIMER
+        return Timer(self, stage)
+
+    def timed(self, iterable, stage):
+        '''
+        Yields from the iterable, timing each step as the stage. For lazy producers like nlp.pipe, whose work happens in next()
+        '''
+        if not self.enabled:
+            return iterable
+        return self._timed(iter(iterable), stage)
+
+    def _timed(self, iterator, stage):
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            self.record(stage, time.perf_counter() - start)
+            yield item
+
+    def record(self, stage, seconds):
+        histogram = self.histograms.get(stage)
+        if histogram is None:
+            histogram = self.histograms[stage] = Histogram()
+        histogram.add(seconds)
+
+    def incr(self, name, n=1):
+        if not self.enabled:
+            return
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def snapshot(self):
+        '''
+        Returns the metrics as plain dicts, which can be sent across processes and merged with merge()
+        '''
+        return {"histograms":{stage:histogram.to_dict() for stage, histogram in self.histograms.items()},
+                "counters":dict(self.counters)}
+
+    def merge(self, snapshot):
+        for stage, histogram in snapshot["histograms"].items():
+            self.histograms.setdefault(stage, Histogram()).merge(histogram)
+        for name, count in snapshot["counters"].items():
+            self.counters[name] = self.counters.get(name, 0) + count
+
+    def summary(self):
+        '''
+        Returns the count, total, mean, p50, p95, p99 & max (in seconds) per stage, and the counters
+        '''
+        stages = {}
+        for stage, histogram in sorted(self.histograms.items(), key=lambda item: -item[1].total):
+            stages[stage] = {"count":histogram.count, "total":histogram.total, "mean":histogram.total / histogram.count,
+                                "p50":histogram.percentile(50), "p95":histogram.percentile(95), "p99":histogram.percentile(99),
+                                "max":histogram.max}
+        return {"stages":stages, "counters":dict(sorted(self.counters.items()))}
+
+    def report(self):
+        '''
+        Returns the summary as a printable table, the stages with the most total time first
+        '''
+        summary = self.summary()
+        lines = [f"{'stage':<24}{'count':>10}{'total s':>12}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}"]
+        for stage, s in summary["stages"].items():
+            lines.append(f"{stage:<24}{s['count']:>10}{s['total']:>12.3f}{s['mean'] * 1000:>10.3f}{s['p50'] * 1000:>10.3f}"
+                            f"{s['p95'] * 1000:>10.3f}{s['p99'] * 1000:>10.3f}{s['max'] * 1000:>10.3f}")
+        for name, count in summary["counters"].items():
+            lines.append(f"{name:<24}{count:>10}")
+        return "\n".join(lines)
+
+    def export_json(self, filepath):
+        with open(filepath, "w") as fp:
+            json.dump(self.summary(), fp, indent=2)
+
+metrics = Metrics()
@@ -6,89 +6,105 @@
 
 from dataclasses import dataclass
 import constants as C
-import py2neo as p2n
 from loguru import logger as log
-import py2neo as p2n
 from datetime import datetime
-import pandas as pd
+import json
+import os
+from graph_writer import Neo4jGraphWriter, to_edge_row
+from metrics import metrics
+
+@dataclass
+class SentenceRecord:
+    '''
+    The outcome of extracting a sentence - the rows for the sentences table and the edges for the graph.
+    It holds plain python values only, so that it can be passed between processes
+    '''
+    sentence_uuid: str
+    token_rows: list
+    edge_rows: list
 
 class SentenceGraph:
-    def __init__(self, G_n4j, sentence_uuid) -> None:
+    def __init__(self, G_n4j, sentence_uuid, graph_writer=None) -> None:
+        '''
+        :param G_n4j: the py2neo Graph. None when the graph goes to another sink, in which case the graph_writer must be given
+        :param sentence_uuid: the unique id of the sentence
+        :param graph_writer: the graph writer (Neo4jGraphWriter | NetworkXGraphWriter) collecting the edges across sentences.
+                                If not given, the sentence is written to G_n4j on its own
+        '''
         self.G_n4j = G_n4j
         self.sentence_uuid = sentence_uuid
+        self.graph_writer = graph_writer
 
     def save(self, ph_3plets, ner_pos_3plets, kb3_plets):
         '''
-        This function saves the sentence phrases into neo4j. It ensure creation of single nodes per phrase.
-        This is achieved by first checking if the node is there in neo4j db based on phrase text and s_uuid.
-        A new node is created only if the the node does not exist yet
+        This function saves the sentence phrases into the graph. It ensure creation of single nodes per phrase.
+        The edges are handed over to the graph writer, which MERGEs the nodes on phrase text and s_uuid (other nodes on the name),
+        so a new node is created only if the the node does not exist yet
+        '''
+        edge_rows = self.edge_rows(ph_3plets, ner_pos_3plets, kb3_plets)
+        if self.graph_writer is None:
+            graph_writer = Neo4jGraphWriter(self.G_n4j)
+            graph_writer.add(edge_rows)
+            graph_writer.flush()
+        else:
+            self.graph_writer.add(edge_rows)
+
+    def edge_rows(self, ph_3plets, ner_pos_3plets, kb3_plets):
+        '''
+        Converts the triplets of the sentence into EdgeRows
         '''
+        edge_rows = []
         for ph_3plet in ph_3plets:
             log.debug(f"{ph_3plet=}")
-
-            head = self.G_n4j.nodes.match(C.PHRASE, name=ph_3plet.head.phrase, s_uuid=self.sentence_uuid).first()
-            if head is None:
-                head = ph_3plet.head
-            tail = self.G_n4j.nodes.match(C.PHRASE, name=ph_3plet.tail.phrase, s_uuid=self.sentence_uuid).first()
-            if tail is None:
-                tail = ph_3plet.tail
             link_phrase = ph_3plet.phrase
             if link_phrase == '':
                 link_phrase = "-x-"
+            edge_rows.append(to_edge_row(ph_3plet.head, link_phrase, {C.N4J_SENTENCE_UUID:self.sentence_uuid, C.CLASSIFICATION:C.PHRASE_LINK}, ph_3plet.tail))
 
-            log.debug(f"{head=}, {ph_3plet.phrase=}, {tail=}")
-            phrase_edge = PhraseEdge(head, link_phrase , tail, self.sentence_uuid)
-            self.G_n4j.create(phrase_edge)
-
-        for ner_pos_3plet in ner_pos_3plets:
-            log.debug(f"{ner_pos_3plet=}")
-
-            head = self.G_n4j.nodes.match(C.PHRASE, name=ner_pos_3plet.head.phrase, s_uuid=self.sentence_uuid).first()
-            if head is None:
-                head = ner_pos_3plet.head
-            tail = self.G_n4j.nodes.match(ner_pos_3plet.tail.type, name=ner_pos_3plet.tail.text).first()
-            if tail is None:
-                tail = ner_pos_3plet.tail
-
-            log.debug(f"{head=}, {tail=}")
-            edge = PhraseInfoEdge(head, tail)
-            self.G_n4j.create(edge)
-
-        for kb3_plet in kb3_plets:
-            log.debug(f"{kb3_plet=}")
-
-            head = self.G_n4j.nodes.match(kb3_plet.head.type, name=kb3_plet.head.text).first()
-            if head is None:
-                head = kb3_plet.head
-            tail = self.G_n4j.nodes.match(kb3_plet.tail.type, name=kb3_plet.tail.text).first()
-            if tail is None:
-                tail = kb3_plet.tail
-
-            log.debug(f"{head=}, {tail=}")
-            edge = PhraseInfoEdge(head, tail)
-            self.G_n4j.create(edge)            
+        for info_3plet in ner_pos_3plets + kb3_plets:
+            log.debug(f"{info_3plet=}")
+            edge_rows.append(to_edge_row(info_3plet.head, "-", {}, info_3plet.tail))
+        return edge_rows
 
 
 class SentenceTable:
-    def __init__(self, db) -> None:
+    def __init__(self, db, commit_interval=C.SQL_COMMIT_INTERVAL) -> None:
+        '''
+        :param db: the sqlite3 connection
+        :param commit_interval: the number of sentences whose rows are inserted in one go and committed
+        '''
         self.db = db
+        self.commit_interval = commit_interval
+        self.rows = []
+        self.pending_sentences = 0
+        self.auto_flush = True # False leaves the flushing to the caller, e.g. to line the commits up with the ingest journal
+        self.db.execute(f"create table if not exists {C.TAB_SENTENCES} ({', '.join(C.COLUMNS_SENTENCES)})")
 
     def persist(self, sentence_uuid, sentence):
         '''
         This function saves the sentence tokens along with the token information, as well as NERs to the database
+        The rows are collected and written by flush, once commit_interval sentences have been collected
         '''        
+        rows, ners, nouns, adjs, verbs = self.token_rows(sentence_uuid, sentence)
+        self.add(rows)
+        return ners, nouns, adjs, verbs
+
+    @staticmethod
+    def token_rows(sentence_uuid, sentence):
+        '''
+        Returns the rows (as tuples in the order of C.COLUMNS_SENTENCES) for the sentence tokens and NERs,
+        along with the NERs, nouns, adjectives and verbs of the sentence
+        '''
+        rows = []
         ners = []
         nouns = []
         adjs = []
         verbs = []
+        ts = datetime.now().isoformat(sep=" ")
         log.debug("|token.text| token.dep_| token.pos_| token.head.text|token.lemma_|")
-        df = pd.DataFrame()
         for token in sentence:
             log.debug(f"|{token.text:<12}| {token.dep_:<10}| {token.pos_:<10}| {token.head.text:12}|{token.lemma_:12}")
-            row = {C.COL_SENT_UUID:sentence_uuid, C.COL_TYPE:C.COL_TYPE_VAL_TOKEN, C.COL_ITEM:token.text, 
-                    C.COL_TOKEN_DEP:token.dep_, C.COL_TOKEN_POS:token.pos_, C.COL_TOKEN_HEAD_TEXT:token.head.text, C.COL_TOKEN_LEMMA:token.lemma_,
-                    C.COL_TS: datetime.now()}
-            df = df.append(row, ignore_index=True)
+            rows.append((sentence_uuid, C.COL_TYPE_VAL_TOKEN, None, token.text, token.dep_, token.pos_, token.head.text, token.lemma_, ts))
             if token.pos_ in [C.POS_NOUN, C.POS_PROPER_NOUN]:
                 nouns.append(token.text)
             if token.pos_ == C.POS_ADJ:
@@ -97,22 +113,102 @@ class SentenceTable:
                 verbs.append(token.lemma_)
 
         for entity in sentence.ents:
-            ner_row = {C.COL_SENT_UUID:sentence_uuid, C.COL_TYPE:C.NER, C.COL_ITEM:entity.text, C.COL_NER_TYPE:entity.label_, C.COL_TS:datetime.now()}
-            df = df.append(ner_row, ignore_index=True)
+            rows.append((sentence_uuid, C.NER, entity.label_, entity.text, None, None, None, None, ts))
             ners.append([entity.text, entity.label_])
-        
-        df.to_sql(C.TAB_SENTENCES, self.db, if_exists="append", index=False)
 
         log.debug(f"{ners=}, {nouns=}, {adjs=}, {verbs=}")
-        return ners, nouns, adjs, verbs
+        return rows, ners, nouns, adjs, verbs
+
+    def add(self, rows):
+        '''
+        Adds the rows of a sentence to the ones to be written. Flushes once commit_interval sentences are pending (unless auto_flush is off)
+        '''
+        self.rows.extend(rows)
+        self.pending_sentences += 1
+        if self.auto_flush and self.full():
+            self.flush()
+
+    def full(self):
+        return self.pending_sentences >= self.commit_interval
+
+    def flush(self):
+        '''
+        Inserts all the collected rows with a single executemany and commits them as one transaction
+        '''
+        if len(self.rows) > 0:
+            sql_str = f"insert into {C.TAB_SENTENCES} ({', '.join(C.COLUMNS_SENTENCES)}) values ({', '.join(['?'] * len(C.COLUMNS_SENTENCES))})"
+            with metrics.timer("sql_write"):
+                with self.db:
+                    self.db.executemany(sql_str, self.rows)
+            metrics.incr("sql_rows", len(self.rows))
+            log.debug(f"Inserted {len(self.rows)} rows of {self.pending_sentences} sentences")
+        self.rows = []
+        self.pending_sentences = 0
+
+class IngestJournal:
+    def __init__(self, db, input_file) -> None:
+        '''
+        The checkpoint journal of a file being ingested. Each row records the byte offset of the input up to which
+        everything has been written, along with the uuids of the sentences written since the previous row
+        :param db: the sqlite3 connection
+        :param input_file: the file being ingested
+        '''
+        self.db = db
+        self.input_file = os.path.abspath(input_file) if input_file != "-" else input_file
+        self.byte_offset = None
+        self.sentence_uuids = []
+        self.db.execute(f"create table if not exists {C.TAB_INGEST_JOURNAL} ({', '.join(C.COLUMNS_JOURNAL)})")
+
+    def last_offset(self):
+        '''
+        Returns the byte offset up to which the input file has been ingested, 0 if it has not been ingested before
+        '''
+        sql_str = f"select max({C.COL_BYTE_OFFSET}) from {C.TAB_INGEST_JOURNAL} where {C.COL_INPUT_FILE}=?"
+        row = self.db.execute(sql_str, (self.input_file,)).fetchone()
+        return row[0] if row[0] is not None else 0
+
+    def reset(self):
+        '''
+        Forgets the progress of the input file, for a run that starts over
+        '''
+        with self.db:
+            self.db.execute(f"delete from {C.TAB_INGEST_JOURNAL} where {C.COL_INPUT_FILE}=?", (self.input_file,))
+
+    def add(self, byte_offset, sentence_uuids):
+        '''
+        Notes that the input up to byte_offset has been processed into the given sentences. It gets recorded by flush
+        '''
+        self.byte_offset = byte_offset
+        self.sentence_uuids.extend(sentence_uuids)
+
+    def flush(self):
+        '''
+        Records the progress noted since the last flush. Must only be called once everything noted has been written to the db & graph
+        '''
+        if self.byte_offset is None:
+            return
+        sql_str = f"insert into {C.TAB_INGEST_JOURNAL} ({', '.join(C.COLUMNS_JOURNAL)}) values (?, ?, ?, ?)"
+        with self.db:
+            self.db.execute(sql_str, (self.input_file, self.byte_offset, json.dumps(self.sentence_uuids), datetime.now().isoformat(sep=" ")))
+        log.debug(f"Journal: {self.input_file} done up to {self.byte_offset}")
+        self.byte_offset = None
+        self.sentence_uuids = []
 
 class ExternalKBsTable:
     ...
 
-class PhraseNode(p2n.Node):
+class PhraseNode:
+    """
+    The phrase nodes & the other node and edge classes below are plain records with __slots__, as a sentence makes a lot of them
+    and they are only used to build the triplets. They are converted to the form of the graph (EdgeRows) in SentenceGraph.edge_rows.
+    Each node has the label it gets in the graph, the key properties it is identified by & the remaining properties
+    """
+    __slots__ = ("sentence_uuid", "phrase", "classification")
+    label = C.PHRASE
+
     def __init__(self, sentence_uuid, phrase, classification):
         '''
-        Creates a Node which is specific to a Phrase. It automatically puts the neo4j Node's label as "Phrase"
+        Creates a Node which is specific to a Phrase. Its label in the graph is "Phrase"
         :param sentence_uuid: the unique id of the sentence
         :param phrase: this is the text that will show up on the graph Node
         :param classification: this is the type of phrase - Subject, Object, Attribute, etc.
@@ -120,25 +216,35 @@ class PhraseNode(p2n.Node):
         self.sentence_uuid = sentence_uuid
         self.phrase = phrase
         self.classification = classification
-        # The Node is created with the values that are used during initialization. Even if the attributes are set, they are of no use per se.
-        super().__init__(C.PHRASE, name=phrase, s_uuid=sentence_uuid, classification=classification)
+
+    @property
+    def key(self):
+        return {C.N4J_NODE_NAME:self.phrase, C.N4J_SENTENCE_UUID:self.sentence_uuid}
+
+    @property
+    def props(self):
+        return {C.CLASSIFICATION:self.classification}
 
     def __eq__(self, other):
         '''
         Equals if name=phrase & sentencue_uuid matches. Ignored classification.
         '''
-        if (self.sentence_uuid == other.sentence_uuid and self.phrase == other.phrase):
-            return True
-        else:
-            return False
+        if not isinstance(other, PhraseNode):
+            return NotImplemented
+        return self.sentence_uuid == other.sentence_uuid and self.phrase == other.phrase
 
     def __hash__(self):
-        return super().__hash__()
+        return hash((self.sentence_uuid, self.phrase))
+
+    def __repr__(self):
+        return f"PhraseNode({self.sentence_uuid!r}, {self.phrase!r}, {self.classification!r})"
+
+class PhraseEdge:
+    __slots__ = ("head", "phrase", "tail", "sentence_uuid")
 
-class PhraseEdge(p2n.Relationship):
     def __init__(self, head, phrase, tail, sentence_uuid):
         '''
-        Creates an Edge which is specific to a Phrase. It adds the Relationship property for classification as "Phrase_Link"
+        Creates an Edge which is specific to a Phrase. In the graph it gets the classification "Phrase_Link"
         :param head: The head PhraseNode
         :param tail: The tail PhraseNode
         :param sentence_uuid: the unique id of the sentence
@@ -148,52 +254,96 @@ class PhraseEdge(p2n.Relationship):
         self.phrase = phrase # neo4j relationship type 
         self.tail = tail
         self.sentence_uuid = sentence_uuid
-        # The Edge is created with the values that are used during initialization. Even if the attributes are set, they are of no use per se. 
-        # Hence a new one needs to be created if you want different values. That's what is happening in the Sentence_Graph.save()
-        super().__init__(head, phrase, tail, s_uuid=sentence_uuid, classification=C.PHRASE_LINK)
 
-class NounNode(p2n.Node):
+    def __eq__(self, other):
+        if not isinstance(other, PhraseEdge):
+            return NotImplemented
+        return (self.head, self.phrase, self.tail, self.sentence_uuid) == (other.head, other.phrase, other.tail, other.sentence_uuid)
+
+    def __hash__(self):
+        return hash((self.head, self.phrase, self.tail, self.sentence_uuid))
+
+    def __repr__(self):
+        return f"PhraseEdge({self.head!r}, {self.phrase!r}, {self.tail!r}, {self.sentence_uuid!r})"
+
+class TermNode:
+    """
+    The base of the nodes that are identified by their text only (nouns, NERs, adjectives, verbs & KB infos), across sentences.
+    The type is the label of the node in the graph
+    """
+    __slots__ = ("text", "type")
+
+    def __init__(self, text, node_type):
+        self.text = text
+        self.type = node_type
+
+    @property
+    def label(self):
+        return self.type
+
+    @property
+    def key(self):
+        return {C.N4J_NODE_NAME:self.text}
+
+    @property
+    def props(self):
+        return {}
+
+    def __eq__(self, other):
+        if not isinstance(other, TermNode):
+            return NotImplemented
+        return self.type == other.type and self.text == other.text
+
+    def __hash__(self):
+        return hash((self.type, self.text))
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.text!r}, {self.type!r})"
+
+class NounNode(TermNode):
+    __slots__ = ()
+
     def __init__(self, noun_text):
         '''
-        Creates a Node which is specific to a Noun. It automatically puts the neo4j Node's label as "Noun"
+        Creates a Node which is specific to a Noun. Its label in the graph is "Noun"
         :param noun_text: this is the text that will show up on the graph Node
         '''
-        self.text = noun_text
-        self.type = C.NOUN
-        super().__init__(C.NOUN, name=noun_text)
+        super().__init__(noun_text, C.NOUN)
+
+class NERNode(TermNode):
+    __slots__ = ()
 
-class NERNode(p2n.Node):
     def __init__(self, ner_text, ner_type):
         '''
-        Creates a Node which is specific to a NER. It automatically puts the neo4j Node's label as the NER type
+        Creates a Node which is specific to a NER. Its label in the graph is the NER type
         :param ner_text: this is the text that will show up on the graph Node
         :param ner_type: this is the label of the n4j Node
         '''
-        self.text = ner_text
-        self.type = ner_type
-        super().__init__(ner_type, name=ner_text)
+        super().__init__(ner_text, ner_type)
+
+class AdjNode(TermNode):
+    __slots__ = ()
 
-class AdjNode(p2n.Node):
     def __init__(self, adj_text):
         '''
-        Creates a Node which is specific to an Adjective. It automatically puts the neo4j Node's label as "Adjective"
+        Creates a Node which is specific to an Adjective. Its label in the graph is "Adjective"
         :param adj_text: this is the text that will show up on the graph Node
         '''
-        self.text = adj_text
-        self.type = C.ADJ
-        super().__init__(C.ADJ, name=adj_text)     
+        super().__init__(adj_text, C.ADJ)
+
+class VerbNode(TermNode):
+    __slots__ = ()
 
-class VerbNode(p2n.Node):
     def __init__(self, verb_text):
         '''
-        Creates a Node which is specific to an Verb. It automatically puts the neo4j Node's label as "Verb"
+        Creates a Node which is specific to an Verb. Its label in the graph is "Verb"
         :param verb_text: this is the text that will show up on the graph Node
         '''
-        self.text = verb_text
-        self.type = C.VERB
-        super().__init__(C.VERB, name=verb_text)              
+        super().__init__(verb_text, C.VERB)
+
+class PhraseInfoEdge:
+    __slots__ = ("head", "tail")
 
-class PhraseInfoEdge(p2n.Relationship):
     def __init__(self, head, tail):
         '''
         Creates an Edge which is specific to a Phrase. 
@@ -202,18 +352,25 @@ class PhraseInfoEdge(p2n.Relationship):
         '''
         self.head = head
         self.tail = tail
-        # The Edge is created with the values that are used during initialization. Even if the attributes are set, they are of no use per se. 
-        # Hence a new one needs to be created if you want different values. That's what is happening in the Sentence_Graph.save()
-        super().__init__(head, "-", tail)
 
-class KBNode(p2n.Node):
+    def __eq__(self, other):
+        if not isinstance(other, PhraseInfoEdge):
+            return NotImplemented
+        return self.head == other.head and self.tail == other.tail
+
+    def __hash__(self):
+        return hash((self.head, self.tail))
+
+    def __repr__(self):
+        return f"PhraseInfoEdge({self.head!r}, {self.tail!r})"
+
+class KBNode(TermNode):
+    __slots__ = ()
+
     def __init__(self, text, kb_source):
         '''
-        Creates a Node which is specific to a KB. It automatically puts the neo4j Node's label as kb_source
+        Creates a Node which is specific to a KB. Its label in the graph is the kb_source
         :param text: this is the text that will show up on the graph Node
         :param kb_source: this is the Node label
         '''
-        self.text = text
-        self.type = kb_source
-        super().__init__(kb_source, name=text)
-
+        super().__init__(text, kb_source)
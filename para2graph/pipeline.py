@@ -0,0 +1,162 @@
+#----------------------------#
+# Author: Surjit Das
+# Email: surjitdas@gmail.com
+# Program: artmind
+#----------------------------#
+
+import constants as C
+from loguru import logger as log
+from textprocessor import TextProcessor
+import wordnet_explorer
+from metrics import metrics
+from http_client import per_process_rate_limits
+import external_kbs
+import sql_db
+import multiprocessing as mp
+import threading
+import queue
+import traceback
+
+'''
+The pipeline splits the processing in 3 stages, connected by bounded queues:
+- feed: a thread that reads the texts and puts them in batches on the text queue
+- extract: N worker processes, each with its own nlp model and kbs. They parse the texts and run the sentencer,
+  the phrase & kb triplets (TextProcessor.extract_doc) and put the resulting SentenceRecords on the record queue
+- write: the main process, which owns the sqlite3 connection and the neo4j Graph and writes the SentenceRecords
+The queues being bounded keeps the memory flat, as the reader can not run ahead of the workers, nor the workers ahead of the writer
+'''
+
+def feed(lines, text_q, workers, batch_size, errors):
+    '''
+    Puts the lines in numbered batches on the text queue, followed by a stop marker (None) for each worker.
+    If reading the lines fails (a corrupt gzip / bz2, a decode or I/O error), the exception goes to errors for run() to raise,
+    and the lines read so far in the unfinished batch are dropped. The workers are stopped either way
+    '''
+    try:
+        batch_no = 0
+        batch = []
+        for line in lines:
+            batch.append(line)
+            if len(batch) == batch_size:
+                text_q.put((batch_no, batch))
+                batch_no += 1
+                batch = []
+        if len(batch) > 0:
+            text_q.put((batch_no, batch))
+    except Exception as e:
+        errors.append(e)
+    finally:
+        for i in range(workers):
+            text_q.put(None)
+
+def extract(text_q, record_q, worker_no, offline, profile, rate_limits):
+    '''
+    The worker process. Extracts the batches of lines from the text queue till it gets the stop marker,
+    and puts (batch_no, byte offset where the batch ends, records, error) on the record queue. error is None, or the traceback
+    if any text of the batch failed - the batch is then not checkpointed (see run)
+    Finally closes its TextProcessor, which completes the queued background refreshes of the external kbs, and puts a dict
+    with its apostrophe re-parse counter & its metrics on the record queue, to tell the writer it is done.
+    The first worker also saves its WordNet cache for the next run. rate_limits are the worker's share of the external kb rate limits
+    '''
+    if profile:
+        metrics.enable()
+    tp = TextProcessor(mode=None, write=False, offline=offline, rate_limits=rate_limits)
+    while True:
+        item = text_q.get()
+        if item is None:
+            break
+        batch_no, batch = item
+        records = []
+        error = None
+        try:
+            for doc in metrics.timed(tp.nlp.pipe([text for text, byte_offset in batch]), "parse"):
+                records.extend(tp.extract_doc(doc))
+        except Exception:
+            log.exception(f"Failed to extract batch {batch_no} of {len(batch)} texts")
+            error = traceback.format_exc()
+        record_q.put((batch_no, batch[-1][1], records, error))
+    tp.close()
+    if worker_no == 0 and C.WORDNET_CACHE_PATH is not None:
+        wordnet_explorer.save_cache(C.WORDNET_CACHE_PATH)
+    record_q.put({"apostrophe_reparses_avoided":tp.apostrophe_reparses_avoided, "metrics":metrics.snapshot()})
+
+def run(tp, lines, workers, batch_size=C.SPACY_BATCH_SIZE, queue_size=C.PIPELINE_QUEUE_SIZE, journal=None):
+    '''
+    Processes the lines with the pipeline. The calling process is the writer stage
+
+    :param tp: the TextProcessor used to write. It does not need to load the nlp model (extract=False). The workers use its offline setting
+    :param lines: an iterable of (text, byte_offset) tuples, byte_offset being where the text ends in the input. It is consumed lazily
+    :param workers: the number of extract worker processes
+    :param batch_size: the number of texts handed to a worker at a time
+    :param queue_size: the max number of batches waiting in each of the queues
+    :param journal: the IngestJournal in which the progress is checkpointed
+
+    A batch that fails in a worker, or a failure to read the lines, aborts the run with a RuntimeError. Everything before
+    the failed batch is written & checkpointed first, so that --resume starts again from the failed batch rather than skip it
+    '''
+    # The workers' Explorers share the external_kbs table. Any migration of it is done here, once, rather than by all of them at the same time
+    db = sql_db.connect(C.SQL_EXT_KB_DB)
+    external_kbs.create_table(db)
+    db.close()
+    # spawn, as forking a process which has torch / sqlite / bolt connections open is not safe
+    ctx = mp.get_context("spawn")
+    text_q = ctx.Queue(maxsize=queue_size)
+    record_q = ctx.Queue(maxsize=queue_size)
+    # Each worker has its own Explorer, hence its own rate limiters. They share the endpoints, so each gets its share of the rates
+    rate_limits = per_process_rate_limits(C.KB_RATE_LIMITS, workers)
+    processes = [ctx.Process(target=extract, args=(text_q, record_q, i, tp.offline, metrics.enabled, rate_limits), daemon=True)
+                    for i in range(workers)]
+    for process in processes:
+        process.start()
+    feed_errors = []
+    feeder = threading.Thread(target=feed, args=(lines, text_q, workers, batch_size, feed_errors), daemon=True)
+    feeder.start()
+    try:
+        write(tp, record_q, processes, journal)
+    except BaseException:
+        for process in processes:
+            process.terminate()
+        raise
+    feeder.join()
+    for process in processes:
+        process.join()
+    if len(feed_errors) > 0:
+        raise RuntimeError("Failed to read the input, it was processed up to the error only") from feed_errors[0]
+
+def write(tp, record_q, processes, journal):
+    '''
+    The write stage of run(). Writes the records of the batches in order and checkpoints them, till all the workers are done
+    '''
+    # The batches complete out of order. The journal only moves forward over batches that are done without a gap before them
+    if journal is not None:
+        tp.flush_on_checkpoint_only()
+    completed = {}
+    next_batch_no = 0
+    done = 0
+    while done < len(processes):
+        try:
+            item = record_q.get(timeout=1)
+        except queue.Empty:
+            if not any(process.is_alive() for process in processes):
+                raise RuntimeError("All the extract workers died before finishing")
+            continue
+        if isinstance(item, dict):
+            tp.apostrophe_reparses_avoided += item["apostrophe_reparses_avoided"]
+            metrics.merge(item["metrics"])
+            done += 1
+            continue
+
+        # The batches are written in order too, so that whatever gets flushed is covered by the journal
+        batch_no, byte_offset, records, error = item
+        completed[batch_no] = (byte_offset, records, error)
+        while next_batch_no in completed:
+            byte_offset, records, error = completed.pop(next_batch_no)
+            if error is not None:
+                tp.flush(journal)
+                raise RuntimeError(f"Batch {next_batch_no} failed in an extract worker, the input is checkpointed up to it:\n{error}")
+            for record in records:
+                tp.write(record)
+            if journal is not None:
+                tp.checkpoint(journal, byte_offset, records)
+            next_batch_no += 1
+    tp.flush(journal)
@@ -0,0 +1,63 @@
+#----------------------------#
+# Author: Surjit Das
+# Email: surjitdas@gmail.com
+# Program: artmind
+#----------------------------#
+
+import constants as C
+from loguru import logger as log
+import spacy
+from external_kbs import Explorer
+from input_reader import read_lines
+
+'''
+Prefetch fills the external_kbs table for a corpus ahead of the ingestion, so that the costly network phase can be run once
+(e.g. on a schedule) and the ingestion itself run offline (run.py file ... --offline), bound only by the CPU.
+Only the NER of the ingestion model (C.SPACY_MODEL) is run over the corpus - the same model, so that the entities prefetched
+are the ones the ingestion looks up. The entity strings are de-duplicated and their external kb info
+fetched concurrently, in chunks. The entities already in the table and fresh are not fetched again, the stale ones are refreshed
+'''
+
+def load_ner(model=C.SPACY_MODEL):
+    '''
+    Loads the model with only the components needed for the NER
+    '''
+    nlp = spacy.load(model)
+    nlp.select_pipes(enable=[name for name in nlp.pipe_names if name in ["tok2vec", "transformer", "ner"]])
+    return nlp
+
+def entities(nlp, lines, batch_size=C.SPACY_BATCH_SIZE):
+    '''
+    Yields the distinct entity strings of the lines, in the order they first appear
+    '''
+    seen = set()
+    texts = (line.strip() for byte_offset, line in lines)
+    for doc in nlp.pipe(texts, batch_size=batch_size):
+        for entity in doc.ents:
+            if entity.text not in seen:
+                seen.add(entity.text)
+                yield entity.text
+
+def prefetch(filepath, chunk_size=C.KB_PREFETCH_CHUNK_SIZE):
+    '''
+    Fills the external_kbs table with the external kb info of all the entities of the file. Returns the number of entities
+    :param filepath: a plain, gzip or bz2 file, or - for stdin
+    :param chunk_size: the number of entities fetched together
+    '''
+    nlp = load_ner()
+    # The stale entries are refreshed right away rather than in the background, as that is the point of the prefetch.
+    # Always online, also when C.KB_OFFLINE makes the ingestion offline - fetching is the point too
+    kbs = Explorer(refresh_in_background=False, offline=False)
+    count = 0
+    chunk = []
+    for text in entities(nlp, read_lines(filepath, desc="Prefetching entities")):
+        chunk.append(text)
+        if len(chunk) == chunk_size:
+            kbs.get_ext_kb_info_many(chunk)
+            count += len(chunk)
+            chunk = []
+    if len(chunk) > 0:
+        kbs.get_ext_kb_info_many(chunk)
+        count += len(chunk)
+    log.info(f"Prefetched the external kb info of {count} entities")
+    return count
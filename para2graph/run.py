@@ -5,10 +5,15 @@
 #----------------------------#
 
 from loguru import logger as log
-import sys
+import argparse
 import constants as C
 from textprocessor import TextProcessor
-from tqdm import tqdm
+import pipeline
+import prefetch
+from metrics import metrics
+import wordnet_explorer
+from input_reader import read_lines
+from p2g_dataclasses import IngestJournal
 from functools import partialmethod
 
 log.remove() #removes default handlers
@@ -16,25 +21,102 @@ log.level("D_DEBUG", no=33, icon="🤖", color="<blue>")
 log.add(C.LOG_PATH, backtrace=True, diagnose=True, level="DEBUG")
 log.__class__.d_debug = partialmethod(log.__class__.log, "D_DEBUG")
 
+def stripped_lines(lines):
+    '''
+    Generator feeding the (byte_offset, line)s of the input as (text, byte_offset) to TextProcessor.execute_many,
+    so that the lines are logged as they are consumed
+    '''
+    for byte_offset, line in lines:
+        log.info(f"Processing line: {line}")
+        yield line.strip(), byte_offset
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Converts sentences to graphs")
+    parser.add_argument("interaction_type", choices=["inline", "file", "prefetch"],
+                        help="prefetch only fills the external kb info of the entities of the file, for a later file run with --offline")
+    parser.add_argument("filepath", nargs="?", help="full filepath, if interaction_type is file or prefetch. Can be gzip/bz2 compressed, or - for stdin")
+    parser.add_argument("--mode", choices=["truncate", "append"], default="truncate",
+                        help="truncate deletes everything in the graph first, append adds to it")
+    parser.add_argument("--resume", action="store_true",
+                        help="skip the part of the file that a previous run has already ingested (implies --mode append)")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="number of worker processes that parse & extract in parallel, while this process writes. They share the external kb rate limits. 0 runs everything in this process")
+    parser.add_argument("--offline", action="store_true",
+                        help="never call the external kb web sources, only use what is in the db (see prefetch). Items not there get UNKNOWN")
+    parser.add_argument("--sink", choices=[C.GRAPH_SINK_NEO4J, C.GRAPH_SINK_NETWORKX], default=C.GRAPH_SINK,
+                        help="where the graph is written. networkx keeps it in this process and saves it as GraphML (--graphml) every C.GRAPHML_SAVE_INTERVAL sentences of a file run and at the end")
+    parser.add_argument("--graphml", default=C.GRAPHML_PATH, help="the GraphML file of the networkx sink")
+    parser.add_argument("--merge-edges", action="store_true", default=C.GRAPH_MERGE_EDGES,
+                        help="keep one edge per (head, type, tail) with a count & first / last seen, so the graph grows with the vocabulary rather than the corpus")
+    parser.add_argument("--columnar", metavar="DIR", default=C.COLUMNAR_PATH,
+                        help="also write the tokens & triplets as partitioned Parquet files under DIR, for analytical scans (needs pyarrow)")
+    parser.add_argument("--columnar-format", choices=[C.COLUMNAR_FORMAT_PARQUET, C.COLUMNAR_FORMAT_ARROW], default=C.COLUMNAR_FORMAT,
+                        help="write the --columnar files as Parquet or as Arrow IPC files")
+    parser.add_argument("--profile", action="store_true",
+                        help="time each processing stage and count the cache hits & neo4j round trips. The summary is logged & printed at the end")
+    parser.add_argument("--profile-json", metavar="PATH", help="also export the --profile summary as json to PATH (implies --profile)")
+    args = parser.parse_args()
+    if args.interaction_type in ["file", "prefetch"] and args.filepath is None:
+        parser.error("Please provide full filename as 2nd parameter")
+    if args.interaction_type != "file" and (args.workers > 0 or args.resume or args.offline):
+        parser.error("--workers, --resume and --offline are only used with interaction_type file")
+    if args.resume:
+        args.mode = "append"
+    if args.profile_json is not None:
+        args.profile = True
+    return args
+
+def report_metrics(args):
+    '''
+    Logs & prints the --profile summary, and exports it as json if asked for
+    '''
+    report = metrics.report()
+    log.info(f"Profile:\n{report}")
+    print(report)
+    if args.profile_json is not None:
+        metrics.export_json(args.profile_json)
+
 @log.catch
 def main():
-    if len(sys.argv) < 2:
-        print("Please provide params:\n1) interaction_type (inline|file)\n2) if param1 is file - provide full filepath")
-        exit(0)
-    tp = TextProcessor("truncate") # ToDo: add this as a cmd line parameter
-    # tp = TextProcessor("append") # ToDo: add this as a cmd line parameter
-
-    if sys.argv[1] == "file":
-        if len(sys.argv) != 3:
-            print("Please provide full filename as 2nd parameter")
-            exit(0)
-        
-        with open(sys.argv[2]) as fp: 
-            lines = fp.readlines() 
-            for line in tqdm(lines, desc="Processing sentences"):
-                log.info(f"Processing line: {line}")
-                tp.execute(line.strip())
+    args = parse_args()
+    if args.profile:
+        metrics.enable()
+    if args.interaction_type == "prefetch":
+        prefetch.prefetch(args.filepath)
+        if args.profile:
+            report_metrics(args)
+        log.info("Done")
+        return
+
+    # With workers, this process only writes and does not need the nlp model
+    tp = TextProcessor(args.mode, extract=args.workers == 0, offline=args.offline or C.KB_OFFLINE, sink=args.sink,
+                        merge_edges=args.merge_edges, columnar=args.columnar, graphml_path=args.graphml,
+                        columnar_format=args.columnar_format)
+
+    if args.interaction_type == "file":
+        journal = IngestJournal(tp.db, args.filepath)
+        start_offset = 0
+        if args.resume:
+            start_offset = journal.last_offset()
+            log.info(f"Resuming {args.filepath} from byte offset {start_offset}")
+        else:
+            # A run that is not resuming goes over the whole file again
+            journal.reset()
+
+        lines = read_lines(args.filepath, start_offset)
+        if args.workers > 0:
+            pipeline.run(tp, stripped_lines(lines), args.workers, journal=journal)
+        else:
+            tp.execute_many(stripped_lines(lines), journal=journal)
+        tp.close()
+
+        log.info(f"Re-parses avoided while pre-processing apostrophes: {tp.apostrophe_reparses_avoided}")
+        # With workers, the first worker saves the WordNet cache
+        if C.WORDNET_CACHE_PATH is not None and args.workers == 0:
+            wordnet_explorer.save_cache(C.WORDNET_CACHE_PATH)
 
+        if args.profile:
+            report_metrics(args)
         log.info("Done")
     else:
         text=input("Para: ")
@@ -43,6 +125,9 @@ def main():
             tp.execute(text) 
             print("Done...")
             text = input("Para: ")
+        tp.close()
+        if args.profile:
+            report_metrics(args)
 
 if __name__=="__main__":
     main()
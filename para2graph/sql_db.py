@@ -0,0 +1,19 @@
+#----------------------------#
+# Author: Surjit Das
+# Email: surjitdas@gmail.com
+# Program: artmind
+#----------------------------#
+
+import sqlite3
+import constants as C
+
+def connect(path, **kwargs):
+    '''
+    Opens a connection to the sqlite3 db, shared by the writer, the pipeline workers & the background refresh threads.
+    In WAL mode the readers do not block the writer and the other way round, and a connection waits up to
+    C.SQL_BUSY_TIMEOUT seconds for the write lock of another one rather than fail with "database is locked"
+    :param kwargs: passed on to sqlite3.connect, e.g. check_same_thread
+    '''
+    db = sqlite3.connect(path, timeout=C.SQL_BUSY_TIMEOUT, **kwargs)
+    db.execute("pragma journal_mode=WAL")
+    return db
@@ -0,0 +1,61 @@
+#----------------------------#
+# Author: Surjit Das
+# Email: surjitdas@gmail.com
+# Program: artmind
+#----------------------------#
+
+from collections import deque
+
+class SubstringMatcher:
+    """
+    Finds which of a set of patterns occur in a text (as substrings, same as `pattern in text`), in one pass over the text
+    whatever the number of patterns - the Aho-Corasick automaton. The patterns are numbered in the order given
+    """
+    def __init__(self, patterns):
+        '''
+        :param patterns: the list of strings to look for. Duplicates get their own numbers, an empty pattern is in every text
+        '''
+        self.goto = [{}] # state -> {char: next state}, state 0 being the root
+        self.fail = [0] # state -> the state of the longest proper suffix that is also in the trie
+        self.out = [[]] # state -> the numbers of the patterns that end at the state
+        self.always = [] # the numbers of the empty patterns
+        for pattern_no, pattern in enumerate(patterns):
+            if pattern == "":
+                self.always.append(pattern_no)
+                continue
+            state = 0
+            for char in pattern:
+                next_state = self.goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self.goto)
+                    self.goto[state][char] = next_state
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.out.append([])
+                state = next_state
+            self.out[state].append(pattern_no)
+
+        # The fail links are set breadth first, so that those of the shorter prefixes are there when needed
+        states = deque(self.goto[0].values())
+        while states:
+            state = states.popleft()
+            for char, next_state in self.goto[state].items():
+                states.append(next_state)
+                fail = self.fail[state]
+                while fail != 0 and char not in self.goto[fail]:
+                    fail = self.fail[fail]
+                self.fail[next_state] = self.goto[fail].get(char, 0)
+                self.out[next_state] = self.out[next_state] + self.out[self.fail[next_state]]
+
+    def find(self, text):
+        '''
+        Returns the set of the numbers of the patterns that occur in the text
+        '''
+        found = set(self.always)
+        state = 0
+        for char in text:
+            while state != 0 and char not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(char, 0)
+            found.update(self.out[state])
+        return found
@@ -4,32 +4,75 @@
 # Program: artmind
 #----------------------------#
 
-from types import TracebackType
-
-from numpy.lib.twodim_base import tri
-from py2neo.matching import NE
 import constants as C
 import spacy
 from loguru import logger as log
 import uuid
-from p2g_dataclasses import PhraseNode, PhraseEdge, SentenceGraph, SentenceTable, NERNode, NounNode, PhraseInfoEdge, KBNode, AdjNode, VerbNode
+from p2g_dataclasses import PhraseNode, PhraseEdge, SentenceGraph, SentenceTable, SentenceRecord, NERNode, NounNode, PhraseInfoEdge, KBNode, AdjNode, VerbNode
 from external_kbs import Explorer
-from wordnet_explorer import WordNet_Explorer
-import sqlite3
-import py2neo as p2n
-import ast
+import wordnet_explorer
+import os
+from graph_writer import make_graph_writer
+from columnar_sink import ColumnarWriter
+from substring_matcher import SubstringMatcher
+import sql_db
+from metrics import metrics
 
 class TextProcessor:
     """
     The TextProcessor contains the main execution logic for Para2Graph
     """
-    def __init__(self, mode="truncate"):
-        self.nlp = spacy.load(C.SPACY_MODEL)
-        self.db = sqlite3.connect(C.SQL_LOCAL_DB)
-        self.kbs = Explorer()
-        self.G_n4j = p2n.Graph(C.NEO4J_URI, auth=(C.NEO4J_USER, C.NEO4J_PASSWORD))
-        if mode == "truncate":
-            self.G_n4j.delete_all()        
+    def __init__(self, mode="truncate", extract=True, write=True, offline=C.KB_OFFLINE, sink=C.GRAPH_SINK, merge_edges=C.GRAPH_MERGE_EDGES,
+                    columnar=C.COLUMNAR_PATH, rate_limits=C.KB_RATE_LIMITS, graphml_path=C.GRAPHML_PATH, columnar_format=C.COLUMNAR_FORMAT):
+        '''
+        :param mode: truncate | append. truncate deletes everything in the graph first
+        :param extract: load the nlp model & the external kbs, which are needed to extract the sentences. The writer stage of the pipeline does not extract
+        :param write: connect to the db & the graph. The worker processes of the pipeline only extract, they do not write
+        :param offline: the external kbs only use the info already in the db, see prefetch.py
+        :param rate_limits: the max calls per second per external kb source of this process, see Explorer
+        :param graphml_path: the GraphML file the networkx sink saves the graph to (and continues from in append mode)
+        :param columnar_format: C.COLUMNAR_FORMAT_PARQUET | C.COLUMNAR_FORMAT_ARROW, the format of the columnar files
+        :param sink: where the graph is written - C.GRAPH_SINK_NEO4J or C.GRAPH_SINK_NETWORKX (in process, saved as GraphML)
+        :param merge_edges: keep one edge per (head, type, tail) with a count, rather than one per sentence
+        :param columnar: directory to which the tokens & triplets are also written as Parquet / Arrow files (see columnar_sink.py). None to not write them
+        '''
+        self.nlp = None
+        self.kbs = None
+        self.db = None
+        self.G_n4j = None
+        self.graph_writer = None
+        self.sentence_table = None
+        self.columnar_writer = None
+        self.offline = offline
+        # With a journal, everything is flushed at the checkpoints. When saving a sink writes whole files (the GraphML of the
+        # networkx sink, the columnar part files), the checkpoints are save points, further apart, with nothing written in between
+        save_intervals = []
+        if write and sink == C.GRAPH_SINK_NETWORKX and graphml_path is not None:
+            save_intervals.append(C.GRAPHML_SAVE_INTERVAL)
+        if write and columnar is not None:
+            save_intervals.append(C.COLUMNAR_SAVE_INTERVAL)
+        self.save_points = len(save_intervals) > 0
+        self.checkpoint_interval = min(save_intervals) if self.save_points else C.SQL_COMMIT_INTERVAL
+        if extract:
+            self.nlp = spacy.load(C.SPACY_MODEL)
+            self.kbs = Explorer(offline=offline, rate_limits=rate_limits)
+            if C.WORDNET_TABLE_PATH is not None:
+                wordnet_explorer.load_table(C.WORDNET_TABLE_PATH)
+            if C.WORDNET_CACHE_PATH is not None and os.path.exists(C.WORDNET_CACHE_PATH):
+                wordnet_explorer.load_cache(C.WORDNET_CACHE_PATH)
+            if C.WORDNET_FREQ_LIST_PATH is not None:
+                wordnet_explorer.warm_cache(C.WORDNET_FREQ_LIST_PATH)
+        if write:
+            self.db = sql_db.connect(C.SQL_LOCAL_DB)
+            # G_n4j stays None for the sinks other than neo4j
+            self.G_n4j, self.graph_writer = make_graph_writer(sink, mode, merge_edges, graphml_path)
+            self.sentence_table = SentenceTable(self.db)
+            if columnar is not None:
+                self.columnar_writer = ColumnarWriter(columnar, append=mode != "truncate", file_format=columnar_format)
+            # Without the model, the indexes of the NER labels get created on their first write
+            ner_labels = list(self.nlp.pipe_labels.get("ner", [])) if self.nlp is not None else []
+            self.graph_writer.ensure_schema(C.N4J_INDEXED_LABELS + ner_labels)
+        self.apostrophe_reparses_avoided = 0 # Counter of the re-parses saved by preprocess_sentence_for_apostrophe
     
     def execute(self, text):
         """
@@ -37,7 +80,100 @@ class TextProcessor:
 
         :param text: the text to be processed. This can be full paragraph as well, because this function breaks it down into sentences and then processes by each sentence
         """
-        doc = self.nlp(text)
+        with metrics.timer("parse"):
+            doc = self.nlp(text)
+        self.process_doc(doc)
+        self.flush()
+
+    def execute_many(self, texts, batch_size=C.SPACY_BATCH_SIZE, n_process=C.SPACY_N_PROCESS, journal=None):
+        """
+        The batched variant of execute. The texts are streamed through nlp.pipe, so that the model parses them in batches
+        instead of paying the per call overhead for every text. Each parsed doc then goes through the same per sentence steps as execute
+
+        :param texts: an iterable of texts (e.g. the lines of a file). It is consumed lazily, so a generator can be passed.
+                        With a journal, an iterable of (text, byte_offset) tuples, byte_offset being where the text ends in the input
+        :param batch_size: the number of texts that spaCy buffers and parses together
+        :param n_process: the number of processes spaCy uses for parsing
+        :param journal: the IngestJournal in which the progress is checkpointed, every C.SQL_COMMIT_INTERVAL sentences
+        """
+        if journal is None:
+            for doc in metrics.timed(self.nlp.pipe(texts, batch_size=batch_size, n_process=n_process), "parse"):
+                self.process_doc(doc)
+        else:
+            self.flush_on_checkpoint_only()
+            for doc, byte_offset in metrics.timed(self.nlp.pipe(texts, as_tuples=True, batch_size=batch_size, n_process=n_process), "parse"):
+                records = self.extract_doc(doc)
+                for record in records:
+                    self.write(record)
+                self.checkpoint(journal, byte_offset, records)
+        self.flush(journal)
+
+    def checkpoint(self, journal, byte_offset, records):
+        """
+        Notes in the journal that the input up to byte_offset has been processed into the records.
+        Flushes everything once checkpoint_interval sentences have been noted, or (without save points) the db / graph batch is full
+        """
+        journal.add(byte_offset, [record.sentence_uuid for record in records])
+        if len(journal.sentence_uuids) >= self.checkpoint_interval or (not self.save_points and (self.graph_writer.full() or self.sentence_table.full())):
+            self.flush(journal)
+
+    def flush_on_checkpoint_only(self):
+        """
+        Stops the db & graph writers from flushing on their own when their batch is full. Used with a journal, so that
+        everything gets written by checkpoint / flush only and each commit lines up with a journal row. Otherwise the sentences
+        written after the last journal row would be in the db & graph, yet ingested again by a resumed run
+        """
+        self.graph_writer.auto_flush = False
+        self.sentence_table.auto_flush = False
+
+    def flush(self, journal=None):
+        """
+        Writes out whatever is still collected for the db and the graph. With a journal, the graph is also saved (e.g. the GraphML file)
+        and the columnar part files completed.
+        The journal is written last, so that it never records progress which is not in the db & graph yet.
+        A crash between the writes makes a resumed run redo the last few sentences, rather than lose them
+        """
+        self.graph_writer.flush()
+        self.sentence_table.flush()
+        if journal is not None:
+            self.graph_writer.save()
+            if self.columnar_writer is not None:
+                with metrics.timer("columnar_write"):
+                    self.columnar_writer.save()
+            journal.flush()
+
+    def close(self):
+        """
+        Writes out whatever is still collected and closes the graph writer, which e.g. saves the networkx graph,
+        and the columnar writer, which completes its part files. Then stops the external kbs, once their queued background refreshes are done
+        """
+        if self.graph_writer is not None:
+            self.flush()
+            self.graph_writer.close()
+        if self.columnar_writer is not None:
+            with metrics.timer("columnar_write"):
+                self.columnar_writer.close()
+        if self.kbs is not None:
+            self.kbs.close()
+
+    def process_doc(self, doc):
+        """
+        Runs the per sentence steps (pre-processing, persisting to db, phrase & kb triplets, saving to graph) on a parsed doc
+
+        :param doc: the nlp doc form of the text to be processed
+        """
+        for record in self.extract_doc(doc):
+            self.write(record)
+
+    def extract_doc(self, doc):
+        """
+        Runs the per sentence steps that do not write anything (pre-processing, token rows, phrase & kb triplets) on a parsed doc.
+        This is the part that runs in the worker processes of the pipeline
+
+        :param doc: the nlp doc form of the text to be processed
+        :return: a SentenceRecord per sentence
+        """
+        records = []
         for sentence in doc.sents:
             log.debug(f"Executing {sentence=}")
 
@@ -51,24 +187,27 @@ class TextProcessor:
             '''
             Pre process the sentence. If multiple pre-processing needs to be done, add here...
             '''
-            sentence = self.preprocess_sentence_for_apostrophe(sentence)
+            with metrics.timer("apostrophe"):
+                sentence = self.preprocess_sentence_for_apostrophe(sentence)
 
             '''
-            Persist the sentence tokens in db
+            Get the sentence tokens for the db
             '''
-            s_t = SentenceTable(self.db)
-            ners, nouns, adjs, verbs = s_t.persist(sentence_uuid, sentence)
-            deduped_nouns = self.dedup_nouns_from_ners(nouns, ners)
+            with metrics.timer("token_rows"):
+                token_rows, ners, nouns, adjs, verbs = SentenceTable.token_rows(sentence_uuid, sentence)
+                deduped_nouns = self.dedup_nouns_from_ners(nouns, ners)
             
             '''
             Break sentences into phrases and get PhraseEdges
             '''
-            ph_3plets = self.sentencer(sentence_uuid, sentence)
+            with metrics.timer("sentencer"):
+                ph_3plets = self.sentencer(sentence_uuid, sentence)
 
             '''
             Get edges that are Phrase->Noun | NER | Adjective | Verb
             '''
-            ner_pos_3plets = self.construct_phrase_3plets(ners, deduped_nouns, adjs, verbs, ph_3plets)
+            with metrics.timer("phrase_3plets"):
+                ner_pos_3plets = self.construct_phrase_3plets(ners, deduped_nouns, adjs, verbs, ph_3plets)
 
             '''
             Get edges that are Noun|NER->KB_Info 
@@ -76,10 +215,24 @@ class TextProcessor:
             kb_3plets = self.constuct_kb_3plets(ners, deduped_nouns, adjs, verbs)
 
             '''
-            Save the outcomes to persistent graph
+            Convert the outcomes to the edges of the persistent graph
             '''
-            s_g = SentenceGraph(self.G_n4j, sentence_uuid)
-            s_g.save(ph_3plets, ner_pos_3plets, kb_3plets)
+            with metrics.timer("edge_rows"):
+                s_g = SentenceGraph(self.G_n4j, sentence_uuid)
+                edge_rows = s_g.edge_rows(ph_3plets, ner_pos_3plets, kb_3plets)
+            metrics.incr("sentences")
+            records.append(SentenceRecord(sentence_uuid, token_rows, edge_rows))
+        return records
+
+    def write(self, record):
+        """
+        Persists a SentenceRecord - the tokens in db and the edges in the persistent graph (and both in the columnar files, if enabled)
+        """
+        self.sentence_table.add(record.token_rows)
+        self.graph_writer.add(record.edge_rows)
+        if self.columnar_writer is not None:
+            with metrics.timer("columnar_write"):
+                self.columnar_writer.add(record)
 
     def dedup_nouns_from_ners(self, nouns, ners):
         '''
@@ -96,29 +249,27 @@ class TextProcessor:
         '''
         This function takes the ners, pos (nouns, adjs, verbs) and the phrase triplets and creates PhraseInfoEdges
         '''
-        # de-duped phrase node triplets
-        phrases = []
+        # de-duped phrase node triplets, in the order they first appear. Keyed like PhraseNode.__eq__ (the classification is ignored)
+        phrases = {}
         for triplet in ph_3plets:
             # print(f"{triplet.head=}, {triplet.phrase=}, {triplet.tail=}")
-            if triplet.head not in phrases:
-                phrases.append(triplet.head)
-            if triplet.tail not in phrases:
-                phrases.append(triplet.tail)
+            phrases.setdefault((triplet.head.sentence_uuid, triplet.head.phrase), triplet.head)
+            phrases.setdefault((triplet.tail.sentence_uuid, triplet.tail.phrase), triplet.tail)
+
+        # Which terms are in a phrase is found with one pass over the phrase, rather than a substring search per term.
+        # NERs match case sensitive, the nouns, adjectives & verbs case insensitive. The terms are numbered in the order
+        # nouns, adjs, verbs so that sorting the matches gives the edges in the same order as looping over the lists
+        ner_matcher = SubstringMatcher([ner[0] for ner in ners])
+        terms = [(noun, NounNode) for noun in deduped_nouns] + [(adj, AdjNode) for adj in adjs] + [(verb, VerbNode) for verb in verbs]
+        term_matcher = SubstringMatcher([term.lower() for term, node_class in terms])
 
         ner_pos_3plets = []
-        for phrase in phrases:
-            for ner in ners:
-                if ner[0] in phrase.phrase:
-                    ner_pos_3plets.append(PhraseInfoEdge(phrase, NERNode(ner[0], ner[1])))
-            for noun in deduped_nouns:
-                if noun.lower() in phrase.phrase.lower():
-                    ner_pos_3plets.append(PhraseInfoEdge(phrase, NounNode(noun)))
-            for adj in adjs:
-                if adj.lower() in phrase.phrase.lower():
-                    ner_pos_3plets.append(PhraseInfoEdge(phrase, AdjNode(adj)))
-            for verb in verbs:
-                if verb.lower() in phrase.phrase.lower():
-                    ner_pos_3plets.append(PhraseInfoEdge(phrase, VerbNode(verb)))      
+        for phrase in phrases.values():
+            for ner_no in sorted(ner_matcher.find(phrase.phrase)):
+                ner_pos_3plets.append(PhraseInfoEdge(phrase, NERNode(ners[ner_no][0], ners[ner_no][1])))
+            for term_no in sorted(term_matcher.find(phrase.phrase.lower())):
+                term, node_class = terms[term_no]
+                ner_pos_3plets.append(PhraseInfoEdge(phrase, node_class(term)))
 
         log.debug(f"{ner_pos_3plets=}")              
         return ner_pos_3plets
@@ -129,20 +280,23 @@ class TextProcessor:
         '''
         kb_3plets = []
 
+        # The kb info of all the NERs is fetched in one go, so that the external sources are queried concurrently
+        with metrics.timer("kb_lookup"):
+            kb_infos = self.kbs.get_ext_kb_info_many([ner[0] for ner in ners])
         for ner in ners:
-            kb_info = self.kbs.get_ext_kb_info(ner[0])
-            kb_3plets = self.add_meta_nodes(NERNode(ner[0],ner[1]), kb_info, kb_3plets, [C.WIKIDATA_CLASS, C.DBPEDIA, C.WDINSTANCE, C.CONCEPTNET])
+            kb_3plets = self.add_meta_nodes(NERNode(ner[0],ner[1]), kb_infos[ner[0]], kb_3plets, [C.WIKIDATA_CLASS, C.DBPEDIA, C.WDINSTANCE, C.CONCEPTNET])
 
-        for noun in deduped_nouns:
-            # kb_info = self.kbs.get_ext_kb_info(noun)
-            # kb_3plets = self.add_meta_nodes(NounNode(noun), kb_info, kb_3plets, [C.WIKIDATA_CLASS, C.DBPEDIA, C.WDINSTANCE, C.CONCEPTNET])
-            kb_3plets = self.add_wordnet_nodes(NounNode(noun), kb_3plets, noun)
+        with metrics.timer("wordnet"):
+            for noun in deduped_nouns:
+                # kb_info = self.kbs.get_ext_kb_info(noun)
+                # kb_3plets = self.add_meta_nodes(NounNode(noun), kb_info, kb_3plets, [C.WIKIDATA_CLASS, C.DBPEDIA, C.WDINSTANCE, C.CONCEPTNET])
+                kb_3plets = self.add_wordnet_nodes(NounNode(noun), kb_3plets, noun)
 
-        for adj in adjs:
-            kb_3plets = self.add_wordnet_nodes(AdjNode(adj), kb_3plets, adj)
+            for adj in adjs:
+                kb_3plets = self.add_wordnet_nodes(AdjNode(adj), kb_3plets, adj)
 
-        for verb in verbs:
-            kb_3plets = self.add_wordnet_nodes(VerbNode(verb), kb_3plets, verb)            
+            for verb in verbs:
+                kb_3plets = self.add_wordnet_nodes(VerbNode(verb), kb_3plets, verb)            
 
         log.debug(f"{kb_3plets=}")   
         return kb_3plets
@@ -151,8 +305,7 @@ class TextProcessor:
         '''
         Utility function used by constuct_kb_3plets to create the KB_Info node + edges for WordNet parent classes
         '''        
-        wn_e = WordNet_Explorer(pos.lower())
-        parents = wn_e.get_parent_classes()
+        parents = wordnet_explorer.get_parent_classes(pos.lower())
         if len(parents)>0:
             kb_3plets.append(PhraseInfoEdge(head,KBNode(parents[0], C.WORDNET)))        
             i = 0
@@ -170,9 +323,7 @@ class TextProcessor:
         It iterates by each type of source
         '''
         for source in sources:
-            # The kb_info coming from the external_kbs.Explorer returns a list as a string. That's how it is stored in the db too.
-            # The ast.literal_eval function converts that string into a list
-            label_list = ast.literal_eval(kb_info[f"list_{source}"])
+            label_list = kb_info[f"list_{source}"]
             for label in label_list[:max_nodes]:
                 if label not in ['Wikimedia disambiguation page', 'MediaWiki main-namespace page', 'list', 'class', 
                             'word-sense disambiguation', 'Wikimedia internal item', 'MediaWiki page', 'MediaWiki help page','Wikimedia non-main namespace',
@@ -185,9 +336,11 @@ class TextProcessor:
         """
         Very tricky function to transform <x's y> or <s' y> as <y of x> or <y of s>   
         To me this is coded as more of a hack rather than with any elegance. But gets the job done
-        The challenge is finding the cases, and then swapping each case; which changes the order
-        and hence needs to be reparsed. So one will find things like the no_of_cases is just used
-        for number of loops and then doc is reparsed to find new indexes of the case, etc.        
+        The challenge is finding the cases, and then swapping each case; which changes the order.
+        Instead of re-parsing the sentence after every swap to find the new indexes of the cases, the words are kept
+        along with the pos & dep of the original parse and moved around together. So the indexes are always those of the
+        current word order, and the sentence is re-parsed only once at the end.
+        Every re-parse saved this way is counted in self.apostrophe_reparses_avoided
         """
         '''
         The constants below control a lot of the logic and are part of the "researched" hacks :-)
@@ -196,46 +349,46 @@ class TextProcessor:
         DEP_APOSTROPHE = 'case'
         
         log.debug(f"pre_processing: {[[token.i, token.text, token.pos_, token.dep_] for token in doc]}")
-        words = [token.text for token in doc]
-        no_of_cases = len([token.i for token in doc if token.dep_ == DEP_APOSTROPHE])
+        # Each word is a (text, pos, dep) tuple taken from the original parse
+        words = [(token.text, token.pos_, token.dep_) for token in doc]
+        no_of_cases = len([word for word in words if word[2] == DEP_APOSTROPHE])
 
         if no_of_cases == 0:
             return doc
 
         for case_i in range(no_of_cases):
-            sentence = ' '.join(words)
-            sentence = sentence.replace(" '", "'")
-            doc = self.nlp(sentence)
-            cases = [token.i for token in doc if token.dep_=="case"]
+            cases = [i for i, word in enumerate(words) if word[2] == DEP_APOSTROPHE]
             log.debug(f"{cases=}")
             case = cases[0] # Since we are popping each case at the end of the loop, the cases[0] always addresses next case
             
             # Find the noun chunk BEFORE case
             noun_chunk_1 = []
-            for token in reversed(doc[:case]):
-                if token.pos_ in POS_NOUN_CHUNK_MODIFIERS:
-                    noun_chunk_1.append(token.i)
+            for i in reversed(range(case)):
+                if words[i][1] in POS_NOUN_CHUNK_MODIFIERS:
+                    noun_chunk_1.append(i)
                 else:
                     break  
             log.debug(f"{noun_chunk_1=}")
             # Find the noun chunk AFTER case
             noun_chunk_2 = []
-            for token in doc[case+1:] :
-                noun_chunk_2.append(token.i)
-                if token.pos_ in [C.POS_PROPER_NOUN, C.POS_NOUN]:
+            for i in range(case+1, len(words)):
+                noun_chunk_2.append(i)
+                if words[i][1] in [C.POS_PROPER_NOUN, C.POS_NOUN]:
                     break
             log.debug(f"{noun_chunk_2=}")
             
             pop_from = noun_chunk_1[-1]
             insert_at = noun_chunk_2[-1]+1
-            words.insert(insert_at, "of")
+            words.insert(insert_at, ("of", "ADP", "prep"))
             for j in noun_chunk_1:
                 words.insert(insert_at, words.pop(pop_from))
             words.pop(pop_from)
             log.debug(f"words at end of loop: {words}")
         
-        sentence = ' '.join([word for word in words if word not in ("'s", "'")])
-        return self.nlp(sentence)
+        self.apostrophe_reparses_avoided += no_of_cases
+        sentence = ' '.join([word[0] for word in words if word[0] not in ("'s", "'")])
+        with metrics.timer("apostrophe_reparse"):
+            return self.nlp(sentence)
 
     def sentencer(self, sentence_uuid, doc):
         '''
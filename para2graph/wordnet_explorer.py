@@ -12,12 +12,73 @@ from nltk.corpus import wordnet as wn
 import nltk
 import sys
 from loguru import logger as log
+import json
+import constants as C
+from caches import LRUCache
+from wordnet_table import WordNetTable
+from metrics import metrics
 
 def download_wordnet_corpora():
     # By default these should get downloaded into /Users/surjitdas/nltk_data
     nltk.download("wordnet")
     nltk.download("omw-1.4")
 
+PARENT_CLASSES_CACHE = LRUCache(C.WORDNET_CACHE_SIZE)
+PARENT_CLASSES_TABLE = None
+
+def load_table(filepath):
+    '''
+    Answers get_parent_classes from the precomputed table (see wordnet_table.py) instead of NLTK's WordNet
+    '''
+    global PARENT_CLASSES_TABLE
+    PARENT_CLASSES_TABLE = WordNetTable(filepath)
+    log.info(f"Loaded the WordNet table {filepath} with {PARENT_CLASSES_TABLE.no_of_words} words")
+
+def get_parent_classes(text):
+    '''
+    The cached form of WordNet_Explorer(text).get_parent_classes(). The same words come up in almost every sentence,
+    so the synsets are looked up and the hypernyms walked only once per word.
+    With the precomputed table loaded, NLTK's WordNet is not used (nor loaded) at all
+    '''
+    parents = PARENT_CLASSES_CACHE.get(text)
+    metrics.incr("wordnet_cache_hits" if parents is not None else "wordnet_cache_misses")
+    if parents is None:
+        if PARENT_CLASSES_TABLE is not None:
+            parents = PARENT_CLASSES_TABLE.get_parent_classes(text)
+        else:
+            parents = WordNet_Explorer(text).get_parent_classes()
+        PARENT_CLASSES_CACHE.put(text, parents)
+    return parents
+
+def warm_cache(filepath, limit=C.WORDNET_CACHE_SIZE):
+    '''
+    Pre-warms the cache from a word frequency list - one word per line (anything after the word is ignored), most frequent first
+    '''
+    with open(filepath) as fp:
+        for i, line in enumerate(fp):
+            if i == limit:
+                break
+            words = line.split()
+            if len(words) > 0:
+                get_parent_classes(words[0].lower())
+    log.info(f"Warmed the WordNet cache with {len(PARENT_CLASSES_CACHE)} words")
+
+def load_cache(filepath):
+    '''
+    Loads the cache saved by save_cache
+    '''
+    with open(filepath) as fp:
+        for text, parents in json.load(fp):
+            PARENT_CLASSES_CACHE.put(text, parents)
+    log.info(f"Loaded {len(PARENT_CLASSES_CACHE)} words into the WordNet cache")
+
+def save_cache(filepath):
+    '''
+    Saves the cache, so that the next run can start with it
+    '''
+    with open(filepath, "w") as fp:
+        json.dump(PARENT_CLASSES_CACHE.items(), fp)
+
 class WordNet_Explorer():
     def __init__(self, text) -> None:
         self.synsets = wn.synsets(text)
@@ -0,0 +1,157 @@
+#----------------------------#
+# Author: Surjit Das
+# Email: surjitdas@gmail.com
+# Program: artmind
+#----------------------------#
+
+'''
+A precomputed lookup table of word -> WordNet parent classes (the output of WordNet_Explorer.get_parent_classes),
+so that the ingestion does not have to load the NLTK WordNet corpus, which takes seconds & hundreds of MB in every process.
+The table is built once (python wordnet_table.py build <path>) and memory mapped at run time, so the worker processes share its pages.
+
+The words in the table are all the words for which wn.synsets is not empty: the lemma names, the morphy exception forms and
+the forms the morphy rules reduce to a lemma name (e.g. "years" -> "year"). The parent classes of each of these words are
+computed with WordNet_Explorer itself, so the output is the same as that of the NLTK path. A word that is not in the table
+has no synsets, hence no parent classes.
+
+File layout (little endian uint32s):
+| magic | no. of words | no. of chains | word offsets (no. of words + 1) | chain no. per word | chain offsets (no. of chains + 1) | words | chains |
+The words are sorted utf8 strings, looked up by binary search. The chains are the distinct tab separated parent classes,
+which are shared across the words
+'''
+
+import mmap
+import struct
+import sys
+from loguru import logger as log
+
+MAGIC = b"P2GWNT1\0"
+UINT32 = struct.Struct("<I")
+HEADER = struct.Struct("<8sII")
+
+class WordNetTable:
+    def __init__(self, filepath) -> None:
+        '''
+        Memory maps the table built by build()
+        '''
+        with open(filepath, "rb") as fp:
+            self.buffer = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.no_of_words, self.no_of_chains = HEADER.unpack_from(self.buffer, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{filepath} is not a WordNet table")
+        self.word_offsets_at = HEADER.size
+        self.chain_nos_at = self.word_offsets_at + UINT32.size * (self.no_of_words + 1)
+        self.chain_offsets_at = self.chain_nos_at + UINT32.size * self.no_of_words
+        self.words_at = self.chain_offsets_at + UINT32.size * (self.no_of_chains + 1)
+        self.chains_at = self.words_at + self.uint32(self.word_offsets_at, self.no_of_words)
+
+    def uint32(self, array_at, i):
+        return UINT32.unpack_from(self.buffer, array_at + UINT32.size * i)[0]
+
+    def word(self, i):
+        start = self.uint32(self.word_offsets_at, i)
+        end = self.uint32(self.word_offsets_at, i + 1)
+        return self.buffer[self.words_at + start:self.words_at + end]
+
+    def chain(self, i):
+        start = self.uint32(self.chain_offsets_at, i)
+        end = self.uint32(self.chain_offsets_at, i + 1)
+        chain = self.buffer[self.chains_at + start:self.chains_at + end].decode("utf8")
+        return chain.split("\t") if chain != "" else []
+
+    def get_parent_classes(self, text):
+        '''
+        Returns the parent classes of the text, same as WordNet_Explorer(text).get_parent_classes()
+        '''
+        # wn.synsets lower cases the text too
+        key = text.lower().encode("utf8")
+        low = 0
+        high = self.no_of_words
+        while low < high:
+            mid = (low + high) // 2
+            if self.word(mid) < key:
+                low = mid + 1
+            else:
+                high = mid
+        if low < self.no_of_words and self.word(low) == key:
+            return self.chain(self.uint32(self.chain_nos_at, low))
+        return []
+
+def candidate_words(wn):
+    '''
+    Returns all the words for which wn.synsets can be non empty.
+    Any such word either is a lemma name, is in the morphy exceptions, or reduces to a lemma name by one of the morphy rules;
+    the last ones are generated by applying the rules backwards to each lemma name
+    '''
+    words = set()
+    for pos, substitutions in wn.MORPHOLOGICAL_SUBSTITUTIONS.items():
+        if pos not in wn._exception_map:
+            continue
+        words.update(wn._exception_map[pos])
+        for lemma in wn.all_lemma_names(pos):
+            words.add(lemma)
+            for old, new in substitutions:
+                if lemma.endswith(new):
+                    words.add(lemma[:len(lemma) - len(new)] + old)
+    return words
+
+def build(filepath, words=None):
+    '''
+    Builds the table with the parent classes as computed by WordNet_Explorer, for every word that has synsets
+    :param words: only these words, of those that have synsets (e.g. for a small table in the tests)
+    '''
+    from nltk.corpus import wordnet as wn
+    from wordnet_explorer import WordNet_Explorer
+
+    entries = {}
+    for word in candidate_words(wn) if words is None else candidate_words(wn) & set(words):
+        wn_e = WordNet_Explorer(word)
+        if len(wn_e.synsets) > 0:
+            entries[word.encode("utf8")] = "\t".join(wn_e.get_parent_classes()).encode("utf8")
+    log.info(f"Built the parent classes of {len(entries)} words")
+    write(filepath, entries)
+
+def write(filepath, entries):
+    '''
+    Writes the table
+    :param entries: dict of utf8 word -> utf8 tab separated parent classes
+    '''
+    words = sorted(entries)
+    chain_nos = {}
+    for word in words:
+        chain_nos.setdefault(entries[word], len(chain_nos))
+    chains = list(chain_nos)
+
+    def offsets(blobs):
+        offsets = [0]
+        for blob in blobs:
+            offsets.append(offsets[-1] + len(blob))
+        return offsets
+
+    with open(filepath, "wb") as fp:
+        fp.write(HEADER.pack(MAGIC, len(words), len(chains)))
+        fp.write(struct.pack(f"<{len(words) + 1}I", *offsets(words)))
+        fp.write(struct.pack(f"<{len(words)}I", *[chain_nos[entries[word]] for word in words]))
+        fp.write(struct.pack(f"<{len(chains) + 1}I", *offsets(chains)))
+        for word in words:
+            fp.write(word)
+        for chain in chains:
+            fp.write(chain)
+
+def check(filepath, texts):
+    '''
+    Compares the table with the NLTK path for the texts and returns the ones that differ
+    '''
+    from wordnet_explorer import WordNet_Explorer
+
+    table = WordNetTable(filepath)
+    return [text for text in texts if table.get_parent_classes(text) != WordNet_Explorer(text).get_parent_classes()]
+
+if __name__=="__main__":
+    if len(sys.argv) < 3 or sys.argv[1] not in ["build", "check"]:
+        print("Please provide params:\n1) build | check\n2) full filepath of the table\n3) if param1 is check - the words to check")
+        exit(0)
+    if sys.argv[1] == "build":
+        build(sys.argv[2])
+    else:
+        print(f"Differing: {check(sys.argv[2], sys.argv[3:])}")
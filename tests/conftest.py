@@ -0,0 +1,11 @@
+#----------------------------#
+# Author: Surjit Das
+# Email: surjitdas@gmail.com
+# Program: artmind
+#----------------------------#
+
+import os
+import sys
+
+# The modules of para2graph import each other by their plain names (import constants as C), as when run from within the folder
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "para2graph"))
@@ -0,0 +1,41 @@
+#----------------------------#
+# Author: Surjit Das
+# Email: surjitdas@gmail.com
+# Program: artmind
+#----------------------------#
+
+import pytest
+import constants as C
+from columnar_sink import ColumnarWriter
+
+'''
+Tests that what the ColumnarWriter writes in several row groups reads back as one dataset
+'''
+
+pa = pytest.importorskip("pyarrow")
+ds = pytest.importorskip("pyarrow.dataset")
+
+class Record:
+    def __init__(self, sentence_uuid, token_rows):
+        self.sentence_uuid = sentence_uuid
+        self.token_rows = token_rows
+        self.edge_rows = []
+
+def token_row(sentence_uuid, item, pos):
+    return (sentence_uuid, C.COL_TYPE_VAL_TOKEN, None, item, "nsubj", pos, "was", item.lower(), "2026-10-17 00:00:00")
+
+@pytest.mark.parametrize("file_format", [C.COLUMNAR_FORMAT_PARQUET, C.COLUMNAR_FORMAT_ARROW])
+def test_row_groups_with_different_strings_read_back(tmp_path, file_format):
+    writer = ColumnarWriter(str(tmp_path), file_format=file_format, row_group_size=2)
+    # each row group brings values which the ones before did not have, and the last one also repeats some of them
+    writer.add(Record("s1", [token_row("s1", "Akbar", C.POS_PROPER_NOUN), token_row("s1", "emperor", C.POS_NOUN)]))
+    writer.add(Record("s2", [token_row("s2", "Babur", C.POS_PROPER_NOUN), token_row("s2", "Panipat", None)]))
+    writer.add(Record("s3", [token_row("s3", "Akbar", C.POS_VERB)]))
+    writer.close()
+
+    dataset_format = "parquet" if file_format == C.COLUMNAR_FORMAT_PARQUET else "arrow"
+    table = ds.dataset(str(tmp_path / C.COLUMNAR_TOKENS), format=dataset_format, partitioning="hive").to_table()
+    rows = sorted(zip(table.column(C.COL_SENT_UUID).to_pylist(), table.column(C.COL_ITEM).to_pylist(),
+                        table.column(C.COL_TOKEN_POS).to_pylist()))
+    assert rows == [("s1", "Akbar", C.POS_PROPER_NOUN), ("s1", "emperor", C.POS_NOUN),
+                    ("s2", "Babur", C.POS_PROPER_NOUN), ("s2", "Panipat", None), ("s3", "Akbar", C.POS_VERB)]
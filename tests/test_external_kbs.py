@@ -0,0 +1,310 @@
+#----------------------------#
+# Author: Surjit Das
+# Email: surjitdas@gmail.com
+# Program: artmind
+#----------------------------#
+
+import json
+from datetime import datetime
+import re
+import sqlite3
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+import pytest
+import constants as C
+import external_kbs
+
+'''
+Tests of the batched wikidata lookups of the Explorer against a local stand-in of the wikidata search api & sparql endpoint
+(and of the wikifier, for the ext kb info). The stand-in answers from the dicts below and records the calls it gets
+'''
+
+ENTITIES = {"Britney Spears":"Q11975", "Paris":"Q90", "Lutetia":"Q90"} # search text -> entity id
+CLASSES = {"Q11975":{"human":["person", "organism"]}, "Q90":{"city":["human settlement"], "capital":["city"]}} # entity id -> {instance_of: [subclass_of]}
+
+class KBHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def reply(self, status, body):
+        data = json.dumps(body).encode("utf8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        search = parse_qs(url.query)["search"][0]
+        self.server.calls.append(("search", search))
+        entity_id = ENTITIES.get(search)
+        self.reply(200, {"search":[{"id":entity_id}] if entity_id is not None else []})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        form = parse_qs(self.rfile.read(int(self.headers["Content-Length"])).decode("utf8"))
+        if url.path == "/wikifier":
+            self.server.calls.append(("wikifier", form["text"][0]))
+            if self.server.fail_wikifier:
+                self.reply(500, {"error":"down"})
+                return
+            self.reply(200, {"annotations":[]})
+            return
+        entity_ids = re.findall(r"wd:(Q\d+)", form["query"][0])
+        self.server.calls.append(("sparql", entity_ids))
+        if self.server.fail_sparql:
+            self.reply(500, {"error":"down"})
+            return
+        bindings = []
+        for entity_id in entity_ids:
+            for instance_of, subclasses in CLASSES.get(entity_id, {}).items():
+                for subclass_of in subclasses:
+                    bindings.append({"item":{"value":f"http://www.wikidata.org/entity/{entity_id}"},
+                                        "instance_ofLabel":{"value":instance_of}, "subclass_ofLabel":{"value":subclass_of}})
+        self.reply(200, {"results":{"bindings":bindings}})
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), KBHandler)
+    server.calls = []
+    server.fail_sparql = False
+    server.fail_wikifier = False
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+@pytest.fixture
+def explorer(server, tmp_path, monkeypatch):
+    monkeypatch.setattr(C, "SQL_EXT_KB_DB", str(tmp_path / "kbs.db"))
+    monkeypatch.setattr(C, "CONCEPTNET_LOCAL_DB", str(tmp_path / "conceptnet.db"))
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    exp = external_kbs.Explorer(wikifier_url=f"{base_url}/wikifier", wikidata_api_url=f"{base_url}/w/api.php",
+                                wikidata_sparql_url=f"{base_url}/sparql", retries=0, rate_limits={}, refresh_in_background=False)
+    yield exp
+    exp.close()
+    exp.executor.shutdown()
+
+def test_get_wikidata_many_splits_the_values_results_per_item(explorer, server):
+    wd_dicts = explorer.get_wikidata_many(["Britney Spears", "Paris"])
+    assert wd_dicts["Britney Spears"] == {"human":["person", "organism"], C.COL_WDINSTANCE:["human"]}
+    assert wd_dicts["Paris"] == {"city":["human settlement"], "capital":["city"], C.COL_WDINSTANCE:["city", "capital"]}
+    # both entities in one query
+    assert [call for call in server.calls if call[0] == "sparql"] == [("sparql", ["Q11975", "Q90"])]
+
+def test_get_wikidata_many_shares_the_entity_of_texts(explorer, server):
+    wd_dicts = explorer.get_wikidata_many(["Paris", "Lutetia"])
+    assert wd_dicts["Paris"] == wd_dicts["Lutetia"]
+    assert [call for call in server.calls if call[0] == "sparql"] == [("sparql", ["Q90"])]
+
+def test_get_wikidata_many_unknown_entity(explorer, server):
+    wd_dicts = explorer.get_wikidata_many(["Nowhere", "Paris"])
+    assert wd_dicts["Nowhere"] == {C.COL_WDINSTANCE:["wd_UNKNOWN"]}
+    assert [call for call in server.calls if call[0] == "sparql"] == [("sparql", ["Q90"])]
+
+def test_get_wikidata_many_nothing_found_makes_no_sparql_call(explorer, server):
+    assert explorer.get_wikidata_many(["Nowhere"]) == {"Nowhere":{C.COL_WDINSTANCE:["wd_UNKNOWN"]}}
+    assert [call for call in server.calls if call[0] == "sparql"] == []
+
+def test_get_wikidata_many_failed_sparql_chunk(explorer, server):
+    server.fail_sparql = True
+    wd_dicts = explorer.get_wikidata_many(["Britney Spears", "Nowhere"])
+    assert wd_dicts["Britney Spears"] is None
+    # not found is not a failure
+    assert wd_dicts["Nowhere"] == {C.COL_WDINSTANCE:["wd_UNKNOWN"]}
+
+def test_failed_sparql_chunk_is_saved_as_negative_entry(explorer, server):
+    server.fail_sparql = True
+    kb_info = explorer.get_ext_kb_info("Britney Spears")
+    assert kb_info[C.COL_WDINSTANCE] == ["wd_UNKNOWN"]
+    saved_kb_info, source_ts, retry_at = explorer.read_ext_kb_info("Britney Spears")
+    assert saved_kb_info[C.COL_WDINSTANCE] == ["wd_UNKNOWN"]
+    # kept for the short negative ttl only, so that it gets retried
+    now = time.time()
+    assert C.KB_SOURCE_WIKIDATA not in explorer.stale_sources(saved_kb_info, source_ts, retry_at, now)
+    assert C.KB_SOURCE_WIKIDATA in explorer.stale_sources(saved_kb_info, source_ts, retry_at, now + C.KB_NEGATIVE_TTL[C.KB_SOURCE_WIKIDATA] + 1)
+
+NOWHERE = {C.COL_WIKIDATACLASS:["Nowhere class"], C.COL_DBPEDIA:["NowhereType"], C.COL_WDINSTANCE:["wd_UNKNOWN"], C.COL_CONCEPTNET:[]}
+
+def save_nowhere(explorer, wikifier_age):
+    now = time.time()
+    source_ts = {C.KB_SOURCE_WIKIFIER:now - wikifier_age, C.KB_SOURCE_WIKIDATA:now - C.KB_NEGATIVE_TTL[C.KB_SOURCE_WIKIDATA] - 60,
+                    C.KB_SOURCE_CONCEPTNET:now - 3600}
+    explorer.save_ext_kb_info("Nowhere", NOWHERE, source_ts)
+    explorer.cache = type(explorer.cache)(C.KB_CACHE_SIZE) # read back from the db
+    return source_ts
+
+def test_refresh_fetches_only_the_stale_sources(explorer, server):
+    source_ts = save_nowhere(explorer, wikifier_age=2 * 24 * 3600)
+    server.fail_wikifier = True
+    assert explorer.get_ext_kb_info("Nowhere") == NOWHERE
+    assert [call[0] for call in server.calls] == ["search"]
+    kb_info, refreshed_ts, retry_at = explorer.read_ext_kb_info("Nowhere")
+    assert kb_info == NOWHERE
+    assert refreshed_ts[C.KB_SOURCE_WIKIDATA] > source_ts[C.KB_SOURCE_WIKIDATA]
+    assert refreshed_ts[C.KB_SOURCE_WIKIFIER] == pytest.approx(source_ts[C.KB_SOURCE_WIKIFIER], abs=1)
+
+def test_failed_refresh_keeps_the_saved_info(explorer, server):
+    source_ts = save_nowhere(explorer, wikifier_age=C.KB_POSITIVE_TTL[C.KB_SOURCE_WIKIFIER] + 60)
+    server.fail_wikifier = True
+    assert explorer.get_ext_kb_info("Nowhere") == NOWHERE
+    assert ("wikifier", "Nowhere") in server.calls
+    kb_info, refreshed_ts, retry_at = explorer.read_ext_kb_info("Nowhere")
+    assert kb_info[C.COL_WIKIDATACLASS] == ["Nowhere class"]
+    assert kb_info[C.COL_DBPEDIA] == ["NowhereType"]
+    # the failed source keeps its ts, and is retried once its negative ttl has passed
+    assert refreshed_ts[C.KB_SOURCE_WIKIFIER] == pytest.approx(source_ts[C.KB_SOURCE_WIKIFIER], abs=1)
+    now = time.time()
+    assert explorer.stale_sources(kb_info, refreshed_ts, retry_at, now) == []
+    assert C.KB_SOURCE_WIKIFIER in explorer.stale_sources(kb_info, refreshed_ts, retry_at, now + C.KB_NEGATIVE_TTL[C.KB_SOURCE_WIKIFIER] + 1)
+
+def test_failed_refresh_is_not_retried_by_the_next_lookups(explorer, server):
+    save_nowhere(explorer, wikifier_age=C.KB_POSITIVE_TTL[C.KB_SOURCE_WIKIFIER] + 60)
+    server.fail_wikifier = True
+    for i in range(5):
+        assert explorer.get_ext_kb_info("Nowhere") == NOWHERE
+    assert server.calls.count(("wikifier", "Nowhere")) == 1
+    # nor after a restart, the retry ts is saved with the info
+    explorer.cache = type(explorer.cache)(C.KB_CACHE_SIZE)
+    assert explorer.get_ext_kb_info("Nowhere") == NOWHERE
+    assert server.calls.count(("wikifier", "Nowhere")) == 1
+
+def test_failed_conceptnet_is_fetched_again_after_its_retry_ttl(explorer, server, monkeypatch):
+    # the ConceptNet db of the fixture has no tables, the lookup raises
+    kb_info = explorer.get_ext_kb_info("Paris")
+    assert kb_info[C.COL_CONCEPTNET] == ["UNKNOWN"]
+    saved_kb_info, source_ts, retry_at = explorer.read_ext_kb_info("Paris")
+    now = time.time()
+    assert C.KB_SOURCE_CONCEPTNET not in explorer.stale_sources(saved_kb_info, source_ts, retry_at, now)
+    # unlike a not found, which ConceptNet keeps for good
+    assert C.KB_SOURCE_CONCEPTNET in explorer.stale_sources(saved_kb_info, source_ts, retry_at, now + 10 * 365 * 24 * 3600)
+
+    lookups = []
+    get_conceptnet_data_many = explorer.get_conceptnet_data_many
+    def counting_get_conceptnet_data_many(texts):
+        lookups.append(texts)
+        return get_conceptnet_data_many(texts)
+    monkeypatch.setattr(explorer, "get_conceptnet_data_many", counting_get_conceptnet_data_many)
+    explorer.get_ext_kb_info("Paris")
+    assert lookups == []
+    later = now + C.KB_RETRY_TTL[C.KB_SOURCE_CONCEPTNET] + 1
+    monkeypatch.setattr(external_kbs.time, "time", lambda: later)
+    explorer.get_ext_kb_info("Paris")
+    assert lookups == [["paris"]]
+
+# A small ConceptNet db with the tables of conceptnet_lite: language, label, concept, relation & edge
+LANGUAGES = [(1, "en"), (2, "fr")]
+LABELS = [(1, "dog", 1), (2, "animal", 1), (3, "pet", 1), (4, "animal", 2), (5, "chat", 2), (6, "cat", 1), (7, "mammal", 1), (8, "paris", 1)]
+CONCEPTS = [(1, 1, "n"), (2, 1, "v"), (3, 2, "n"), (4, 3, "n"), (5, 4, "n"), (6, 5, "n"), (7, 6, "n"), (8, 7, "n"), (9, 8, "n")] # id, label, sense
+RELATIONS = [(1, "is_a", 1), (2, "related_to", 0)]
+EDGES = [(1, 1, 1, 3), (2, 1, 2, 4), (3, 1, 1, 5), (4, 2, 1, 4), (5, 1, 3, 1), (6, 1, 6, 5), (7, 1, 7, 8), (8, 1, 7, 4), (9, 1, 7, 8)] # id, relation, start, end
+
+@pytest.fixture
+def conceptnet_db(tmp_path, monkeypatch):
+    path = tmp_path / "conceptnet.db"
+    db = sqlite3.connect(path)
+    db.execute("create table language (id integer primary key, name text)")
+    db.execute("create table label (id integer primary key, text text, language_id integer)")
+    db.execute("create table concept (id integer primary key, label_id integer, sense_label text)")
+    db.execute("create table relation (id integer primary key, name text, directed integer)")
+    db.execute("create table edge (id integer primary key, relation_id integer, start_id integer, end_id integer, etc text)")
+    db.executemany("insert into language values (?, ?)", LANGUAGES)
+    db.executemany("insert into label values (?, ?, ?)", LABELS)
+    db.executemany("insert into concept values (?, ?, ?)", CONCEPTS)
+    db.executemany("insert into relation values (?, ?, ?)", RELATIONS)
+    db.executemany("insert into edge values (?, ?, ?, ?, null)", EDGES)
+    db.commit()
+    db.close()
+    monkeypatch.setattr(C, "CONCEPTNET_LOCAL_DB", str(path))
+    monkeypatch.setattr(C, "SQL_EXT_KB_DB", str(tmp_path / "kbs.db"))
+    return path
+
+def orm_walk(text):
+    '''
+    What the conceptnet_lite ORM walk did: the edges_for the concepts of the english label of the text, in the same language,
+    kept if is_a and starting from the text
+    '''
+    languages = dict(LANGUAGES)
+    labels = {label_id:(label_text, languages[language_id]) for label_id, label_text, language_id in LABELS}
+    concepts = {concept_id:labels[label_id] for concept_id, label_id, sense in CONCEPTS}
+    relations = {relation_id:name for relation_id, name, directed in RELATIONS}
+    label_ids = [label_id for label_id, (label_text, language) in labels.items() if label_text == text and language == "en"]
+    if len(label_ids) == 0:
+        return ["UNKNOWN"]
+    text_concepts = [concept_id for concept_id, label_id, sense in CONCEPTS if label_id == label_ids[0]]
+    targets = []
+    for edge_id, relation_id, start, end in EDGES:
+        if not (start in text_concepts or end in text_concepts) or concepts[start][1] != concepts[end][1]:
+            continue
+        if relations[relation_id] == "is_a" and concepts[start][0] == text:
+            targets.append(concepts[end][0])
+    return targets
+
+def test_conceptnet_lookup_matches_the_orm_walk(conceptnet_db):
+    exp = external_kbs.Explorer(rate_limits={}, offline=True)
+    texts = ["dog", "animal", "chat", "cat", "paris", "nowhere", "dog"]
+    expected = {text:orm_walk(text) for text in texts}
+    # the cross language & the related_to edges are left out, a text without any english label is UNKNOWN
+    assert expected["dog"] == ["animal", "pet"]
+    assert expected["chat"] == ["UNKNOWN"]
+    assert expected["paris"] == []
+    for chunk_size in [1, 2, C.CONCEPTNET_BATCH_SIZE]:
+        assert exp.get_conceptnet_data_many(texts, chunk_size=chunk_size) == expected
+    exp.executor.shutdown()
+
+def test_conceptnet_lookup_leaves_the_db_as_is(conceptnet_db):
+    exp = external_kbs.Explorer(rate_limits={}, offline=True)
+    exp.get_conceptnet_data("dog")
+    db = sqlite3.connect(conceptnet_db)
+    assert db.execute("select name from sqlite_master where type = 'index'").fetchall() == []
+    external_kbs.index_conceptnet(str(conceptnet_db))
+    assert db.execute("select name from sqlite_master where type = 'index'").fetchall() == [("idx_edge_start_relation",)]
+    db.close()
+    exp.executor.shutdown()
+
+def test_rows_without_the_source_ts_columns(server, tmp_path, monkeypatch):
+    db_path = tmp_path / "old.db"
+    db = sqlite3.connect(db_path)
+    db.execute(f"create table {C.TAB_EXT_KBS} ({', '.join([C.COL_ITEM] + C.COLUMNS_KBS_SOURCES + [C.COL_TS])})")
+    db.execute(f"insert into {C.TAB_EXT_KBS} values (?, ?, ?, ?, ?, ?)", ["Paris", "['city']", "['capital']", "['City']", "[]", "2020-01-01 00:00:00"])
+    db.commit()
+    db.close()
+    monkeypatch.setattr(C, "SQL_EXT_KB_DB", str(db_path))
+    exp = external_kbs.Explorer(rate_limits={}, offline=True)
+    kb_info, source_ts, retry_at = exp.read_ext_kb_info("Paris")
+    assert kb_info[C.COL_WDINSTANCE] == ["city"]
+    assert set(source_ts.values()) == {datetime(2020, 1, 1).timestamp()}
+    exp.executor.shutdown()
+
+def test_offline_lookups_not_in_the_db_are_counted(explorer, server):
+    explorer.offline = True
+    assert explorer.get_ext_kb_info("Paris") == C.KB_FAILED_VALUES
+    assert explorer.offline_misses == 1
+    assert server.calls == []
+
+def test_get_wikidata_many_chunks_the_sparql_queries(explorer, server, monkeypatch):
+    texts = [f"entity {i}" for i in range(7)]
+    for i, text in enumerate(texts):
+        monkeypatch.setitem(ENTITIES, text, f"Q{1000 + i}")
+        monkeypatch.setitem(CLASSES, f"Q{1000 + i}", {f"class {i}":[f"parent {i}"]})
+    wd_dicts = explorer.get_wikidata_many(texts, chunk_size=3)
+    sparql_calls = [call[1] for call in server.calls if call[0] == "sparql"]
+    assert [len(entity_ids) for entity_ids in sparql_calls] == [3, 3, 1]
+    assert sorted(sum(sparql_calls, [])) == sorted(ENTITIES[text] for text in texts)
+    assert all(wd_dicts[text] == {f"class {i}":[f"parent {i}"], C.COL_WDINSTANCE:[f"class {i}"]} for i, text in enumerate(texts))
+
+def test_get_wikidata_many_default_chunk_size(explorer, server, monkeypatch):
+    texts = [f"entity {i}" for i in range(C.WIKIDATA_SPARQL_BATCH_SIZE + 1)]
+    for i, text in enumerate(texts):
+        monkeypatch.setitem(ENTITIES, text, f"Q{1000 + i}")
+    explorer.get_wikidata_many(texts)
+    assert [len(call[1]) for call in server.calls if call[0] == "sparql"] == [C.WIKIDATA_SPARQL_BATCH_SIZE, 1]
+
+def test_explorer_db_is_shared_in_wal_mode(explorer):
+    # the pipeline workers save to the db the writer commits to
+    assert explorer.db.execute("pragma journal_mode").fetchone()[0] == "wal"
+    assert explorer.db.execute("pragma busy_timeout").fetchone()[0] == C.SQL_BUSY_TIMEOUT * 1000
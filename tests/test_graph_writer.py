@@ -0,0 +1,110 @@
+#----------------------------#
+# Author: Surjit Das
+# Email: surjitdas@gmail.com
+# Program: artmind
+#----------------------------#
+
+import re
+import pytest
+import constants as C
+import graph_writer
+from graph_writer import NetworkXGraphWriter, Neo4jGraphWriter, EdgeRow
+
+'''
+Tests that the networkx sink saves what the ingest journal records, so that a resumed run continues from it,
+and that the neo4j writer does not lose edges to stale cached node ids (against a stand-in of the py2neo Graph)
+'''
+
+def edge_row(head, tail):
+    return EdgeRow(C.NOUN, {C.N4J_NODE_NAME:head}, {}, C.WORDNET, {C.CLASSIFICATION:None}, C.WORDNET, {C.N4J_NODE_NAME:tail}, {})
+
+def test_save_keeps_the_graph_for_a_resumed_run(tmp_path):
+    pytest.importorskip("networkx")
+    filepath = str(tmp_path / "graph.graphml")
+    writer = NetworkXGraphWriter(filepath)
+    writer.auto_flush = False
+    writer.add([edge_row("emperor", "ruler")])
+    writer.flush()
+    # a flush only adds to the graph in memory
+    assert not (tmp_path / "graph.graphml").exists()
+    writer.save()
+    # no close(), as after a crash - a resumed run continues from the graph of the last save
+    resumed = NetworkXGraphWriter(filepath, append=True)
+    assert resumed.G.number_of_edges() == 1
+    assert resumed.G.has_node(f"{C.WORDNET}:ruler")
+
+def test_close_saves_the_graph(tmp_path):
+    pytest.importorskip("networkx")
+    filepath = str(tmp_path / "graph.graphml")
+    writer = NetworkXGraphWriter(filepath)
+    writer.add([edge_row("emperor", "ruler")])
+    writer.flush()
+    assert not (tmp_path / "graph.graphml").exists()
+    writer.close()
+    assert NetworkXGraphWriter(filepath, append=True).G.number_of_edges() == 1
+
+class FakeGraph:
+    """
+    Stands in for the py2neo Graph. Runs the UNWIND queries of the Neo4jGraphWriter row by row:
+    MATCHes a node on its id, MERGEs it on its label & name, and returns the records of the rows written
+    """
+    def __init__(self):
+        self.nodes = {} # id -> (label, name)
+        self.edges = []
+        self.next_id = 1000
+
+    def merge(self, label, name):
+        for node_id, node in self.nodes.items():
+            if node == (label, name):
+                return node_id
+        node_id = self.next_id
+        self.next_id += 1
+        self.nodes[node_id] = (label, name)
+        return node_id
+
+    def run(self, query, rows=None, **params):
+        records = []
+        for row in rows or []:
+            record = {"i":row["i"]}
+            nodes = {}
+            for var in ["h", "t"]:
+                if f"WHERE id({var}) = row.{var}_id" in query:
+                    nodes[var] = row[f"{var}_id"] if row[f"{var}_id"] in self.nodes else None
+                else:
+                    label = re.search(rf"MERGE \({var}:`([^`]*)`", query).group(1)
+                    nodes[var] = self.merge(label, row[f"{var}_key"][C.N4J_NODE_NAME])
+                    record.update({f"{var}_name":row[f"{var}_key"][C.N4J_NODE_NAME], f"{var}_id":nodes[var]})
+            if None not in nodes.values():
+                self.edges.append((nodes["h"], nodes["t"]))
+                records.append(record)
+        return Cursor(records)
+
+    def begin(self):
+        return self
+
+    def commit(self, tx):
+        pass
+
+class Cursor:
+    def __init__(self, records):
+        self.records = records
+
+    def data(self):
+        return self.records
+
+def test_stale_cached_node_id_is_evicted_and_the_edge_written(monkeypatch):
+    monkeypatch.setattr(graph_writer, "NODE_IDS", graph_writer.LRUCache(10))
+    graph = FakeGraph()
+    writer = Neo4jGraphWriter(graph)
+    writer.add([edge_row("emperor", "ruler")])
+    writer.flush()
+    emperor_id = graph_writer.NODE_IDS.get((C.NOUN, "emperor"))
+    assert graph.nodes[emperor_id] == (C.NOUN, "emperor")
+    # the node gets deleted, e.g. by another client, while its id is cached
+    del graph.nodes[emperor_id]
+    writer.add([edge_row("emperor", "king")])
+    writer.flush()
+    assert len(graph.edges) == 2
+    new_id = graph_writer.NODE_IDS.get((C.NOUN, "emperor"))
+    assert new_id != emperor_id and graph.nodes[new_id] == (C.NOUN, "emperor")
+    assert graph.edges[-1] == (new_id, graph_writer.NODE_IDS.get((C.WORDNET, "king")))
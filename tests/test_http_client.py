@@ -0,0 +1,65 @@
+#----------------------------#
+# Author: Surjit Das
+# Email: surjitdas@gmail.com
+# Program: artmind
+#----------------------------#
+
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+import requests
+from http_client import make_session, RateLimiter, per_process_rate_limits
+
+class Handler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        self.server.calls.append(self.path)
+        if self.path == "/hang":
+            time.sleep(2)
+            return
+        status = 503 if self.path == "/down" else 200
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.calls = []
+    server.url = f"http://127.0.0.1:{server.server_address[1]}"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def test_read_timeout_is_not_retried(server):
+    session = make_session(pool_size=2, retries=3, backoff=0.01)
+    start = time.monotonic()
+    with pytest.raises(requests.exceptions.RequestException):
+        session.post(f"{server.url}/hang", data={"q":"x"}, timeout=0.3)
+    assert time.monotonic() - start < 1
+    assert server.calls == ["/hang"]
+
+def test_unavailable_is_retried(server):
+    session = make_session(pool_size=2, retries=3, backoff=0.01)
+    response = session.post(f"{server.url}/down", data={"q":"x"}, timeout=1)
+    assert response.status_code == 503
+    assert server.calls == ["/down"] * 4
+
+def test_rate_limiter_spaces_the_calls():
+    limiter = RateLimiter(20)
+    start = time.monotonic()
+    for i in range(5):
+        limiter.wait()
+    assert time.monotonic() - start >= 0.19
+    unlimited = RateLimiter(None)
+    start = time.monotonic()
+    for i in range(100):
+        unlimited.wait()
+    assert time.monotonic() - start < 0.1
+
+def test_per_process_rate_limits_share_the_rates():
+    assert per_process_rate_limits({"wikifier":10, "wikidata":5, "conceptnet":None}, 4) == {"wikifier":2.5, "wikidata":1.25, "conceptnet":None}
@@ -0,0 +1,83 @@
+#----------------------------#
+# Author: Surjit Das
+# Email: surjitdas@gmail.com
+# Program: artmind
+#----------------------------#
+
+import queue
+import pytest
+import pipeline
+
+'''
+Tests of the feed & write stages of the pipeline, without worker processes - the batches the workers would put on the
+record queue are put there by the tests
+'''
+
+class FakeTP:
+    def __init__(self):
+        self.apostrophe_reparses_avoided = 0
+        self.written = []
+        self.checkpoints = []
+        self.flushes = 0
+
+    def flush_on_checkpoint_only(self):
+        pass
+
+    def write(self, record):
+        self.written.append(record)
+
+    def checkpoint(self, journal, byte_offset, records):
+        self.checkpoints.append(byte_offset)
+
+    def flush(self, journal=None):
+        self.flushes += 1
+
+class AliveProcess:
+    def is_alive(self):
+        return True
+
+def failing_lines():
+    yield ("a", 1)
+    yield ("b", 2)
+    yield ("c", 3)
+    raise EOFError("Compressed file ended before the end-of-stream marker was reached")
+
+def test_feed_reports_a_read_error_and_stops_the_workers():
+    text_q = queue.Queue()
+    errors = []
+    pipeline.feed(failing_lines(), text_q, workers=2, batch_size=2, errors=errors)
+    items = [text_q.get_nowait() for i in range(text_q.qsize())]
+    # the unfinished batch (c) is dropped, so nothing after the last full batch is taken as done
+    assert items == [(0, [("a", 1), ("b", 2)]), None, None]
+    assert len(errors) == 1 and isinstance(errors[0], EOFError)
+
+def test_feed_without_errors():
+    text_q = queue.Queue()
+    errors = []
+    pipeline.feed([("a", 1), ("b", 2), ("c", 3)], text_q, workers=1, batch_size=2, errors=errors)
+    assert [text_q.get_nowait() for i in range(text_q.qsize())] == [(0, [("a", 1), ("b", 2)]), (1, [("c", 3)]), None]
+    assert errors == []
+
+def done():
+    return {"apostrophe_reparses_avoided":0, "metrics":{"histograms":{}, "counters":{}}}
+
+def test_write_checkpoints_the_batches_in_order():
+    record_q = queue.Queue()
+    for item in [(1, 20, ["r1"], None), (0, 10, ["r0"], None), done()]:
+        record_q.put(item)
+    tp = FakeTP()
+    pipeline.write(tp, record_q, [AliveProcess()], journal=object())
+    assert tp.written == ["r0", "r1"]
+    assert tp.checkpoints == [10, 20]
+
+def test_write_stops_at_a_failed_batch():
+    record_q = queue.Queue()
+    for item in [(0, 10, ["r0"], None), (2, 30, ["r2"], None), (1, 20, [], "Traceback: parse failed"), done()]:
+        record_q.put(item)
+    tp = FakeTP()
+    with pytest.raises(RuntimeError, match="Batch 1 failed"):
+        pipeline.write(tp, record_q, [AliveProcess()], journal=object())
+    # batch 0 is written & checkpointed, the failed batch & the ones after it are not
+    assert tp.written == ["r0"]
+    assert tp.checkpoints == [10]
+    assert tp.flushes == 1
@@ -0,0 +1,138 @@
+#----------------------------#
+# Author: Surjit Das
+# Email: surjitdas@gmail.com
+# Program: artmind
+#----------------------------#
+
+import pytest
+import constants as C
+from textprocessor import TextProcessor
+from graph_writer import NetworkXGraphWriter, EdgeRow
+from p2g_dataclasses import SentenceRecord, IngestJournal, PhraseNode, PhraseEdge, NERNode, NounNode, AdjNode, VerbNode, PhraseInfoEdge
+import random
+
+'''
+Tests of the TextProcessor steps that do not need the nlp model
+'''
+
+def record(i):
+    sentence_uuid = f"s{i}"
+    token_rows = [(sentence_uuid, C.COL_TYPE_VAL_TOKEN, None, f"word{i}", "nsubj", C.POS_NOUN, "was", f"word{i}", "2026-10-17 00:00:00")]
+    edge_rows = [EdgeRow(C.NOUN, {C.N4J_NODE_NAME:f"word{i}"}, {}, "-", {}, C.WORDNET, {C.N4J_NODE_NAME:"entity"}, {})]
+    return SentenceRecord(sentence_uuid, token_rows, edge_rows)
+
+@pytest.fixture
+def networkx_tp(tmp_path, monkeypatch):
+    pytest.importorskip("networkx")
+    monkeypatch.setattr(C, "SQL_LOCAL_DB", str(tmp_path / "local.db"))
+    monkeypatch.setattr(C, "GRAPHML_SAVE_INTERVAL", 5)
+    tp = TextProcessor("truncate", extract=False, sink=C.GRAPH_SINK_NETWORKX, graphml_path=str(tmp_path / "graph.graphml"))
+    yield tp
+    tp.db.close()
+
+def test_networkx_sink_moves_the_journal_at_the_graph_saves_only(networkx_tp, tmp_path):
+    tp = networkx_tp
+    journal = IngestJournal(tp.db, str(tmp_path / "input.txt"))
+    tp.flush_on_checkpoint_only()
+    for i in range(7):
+        tp.write(record(i))
+        tp.checkpoint(journal, (i + 1) * 10, [record(i)])
+    # one save, after the 5th sentence - the db & the journal stop there too, so that a resumed run redoes exactly the rest
+    assert journal.last_offset() == 50
+    assert tp.db.execute(f"select count(*) from {C.TAB_SENTENCES}").fetchone()[0] == 5
+    assert NetworkXGraphWriter(tp.graph_writer.filepath, append=True).G.number_of_edges() == 5
+    tp.flush(journal)
+    assert journal.last_offset() == 70
+    assert NetworkXGraphWriter(tp.graph_writer.filepath, append=True).G.number_of_edges() == 7
+
+def test_columnar_part_files_are_complete_at_each_journal_checkpoint(tmp_path, monkeypatch):
+    ds = pytest.importorskip("pyarrow.dataset")
+    monkeypatch.setattr(C, "SQL_LOCAL_DB", str(tmp_path / "local.db"))
+    monkeypatch.setattr(C, "COLUMNAR_SAVE_INTERVAL", 5)
+    columnar = tmp_path / "columnar"
+    tp = TextProcessor("truncate", extract=False, sink=C.GRAPH_SINK_NETWORKX, graphml_path=None, columnar=str(columnar))
+    journal = IngestJournal(tp.db, str(tmp_path / "input.txt"))
+    tp.flush_on_checkpoint_only()
+    for i in range(7):
+        tp.write(record(i))
+        tp.checkpoint(journal, (i + 1) * 10, [record(i)])
+    # the rows up to the checkpoint are in complete part files, the rest is redone by a resumed run
+    assert journal.last_offset() == 50
+    tokens = ds.dataset(str(columnar / C.COLUMNAR_TOKENS), format="parquet", partitioning="hive").to_table()
+    assert sorted(tokens.column(C.COL_SENT_UUID).to_pylist()) == [f"s{i}" for i in range(5)]
+    tp.db.close()
+
+def nested_loops_phrase_3plets(ners, deduped_nouns, adjs, verbs, ph_3plets):
+    '''
+    construct_phrase_3plets as it was, with a list scan per phrase & a substring search per term
+    '''
+    phrases = []
+    for triplet in ph_3plets:
+        if triplet.head not in phrases:
+            phrases.append(triplet.head)
+        if triplet.tail not in phrases:
+            phrases.append(triplet.tail)
+    ner_pos_3plets = []
+    for phrase in phrases:
+        for ner in ners:
+            if ner[0] in phrase.phrase:
+                ner_pos_3plets.append(PhraseInfoEdge(phrase, NERNode(ner[0], ner[1])))
+        for noun in deduped_nouns:
+            if noun.lower() in phrase.phrase.lower():
+                ner_pos_3plets.append(PhraseInfoEdge(phrase, NounNode(noun)))
+        for adj in adjs:
+            if adj.lower() in phrase.phrase.lower():
+                ner_pos_3plets.append(PhraseInfoEdge(phrase, AdjNode(adj)))
+        for verb in verbs:
+            if verb.lower() in phrase.phrase.lower():
+                ner_pos_3plets.append(PhraseInfoEdge(phrase, VerbNode(verb)))
+    return ner_pos_3plets
+
+def as_compared(ner_pos_3plets):
+    # the classification of the phrase too, which tells which of the equal phrase nodes was kept
+    return [(repr(edge.head), repr(edge.tail)) for edge in ner_pos_3plets]
+
+def phrase_triplets(phrases):
+    nodes = [PhraseNode("s1", phrase, classification) for phrase, classification in phrases]
+    return [PhraseEdge(head, "-", tail, "s1") for head, tail in zip(nodes, nodes[1:])]
+
+@pytest.fixture
+def extract_tp():
+    return TextProcessor(extract=False, write=False)
+
+def test_phrase_3plets_overlapping_and_repeated_terms(extract_tp):
+    # the phrases repeat (with another classification), the terms overlap, repeat, differ in case & are empty
+    ph_3plets = phrase_triplets([("New York City", C.SUBJECT), ("visited the new city", C.OBJECT), ("New York City", C.OBJECT),
+                                    ("York", C.ATTRIBUTE), ("", C.ACTIVITY)])
+    ners = [["New York", "GPE"], ["York", "GPE"], ["New York City", "GPE"], ["York", "PERSON"]]
+    nouns = ["city", "City", "york", "ork", "cit"]
+    adjs = ["new", "New", ""]
+    verbs = ["visit", "visited", "isit"]
+    args = (ners, nouns, adjs, verbs, ph_3plets)
+    expected = nested_loops_phrase_3plets(*args)
+    assert as_compared(extract_tp.construct_phrase_3plets(*args)) == as_compared(expected)
+
+def test_phrase_3plets_match_the_nested_loops_on_random_inputs(extract_tp):
+    rnd = random.Random(21)
+    def text(max_len):
+        return "".join(rnd.choice("abAB ") for i in range(rnd.randint(0, max_len)))
+    for trial in range(300):
+        ph_3plets = phrase_triplets([(text(12), rnd.choice([C.SUBJECT, C.OBJECT])) for i in range(rnd.randint(1, 6))])
+        args = ([[text(3), rnd.choice(["GPE", "ORG"])] for i in range(rnd.randint(0, 4))],
+                [text(3) for i in range(rnd.randint(0, 4))], [text(2) for i in range(rnd.randint(0, 3))], [text(3) for i in range(rnd.randint(0, 3))],
+                ph_3plets)
+        assert as_compared(extract_tp.construct_phrase_3plets(*args)) == as_compared(nested_loops_phrase_3plets(*args))
+
+def test_apostrophes_are_rewritten_with_a_single_reparse(extract_tp):
+    spacy = pytest.importorskip("spacy")
+    from spacy.tokens import Doc
+    nlp = spacy.blank("en")
+    reparsed = []
+    extract_tp.nlp = lambda sentence: reparsed.append(sentence) or nlp(sentence)
+    doc = Doc(nlp.vocab, words=["Akbar", "'s", "son", "met", "the", "emperors", "'", "army"],
+                pos=["PROPN", "PART", "NOUN", "VERB", "DET", "NOUN", "PART", "NOUN"],
+                deps=["poss", "case", "nsubj", "ROOT", "det", "poss", "case", "dobj"])
+    before = extract_tp.apostrophe_reparses_avoided
+    assert extract_tp.preprocess_sentence_for_apostrophe(doc).text == "son of Akbar met the army of emperors"
+    assert reparsed == ["son of Akbar met the army of emperors"]
+    assert extract_tp.apostrophe_reparses_avoided == before + 2
@@ -0,0 +1,54 @@
+#----------------------------#
+# Author: Surjit Das
+# Email: surjitdas@gmail.com
+# Program: artmind
+#----------------------------#
+
+import pytest
+import wordnet_table
+
+def test_table_round_trip(tmp_path):
+    filepath = tmp_path / "wordnet.table"
+    wordnet_table.write(filepath, {"dog".encode("utf8"):"canine\tcarnivore".encode("utf8"), "cat".encode("utf8"):"feline\tcarnivore".encode("utf8"),
+                                    "wolf".encode("utf8"):"canine\tcarnivore".encode("utf8"), "café".encode("utf8"):"restaurant".encode("utf8"),
+                                    "entity".encode("utf8"):b""})
+    table = wordnet_table.WordNetTable(filepath)
+    assert table.no_of_words == 5
+    assert table.no_of_chains == 4 # dog & wolf share theirs
+    assert table.get_parent_classes("dog") == ["canine", "carnivore"]
+    assert table.get_parent_classes("Wolf") == ["canine", "carnivore"]
+    assert table.get_parent_classes("café") == ["restaurant"]
+    assert table.get_parent_classes("entity") == []
+    assert table.get_parent_classes("unicorn") == []
+    assert table.get_parent_classes("") == []
+
+def test_not_a_table(tmp_path):
+    filepath = tmp_path / "not.table"
+    filepath.write_bytes(b"\0" * 64)
+    with pytest.raises(ValueError):
+        wordnet_table.WordNetTable(filepath)
+
+# Lemma names, inflections the morphy rules reduce, morphy exceptions, multi word lemmas, words which only have a
+# derivationally related form with hypernyms, mixed case & words without synsets
+WORDS = ["dog", "dogs", "Dog", "DOGS", "mice", "geese", "children", "ran", "running", "was", "better", "best", "happy", "happier",
+            "quickly", "beautiful", "new_york", "New_York", "new york", "years", "analyses", "entity", "xyzzy", "qwertyuiop", "", "the", "of"]
+
+def test_table_is_the_same_as_nltk(tmp_path):
+    nltk = pytest.importorskip("nltk")
+    try:
+        nltk.data.find("corpora/wordnet")
+    except LookupError:
+        pytest.skip("the NLTK WordNet corpus is not installed")
+    from nltk.corpus import wordnet as wn
+    from wordnet_explorer import WordNet_Explorer
+
+    # every word with synsets is one the full build would put in the table
+    candidates = wordnet_table.candidate_words(wn)
+    assert [word for word in WORDS if len(wn.synsets(word)) > 0 and word.lower() not in candidates] == []
+
+    filepath = tmp_path / "wordnet.table"
+    wordnet_table.build(filepath, [word.lower() for word in WORDS])
+    table = wordnet_table.WordNetTable(filepath)
+    for word in WORDS:
+        assert table.get_parent_classes(word) == WordNet_Explorer(word).get_parent_classes(), word
+    assert wordnet_table.check(filepath, WORDS) == []